@@ -58,6 +58,46 @@ description:
     (i.e. C(| match), C(| count), etc.) with the CLI commands executed by this
     module.
 options:
+  backoff:
+    description:
+      - The factor by which the I(interval) is multiplied after each attempt
+        to meet the I(wait_for) conditions. The default of C(1) polls at a
+        constant interval.
+    required: false
+    default: 1
+    type: float
+  cache_dir:
+    description:
+      - The path to a directory, on the Ansible control machine, where the
+        output of the CLI commands is cached. When this option is specified,
+        the output of a command is reused, rather than executing the command
+        on the Junos device again, if the same command with the same format
+        was executed on the same host within the last I(cache_ttl) seconds.
+      - Only use this option for commands which do not change the state of
+        the Junos device, such as C(show) commands.
+      - The directory is created if it does not exist. The directory may be
+        shared by all target hosts and by both the C(juniper_junos_command)
+        and C(juniper_junos_rpc) modules.
+    required: false
+    default: none
+    type: path
+  cache_size:
+    description:
+      - The maximum number of entries kept in the I(cache_dir) directory.
+        When this number is exceeded, the least recently used entries are
+        removed. Must be at least 1.
+      - Only applies when the I(cache_dir) option is specified.
+    required: false
+    default: 256
+    type: int
+  cache_ttl:
+    description:
+      - The number of seconds a cached command output remains valid.
+        Must be at least 1.
+      - Only applies when the I(cache_dir) option is specified.
+    required: false
+    default: 60
+    type: int
   commands:
     description:
       - A list of one or more CLI commands to execute on the Junos device.
@@ -69,6 +109,64 @@ options:
       - command
       - cmd
       - cmds
+  compression:
+    description:
+      - Compress the outputs saved with the I(dest) or I(dest_dir) options.
+        With the I(dest_dir) option, the file names end in C(.gz) or C(.zst).
+        With the I(dest) option, the file name is not changed.
+      - The C(zstd) compression requires the zstandard Python library on the
+        Ansible control machine.
+    required: false
+    default: none
+    choices:
+      - none
+      - gzip
+      - zstd
+    type: str
+  content_addressed:
+    description:
+      - When C(true), each output saved with the I(dest_dir) option is
+        stored once, no matter how many hosts or runs produce it, in the
+        C(objects/<xx>/<sha256>) file of the I(dest_dir) directory. The file
+        is named by the SHA-256 digest of the output, with a C(.gz) or
+        C(.zst) suffix if it is compressed.
+      - Instead of the C(<hostname>_<command>.<format>) file, the
+        C(<hostname>.manifest.json) file of the I(dest_dir) directory then
+        maps that file name to the object's path, relative to the
+        I(dest_dir) directory, the object's I(sha256) digest, and the
+        output's uncompressed I(size).
+      - Requires the I(dest_dir) option.
+    required: false
+    default: false
+    type: bool
+  deadline:
+    description:
+      - The maximum number of seconds the module may take. The time is
+        measured from the start of the module, including the time spent
+        opening the connection to the Junos device.
+      - The timeout of each command is limited to the time remaining before
+        the deadline. When the deadline expires, the remaining commands are
+        not executed. Each of them is returned as failed with a
+        I(deadline_exceeded) key, and the results of the commands already
+        executed are still returned.
+    required: false
+    default: none
+    type: int
+  detect_changes:
+    description:
+      - When C(true), a normalized digest of each command output is compared to
+        the digest saved when the output was last written to the
+        I(dest_dir) directory. An unchanged output is not rewritten, and the
+        I(changed) value of its result is C(false). A new or different
+        output is written, and its I(changed) value is C(true).
+      - The digests are saved per host, in the C(.<hostname>.hashes.json)
+        file of the I(dest_dir) directory. Volatile parts of the outputs,
+        such as timestamps and counters, can be excluded from the digests
+        with the I(ignore_xpaths) and I(ignore_patterns) options.
+      - Requires the I(dest_dir) option.
+    required: false
+    default: false
+    type: bool
   dest:
     description:
       - The path to a file, on the Ansible control machine, where the output of
@@ -110,6 +208,17 @@ options:
     aliases:
       - destination_dir
       - destdir
+  fail_fast:
+    description:
+      - Indicates if the remaining commands should be skipped once the
+        connection to the Junos device is lost. When C(true), and the
+        connection cannot be reopened (see the I(reconnect_attempts) option),
+        the remaining commands are returned as failed with a
+        I(connection_lost) key instead of each one failing after its own
+        timeout.
+    required: false
+    default: false
+    type: bool
   formats:
     description:
       - The format of the reply for the CLI command(s) specified by the
@@ -134,6 +243,124 @@ options:
       - format
       - display
       - output
+  ignore_patterns:
+    description:
+      - A list of regular expressions. Every match of each expression is
+        removed from an output before its digest is computed, so changes
+        which only affect the matched text are not detected. Applies to
+        every format. For the xml format, the expressions are applied to
+        the canonical XML text, after the I(ignore_xpaths) option.
+      - Only used when the I(detect_changes) option is C(true).
+    required: false
+    default: none
+    type: list
+  ignore_xpaths:
+    description:
+      - A list of XPath expressions. The elements, attributes, and text
+        selected by each expression are removed from an xml format output
+        before its digest is computed. Ignored for other formats. For
+        example, C(//@junos:seconds) or C(//last-flapped).
+      - Only used when the I(detect_changes) option is C(true).
+    required: false
+    default: none
+    type: list
+  interval:
+    description:
+      - The number of seconds to wait between attempts to meet the
+        I(wait_for) conditions. Fractions of a second are allowed.
+    required: false
+    default: 1
+    type: float
+  match:
+    description:
+      - Indicates if all of the I(wait_for) conditions, or any one of them,
+        must be met.
+    required: false
+    default: all
+    type: str
+    choices:
+      - all
+      - any
+  retries:
+    description:
+      - The maximum number of times each command is executed while waiting
+        for the I(wait_for) conditions to be met.
+    required: false
+    default: 10
+    type: int
+  templates:
+    description:
+      - The path to a TextFSM template, on the Ansible control machine, used
+        to parse the text output of the CLI command(s) into a list of
+        records. Each record is a dictionary whose keys are the C(Value)
+        names defined in the template. The records are returned in the
+        I(parsed_output) key.
+      - The value of this option can either be a single template, or a list of
+        templates. If a single template is specified, it applies to all
+        command(s) specified by the I(commands) option. If a list of templates
+        is specified, there must be one value in the list for each command
+        specified by the I(commands) option. An empty string in the list means
+        the output of the corresponding command is not parsed.
+      - Templates may only be applied to commands whose format is C(text).
+        Each template is compiled once per task and reused for all of the
+        task's commands.
+      - Requires the U(TextFSM|https://github.com/google/textfsm) library.
+    required: false
+    default: none
+    type: path or list of path
+    aliases:
+      - template
+  select:
+    description:
+      - A dictionary which maps names to XPath expressions. When specified,
+        only the values selected by the XPath expressions are converted and
+        returned in the I(parsed_output) key, as a dictionary with the same
+        names. The I(stdout) and I(stdout_lines) keys are not returned.
+      - An expression which selects nodes returns a list with one value per
+        node. The value is the text of a leaf element, or the dictionary form
+        of an element with children. Expressions which return a string,
+        number or boolean (e.g. C(count(...))) return that value.
+      - The value of this option can either be a single dictionary, or a list
+        of dictionaries. If a single dictionary is specified, it applies to
+        all command(s) specified by the I(commands) option. If a list is
+        specified, there must be one dictionary in the list for each command
+        specified by the I(commands) option.
+      - May only be applied to commands whose format is C(xml). Each XPath
+        expression is compiled once and reused for all commands.
+    required: false
+    default: none
+    type: dict or list of dict
+  json_output:
+    description:
+      - Controls which keys are returned for commands whose format is C(json).
+      - C(both) returns the reply as JSON text in the I(stdout) and
+        I(stdout_lines) keys, and as a JSON data structure in the
+        I(parsed_output) key.
+      - C(raw) returns only the I(stdout) and I(stdout_lines) keys.
+      - C(parsed) returns only the I(parsed_output) key. In this case the
+        reply is only encoded as JSON text if it is saved with the I(dest)
+        or I(dest_dir) options.
+      - The reply is decoded from JSON once, by PyEZ, and encoded as JSON text
+        at most once.
+    required: false
+    default: both
+    type: str
+    choices:
+      - both
+      - raw
+      - parsed
+  reconnect_attempts:
+    description:
+      - The maximum number of attempts, for the whole task, to reopen the
+        connection to the Junos device after a command fails because the
+        connection was lost. When the connection is reopened, the failed
+        command is retried once, and the remaining commands are executed on the
+        new connection.
+      - Only use a non-zero value for commands which can safely be executed
+        again.
+    required: false
+    default: 0
+    type: int
   return_output:
     description:
       - Indicates if the output of the command should be returned in the
@@ -144,6 +371,66 @@ options:
     required: false
     default: true
     type: bool
+  timeouts:
+    description:
+      - The number of seconds to wait for the reply of each command, in place
+        of the device-wide I(timeout) option. The value of this option can
+        either be a single timeout, or a list of timeouts. If a single
+        timeout is specified, it applies to all commands specified by the
+        I(commands) option. If a list of timeouts is specified, there must be one
+        value in the list for each command specified by the I(commands) option.
+    required: false
+    default: none
+    type: int or list of int
+  translate_to_rpc:
+    description:
+      - Indicates if each CLI command should be executed as its equivalent
+        NETCONF RPC rather than with the C(<command>) RPC. The equivalent RPC
+        is found once, by executing the command with C(| display xml rpc),
+        and the RPC is then executed directly. This avoids CLI parsing and
+        translation on the Junos device for every execution, and the
+        reply has the same structure as the reply of the
+        C(juniper_junos_rpc) module.
+      - The translations are keyed by the model and Junos version of the
+        device. When the I(translations_dir) option is specified, they are
+        saved in that directory and reused by later tasks against any device
+        with the same model and version.
+      - Commands which have no equivalent RPC are executed with the
+        C(<command>) RPC.
+    required: false
+    default: false
+    type: bool
+  translations_dir:
+    description:
+      - A directory on the Ansible control machine where the CLI-to-RPC
+        translations of the I(translate_to_rpc) option are saved, one file
+        per device model and Junos version. The directory may be shared by
+        all hosts and tasks. Translations are never evicted or expired.
+      - Unlike the I(cache_dir) option, this option does not cache the
+        outputs of the commands.
+    required: false
+    default: none
+    type: path
+  wait_for:
+    description:
+      - One or more conditions which the reply of each command must meet.
+        The command is executed again, on the same connection, until the
+        conditions are met or the I(retries) are exhausted. If the conditions
+        are never met, the command fails and the I(failed_conditions) key
+        lists the conditions which were not met.
+      - For the C(xml) format, each condition is an XPath expression
+        evaluated against the reply. The condition is met if the expression
+        selects at least one node, or returns true, a non-zero number, or a
+        non-empty string. For the C(text) format, each condition is a
+        regular expression which must match the reply. The C(json) format is
+        not supported.
+      - Polling stops when the I(deadline) option expires. Mutually exclusive
+        with the I(cache_dir) option.
+    required: false
+    default: none
+    type: str or list of str
+    aliases:
+      - waitfor
 '''
 
 EXAMPLES = '''
@@ -213,6 +500,38 @@ EXAMPLES = '''
           - "show lldp neighbors"
         dest: "/tmp/{{ inventory_hostname }}.commands.output"
 
+    - name: Parse "show interfaces terse" into a list of records
+      juniper_junos_command:
+        command: "show interfaces terse"
+        template: "templates/show_interfaces_terse.textfsm"
+      register: response
+
+    - name: Return only the BGP peer states from "show bgp summary"
+      juniper_junos_command:
+        command: "show bgp summary"
+        format: xml
+        select:
+          peers: "//bgp-peer/peer-address"
+          states: "//bgp-peer/peer-state"
+          down: "number(//down-peer-count)"
+      register: response
+
+    - name: Reuse the output of "show version" for five minutes
+      juniper_junos_command:
+        command: "show version"
+        format: xml
+        cache_dir: "/tmp/junos_cache"
+        cache_ttl: 300
+      register: response
+
+    - name: Execute "show interfaces terse" as its equivalent RPC
+      juniper_junos_command:
+        command: "show interfaces terse"
+        format: xml
+        translate_to_rpc: true
+        translations_dir: "/tmp/junos_translations"
+      register: response
+
     - name: Multiple commands, save outputs, but don't return them
       juniper_junos_command:
         commands:
@@ -223,9 +542,64 @@ EXAMPLES = '''
           - "json"
         dest_dir: "/tmp/outputs/"
         return_output: false
+
+    - name: Wait up to a minute for all BGP peers to be Established
+      juniper_junos_command:
+        command: "show bgp summary"
+        format: xml
+        wait_for: "not(//bgp-peer[peer-state != 'Established'])"
+        retries: 12
+        interval: 5
+      register: response
+
+    - name: Save outputs only when they change, ignoring flap times.
+      juniper_junos_command:
+        commands:
+          - "show interfaces"
+          - "show version"
+        format: xml
+        dest_dir: "./output"
+        detect_changes: true
+        ignore_xpaths:
+          - "//interface-flapped"
+          - "//@junos:seconds"
+      register: response
+
+    - name: Archive outputs compressed, storing identical outputs once.
+      juniper_junos_command:
+        commands:
+          - "show version"
+          - "show chassis hardware"
+        dest_dir: "/var/archive/outputs"
+        compression: gzip
+        content_addressed: true
 '''
 
 RETURN = '''
+attempts:
+  description:
+    - The number of times the command was executed while waiting for the
+      I(wait_for) conditions.
+  returned: when the I(wait_for) option is specified.
+  type: int
+cache_hit:
+  description:
+    - Indicates if the command output was retrieved from the cache rather
+      than from the Junos device.
+  returned: when the I(cache_dir) option is specified.
+  type: bool
+cache_hits:
+  description:
+    - The number of commands whose output was retrieved from the cache.
+  returned: when the I(cache_dir) option is specified and the I(commands)
+            option is a list value.
+  type: int
+cache_misses:
+  description:
+    - The number of commands whose output was not found in the cache.
+  returned: when the I(cache_dir) option is specified and the I(commands)
+            option is a list value.
+  type: int
 changed:
   description:
     - Indicates if the device's state has changed. Since this module does not
@@ -236,6 +610,10 @@ changed:
       C(clear ospf neighbors). Beware, this module is unable to detect
       this situation, and will still return the value C(false) for I(changed)
       in this case.
+    - When the I(detect_changes) option is C(true), indicates if the command
+      output differs from the output last saved in the I(dest_dir)
+      directory. For a list of commands, the top-level value is C(true) if
+      any command output changed.
   returned: success
   type: bool
   sample: false
@@ -244,12 +622,33 @@ command:
     - The CLI command which was executed.
   returned: always
   type: str
+connection_lost:
+  description:
+    - Indicates that the command was not executed because the connection to
+      the Junos device was lost and the I(fail_fast) option is C(true).
+  returned: when the command was not executed because the connection was lost.
+  type: bool
+deadline_exceeded:
+  description:
+    - Indicates that the command was not executed because the deadline
+      specified by the I(deadline) option expired. When the I(commands) option is
+      a list value, the top-level key indicates if any command was not
+      executed.
+  returned: when the command was not executed, and at the top-level when the
+            I(deadline) option is specified and the I(commands) option is a
+            list value.
+  type: bool
 failed:
   description:
     - Indicates if the task failed. See the I(results) key for additional
       details.
   returned: always
   type: bool
+failed_conditions:
+  description:
+    - The I(wait_for) conditions which were not met by the last reply.
+  returned: when the I(wait_for) conditions were not met.
+  type: list of str
 format:
   description:
     - The format of the command response.
@@ -263,16 +662,29 @@ msg:
 parsed_output:
   description:
     - The command reply from the Junos device parsed into a JSON data structure.
-      For XML replies, the response is parsed into JSON using the
-      U(jxmlease|https://github.com/Juniper/jxmlease)
-      library. For JSON the response is parsed using the Python
-      U(json|https://docs.python.org/2/library/json.html) library.
-    - When Ansible converts the jxmlease or native Python data structure
+      For XML replies, the response is parsed into JSON by a converter which
+      walks the lxml tree. Each element becomes a key named by its tag,
+      without any namespace. An element without child elements becomes its
+      stripped text, and child elements which share a tag become a list.
+      Element attributes are not included. For JSON the response is parsed using the Python
+      U(json|https://docs.python.org/2/library/json.html) library. For text
+      replies parsed with a template from the I(templates) option, this is
+      a list of dictionaries. One dictionary per record. When the I(select)
+      option is specified, this is a dictionary of the selected values.
+    - When Ansible converts the native Python data structure
       into JSON, it does not guarantee that the order of dictionary/object keys
       are maintained.
   returned: when command executed successfully, I(return_output) is true,
-            and the value of the I(formats) option is C(xml) or C(json).
-  type: dict
+            and the value of the I(formats) option is C(xml) or C(json), or a
+            template is specified by the I(templates) option.
+  type: dict or list of dict
+reconnects:
+  description:
+    - The number of attempts made to reopen the connection to the Junos
+      device.
+  returned: when the I(reconnect_attempts) option is greater than zero and
+            the I(commands) option is a list value.
+  type: int
 results:
   description:
     - The other keys are returned when a single command is specified for the
@@ -288,15 +700,24 @@ results:
       results of individual commands.
   returned: when the I(commands) option is a list value.
   type: list of dict
+rpc:
+  description:
+    - The name of the RPC which was executed in place of the command.
+  returned: when the I(translate_to_rpc) option is C(true) and the command
+            has an equivalent RPC.
+  type: str
 stdout:
   description:
     - The command reply from the Junos device as a single multi-line string.
-  returned: when command executed successfully and I(return_output) is C(true).
+    - For JSON replies, this is the reply encoded as compact JSON text.
+  returned: when command executed successfully, I(return_output) is C(true),
+            and the I(select) option is not specified.
   type: str
 stdout_lines:
   description:
     - The command reply from the Junos device as a list of single-line strings.
-  returned: when command executed successfully and I(return_output) is C(true).
+  returned: when command executed successfully, I(return_output) is C(true),
+            and the I(select) option is not specified.
   type: list of str
 '''
 
@@ -312,6 +733,131 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils import juniper_junos_common
 
 
+def execute_command(junos_module, command, format, result, select=None,
+                    timeout=None):
+    """Execute command on the Junos device and return its output.
+
+    Args:
+        junos_module: The JuniperJunosModule instance.
+        command: The CLI command to execute.
+        format: The format of the command reply.
+        result: The result dict for the command. The 'msg' key is updated.
+        select: A dict of names and XPath expressions, or None. If
+                specified, only the selected values of an XML reply are
+                converted and returned as the parsed output.
+        timeout: The timeout, in seconds, for the command, or None to use the
+                 device timeout.
+
+    Returns:
+        A tuple containing the text output and the parsed output, or None if
+        the command failed.
+    """
+    # Execute the CLI command
+    try:
+        junos_module.logger.debug('Executing command "%s".',
+                                  command)
+        rpc = None
+        if junos_module.params.get('translate_to_rpc') is True:
+            rpc = junos_module.get_rpc_translation(command)
+        if rpc is not None:
+            # Issue the equivalent RPC directly.
+            rpc.set('format', format)
+            result['rpc'] = rpc.tag
+            junos_module.logger.debug('Command "%s" translated to RPC "%s".',
+                                      command, rpc.tag)
+        else:
+            rpc = junos_module.etree.Element('command', format=format)
+            rpc.text = command
+        rpc_args = {'normalize': bool(format == 'xml')}
+        if timeout is not None:
+            rpc_args['dev_timeout'] = timeout
+        resp = junos_module.dev.rpc(rpc, **rpc_args)
+        result['msg'] = 'The command executed successfully.'
+        junos_module.logger.debug('Command "%s" executed successfully.',
+                                  command)
+    except (junos_module.pyez_exception.ConnectError,
+            junos_module.pyez_exception.RpcError) as ex:
+        if isinstance(ex, junos_module.pyez_exception.ConnectError):
+            junos_module.connection_lost = True
+        junos_module.logger.debug('Unable to execute "%s". Error: %s',
+                                  command, str(ex))
+        result['msg'] = 'Unable to execute the command: %s. Error: %s' % \
+                        (command, str(ex))
+        return None
+
+    text_output = None
+    parsed_output = None
+    if resp is True:
+        text_output = ''
+    elif (resp, junos_module.etree._Element):
+        # Handle the output based on format
+        if format == 'text':
+            if resp.tag in ['output', 'rpc-reply']:
+                text_output = resp.text
+                junos_module.logger.debug('Text output set.')
+            elif resp.tag == 'configuration-information':
+                text_output = resp.findtext('configuration-output')
+                junos_module.logger.debug('Text configuration output set.')
+            elif 'rpc' in result:
+                # The text reply of a translated command may be wrapped in
+                # any element, e.g. <configuration-text>.
+                text_output = ''.join(resp.itertext())
+                junos_module.logger.debug('Text output of <%s> set.',
+                                          resp.tag)
+            else:
+                result['msg'] = 'Unexpected text response tag: %s.' % (
+                                (resp.tag))
+                junos_module.logger.debug('Unexpected text response tag '
+                                          '%s.', resp.tag)
+                return None
+        elif format == 'xml':
+            encode = None if sys.version < '3' else 'unicode'
+            if select is not None:
+                # Only the selected nodes are converted. The full reply is
+                # only serialized if it must be saved.
+                parsed_output = juniper_junos_common.select_from_xml(resp,
+                                                                     select)
+                if (junos_module.params.get('dest') is not None or
+                        junos_module.params.get('dest_dir') is not None):
+                    text_output = junos_module.etree.tostring(
+                                      resp,
+                                      pretty_print=True,
+                                      encoding=encode)
+                junos_module.logger.debug('Selected XML output set.')
+            else:
+                text_output = junos_module.etree.tostring(resp,
+                                                          pretty_print=True,
+                                                          encoding=encode)
+                parsed_output = juniper_junos_common.xml_to_dict(resp)
+                junos_module.logger.debug('XML output set.')
+        elif format == 'json':
+            # PyEZ has already decoded the JSON reply. The JSON text is only
+            # encoded when it is needed. See
+            # JuniperJunosModule.json_output_text().
+            parsed_output = resp
+            junos_module.logger.debug('JSON output set.')
+        else:
+            result['msg'] = 'Unexpected format %s.' % (format)
+            junos_module.logger.debug('Unexpected format %s.', format)
+            return None
+    else:
+        result['msg'] = 'Unexpected response type %s.' % (type(resp))
+        junos_module.logger.debug('Unexpected response type %s.',
+                                  type(resp))
+        return None
+    # Check the wait_for conditions. See JuniperJunosModule.wait_for().
+    if junos_module.params.get('wait_for') is not None:
+        reply = resp if format == 'xml' else text_output
+        if resp is True:
+            reply = None
+        result['failed_conditions'] = juniper_junos_common.failed_conditions(
+                                          junos_module.params.get('wait_for'),
+                                          junos_module.params.get('match'),
+                                          format,
+                                          reply)
+    return (text_output, parsed_output)
+
+
 def main():
     # Create the module instance.
     junos_module = juniper_junos_common.JuniperJunosModule(
@@ -332,9 +878,81 @@ def main():
                           type='path',
                           aliases=['destination_dir', 'destdir'],
                           default=None),
+            templates=dict(required=False,
+                           type='list',
+                           aliases=['template'],
+                           default=None),
+            select=dict(required=False,
+                        type='str',
+                        default=None),
+            translate_to_rpc=dict(required=False,
+                                  type='bool',
+                                  default=False),
+            translations_dir=dict(required=False,
+                                  type='path',
+                                  default=None),
             return_output=dict(required=False,
                                type='bool',
-                               default=True)
+                               default=True),
+            json_output=dict(required=False,
+                             choices=['both', 'raw', 'parsed'],
+                             type='str',
+                             default='both'),
+            cache_dir=dict(required=False,
+                           type='path',
+                           default=None),
+            cache_ttl=dict(required=False,
+                           type='int',
+                           default=60),
+            cache_size=dict(required=False,
+                            type='int',
+                            default=256),
+            timeouts=dict(required=False,
+                          type='list',
+                          default=None),
+            deadline=dict(required=False,
+                          type='int',
+                          default=None),
+            fail_fast=dict(required=False,
+                           type='bool',
+                           default=False),
+            reconnect_attempts=dict(required=False,
+                                    type='int',
+                                    default=0),
+            wait_for=dict(required=False,
+                          type='list',
+                          aliases=['waitfor'],
+                          default=None),
+            match=dict(required=False,
+                       choices=['all', 'any'],
+                       type='str',
+                       default='all'),
+            retries=dict(required=False,
+                         type='int',
+                         default=10),
+            interval=dict(required=False,
+                          type='float',
+                          default=1),
+            backoff=dict(required=False,
+                         type='float',
+                         default=1),
+            detect_changes=dict(required=False,
+                                type='bool',
+                                default=False),
+            ignore_xpaths=dict(required=False,
+                               type='list',
+                               default=None),
+            ignore_patterns=dict(required=False,
+                                 type='list',
+                                 default=None),
+            compression=dict(
+                required=False,
+                choices=juniper_junos_common.OUTPUT_COMPRESSION_CHOICES,
+                type='str',
+                default='none'),
+            content_addressed=dict(required=False,
+                                   type='bool',
+                                   default=False)
         ),
         # Since this module doesn't change the device's configuration, there is
         # no additional work required to support check mode. It's inherently
@@ -342,7 +960,7 @@ def main():
         # command executed. See the I(changed) key in the RETURN documentation
         # for more details.
         supports_check_mode=True,
-        min_jxmlease_version=juniper_junos_common.MIN_JXMLEASE_VERSION,
+        mutually_exclusive=[['wait_for', 'cache_dir']],
     )
 
     # Check over commands
@@ -398,8 +1016,57 @@ def main():
     elif len(formats) == 1 and len(commands) > 1:
         formats = formats * len(commands)
 
+    # Check over templates
+    templates = junos_module.params.get('templates')
+    if templates is None:
+        templates = [None] * len(commands)
+    else:
+        junos_module.check_textfsm(juniper_junos_common.MIN_TEXTFSM_VERSION)
+        # Correct number of template values?
+        if len(templates) != 1 and len(templates) != len(commands):
+            junos_module.fail_json(msg="The templates option must have a "
+                                       "single value, or one value per "
+                                       "command. There are %d commands and "
+                                       "%d templates." %
+                                       (len(commands), len(templates)))
+        # Same template for all commands
+        elif len(templates) == 1 and len(commands) > 1:
+            templates = templates * len(commands)
+        for (command, format, template) in zip(commands, formats, templates):
+            if template and format != 'text':
+                junos_module.fail_json(msg="A template can only be applied "
+                                           "to a command with the text "
+                                           "format. The format of the "
+                                           "command (%s) is %s." %
+                                           (command, format))
+
+    # Check over select
+    selects = junos_module.parse_select_option(len(commands))
+    for (command, format, select) in zip(commands, formats, selects):
+        if select is not None and format != 'xml':
+            junos_module.fail_json(msg="The select option can only be "
+                                       "applied to a command with the xml "
+                                       "format. The format of the command "
+                                       "(%s) is %s." % (command, format))
+
+    # Check over timeouts
+    timeouts = junos_module.parse_timeouts_option(len(commands))
+
+    # Check over wait_for
+    junos_module.parse_wait_for_option(formats)
+
+    # Check over detect_changes
+    junos_module.parse_detect_changes_option()
+
+    # Check over compression and content_addressed
+    junos_module.parse_storage_options()
+
+    # Whether the text of a reply is kept, to be saved.
+    keep_text = bool(junos_module.params.get('dest') is not None or
+                     junos_module.params.get('dest_dir') is not None)
     results = list()
-    for (command, format) in zip(commands, formats):
+    for (command, format, template, select, timeout) in \
+            zip(commands, formats, templates, selects, timeouts):
         # Set initial result values. Assume failure until we know it's success.
         result = {'msg': '',
                   'command': command,
@@ -407,77 +1074,83 @@ def main():
                   'changed': False,
                   'failed': True}
 
-        # Execute the CLI command
-        try:
-            junos_module.logger.debug('Executing command "%s".',
-                                      command)
-            rpc = junos_module.etree.Element('command', format=format)
-            rpc.text = command
-            resp = junos_module.dev.rpc(rpc, normalize=bool(format == 'xml'))
-            result['msg'] = 'The command executed successfully.'
-            junos_module.logger.debug('Command "%s" executed successfully.',
-                                      command)
-        except (junos_module.pyez_exception.ConnectError,
-                junos_module.pyez_exception.RpcError) as ex:
-            junos_module.logger.debug('Unable to execute "%s". Error: %s',
-                                      command, str(ex))
-            result['msg'] = 'Unable to execute the command: %s. Error: %s' % \
-                            (command, str(ex))
-            results.append(result)
-            continue
-
-        text_output = None
-        parsed_output = None
-        if resp is True:
-            text_output = ''
-        elif (resp, junos_module.etree._Element):
-            # Handle the output based on format
-            if format == 'text':
-                if resp.tag in ['output', 'rpc-reply']:
-                    text_output = resp.text
-                    junos_module.logger.debug('Text output set.')
-                elif resp.tag == 'configuration-information':
-                    text_output = resp.findtext('configuration-output')
-                    junos_module.logger.debug('Text configuration output set.')
-                else:
-                    result['msg'] = 'Unexpected text response tag: %s.' % (
-                                    (resp.tag))
-                    results.append(result)
-                    junos_module.logger.debug('Unexpected text response tag '
-                                              '%s.', resp.tag)
-                    continue
-            elif format == 'xml':
-                encode = None if sys.version < '3' else 'unicode'
-                text_output = junos_module.etree.tostring(resp,
-                                                          pretty_print=True,
-                                                          encoding=encode)
-                parsed_output = junos_module.jxmlease.parse_etree(resp)
-                junos_module.logger.debug('XML output set.')
-            elif format == 'json':
-                text_output = str(resp)
-                parsed_output = resp
-                junos_module.logger.debug('JSON output set.')
-            else:
-                result['msg'] = 'Unexpected format %s.' % (format)
+        # Try the cache before executing the command. Selected replies are
+        # only kept as text if they are saved, so that is part of the key.
+        cache_key = ['command', command, format, select, keep_text,
+                     junos_module.params.get('translate_to_rpc')]
+        output = junos_module.get_cached_output(cache_key)
+        cache_hit = bool(output is not None)
+        if cache_hit is True:
+            result['msg'] = 'The command output was retrieved from the cache.'
+        else:
+            timeout = junos_module.call_timeout(timeout)
+            if timeout == 0:
+                result['msg'] = 'The command was not executed. The deadline ' \
+                                'of %d seconds expired.' % \
+                                (junos_module.params.get('deadline'))
+                result['deadline_exceeded'] = True
                 results.append(result)
-                junos_module.logger.debug('Unexpected format %s.', format)
                 continue
-        else:
-            result['msg'] = 'Unexpected response type %s.' % (type(resp))
-            results.append(result)
-            junos_module.logger.debug('Unexpected response type %s.',
-                                      type(resp))
-            continue
+            # Don't wait for another failure on a lost connection.
+            if (junos_module.reconnect() is False and
+                    junos_module.params.get('fail_fast') is True):
+                result['msg'] = 'The command was not executed. The ' \
+                                'connection to the device was lost.'
+                result['connection_lost'] = True
+                results.append(result)
+                continue
+            output = junos_module.wait_for(result, timeout, execute_command,
+                                           junos_module, command, format,
+                                           result, select)
+            # Retry once if the lost connection can be reopened.
+            if (output is None and junos_module.connection_lost is True and
+                    junos_module.reconnect() is True):
+                output = junos_module.wait_for(result, timeout,
+                                               execute_command, junos_module,
+                                               command, format, result,
+                                               select)
+            if output is None:
+                results.append(result)
+                continue
+            junos_module.set_cached_output(cache_key, *output)
+        if junos_module.params.get('cache_dir') is not None:
+            result['cache_hit'] = cache_hit
+        (text_output, parsed_output) = output
+
+        # Parse the text output with the template.
+        if template:
+            try:
+                parsed_output = juniper_junos_common.parse_text_output(
+                                    template, text_output)
+                junos_module.logger.debug('Output of "%s" parsed with the '
+                                          '%s template.', command, template)
+            except (IOError, OSError,
+                    junos_module.textfsm.TextFSMError,
+                    junos_module.textfsm.TextFSMTemplateError) as ex:
+                result['msg'] = 'Unable to parse the output of the command: ' \
+                                '%s with the template: %s. Error: %s' % \
+                                (command, template, str(ex))
+                results.append(result)
+                continue
+
+        text_output = junos_module.json_output_text(format, text_output,
+                                                    parsed_output)
 
         # Set the output keys
         if junos_module.params['return_output'] is True:
-            if text_output is not None:
+            if (text_output is not None and select is None and
+                    (format != 'json' or
+                     junos_module.params.get('json_output') != 'parsed')):
                 result['stdout'] = text_output
                 result['stdout_lines'] = text_output.splitlines()
-            if parsed_output is not None:
+            if (parsed_output is not None and
+                    (format != 'json' or
+                     junos_module.params.get('json_output') != 'raw')):
                 result['parsed_output'] = parsed_output
         # Save the output
-        junos_module.save_text_output(command, format, text_output)
+        saved = junos_module.save_text_output(command, format, text_output)
+        if junos_module.params.get('detect_changes') is True:
+            result['changed'] = saved is True
         # This command succeeded.
         result['failed'] = False
         # Append to the list of results
@@ -493,9 +1166,23 @@ def main():
             if result.get('failed') is False:
                 failed = False
                 break
+        summary = {}
+        if junos_module.params.get('cache_dir') is not None:
+            hits = len([result for result in results
+                        if result.get('cache_hit') is True])
+            summary['cache_hits'] = hits
+            summary['cache_misses'] = len(results) - hits
+        if junos_module.params.get('deadline') is not None:
+            summary['deadline_exceeded'] = any(
+                result.get('deadline_exceeded') is True
+                for result in results)
+        if junos_module.params.get('reconnect_attempts') > 0:
+            summary['reconnects'] = junos_module.reconnects
+        changed = any(result.get('changed') is True for result in results)
         junos_module.exit_json(results=results,
-                               changed=False,
-                               failed=failed)
+                               changed=changed,
+                               failed=failed,
+                               **summary)
 
 
 if __name__ == '__main__':
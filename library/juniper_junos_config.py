@@ -686,10 +686,11 @@ config_lines:
 config_parsed:
   description:
     - The retrieved configuration parsed into a JSON datastructure.
-      For XML replies, the response is parsed into JSON using the
-      jxmlease library. For JSON the response is parsed using the
-      Python json library.
-    - When Ansible converts the jxmlease or native Python data
+      For XML replies, the response is parsed into JSON by a converter
+      which walks the lxml tree. The data structure is the same one
+      produced by the jxmlease library. For JSON the response is parsed
+      using the Python json library.
+    - When Ansible converts the native Python data
       structure into JSON, it does not guarantee that the order of
       dictionary/object keys are maintained.
   returned: when I(retrieved) is not C(none), the I(format) option is C(xml) or
@@ -850,7 +851,6 @@ def main():
         required_together=[['template', 'vars']],
         # Check mode is implemented.
         supports_check_mode=True,
-        min_jxmlease_version=juniper_junos_common.MIN_JXMLEASE_VERSION,
     )
     # Do additional argument verification.
 
@@ -295,7 +295,6 @@ def main():
         # no additional work required to support check mode. It's inherently
         # supported.
         supports_check_mode=True,
-        min_jxmlease_version=juniper_junos_common.MIN_JXMLEASE_VERSION,
     )
 
     junos_module.logger.debug("Gathering facts.")
@@ -35,7 +35,7 @@
 #
 
 from __future__ import absolute_import, division, print_function
-from six import iteritems
+from six import iteritems, itervalues
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
                     'supported_by': 'community',
@@ -57,6 +57,47 @@ description:
     C(show version | display xml rpc) reveals the equivalent RPC name is
     C(get-software-information).
 options:
+  backoff:
+    description:
+      - The factor by which the I(interval) is multiplied after each attempt
+        to meet the I(wait_for) conditions. The default of C(1) polls at a
+        constant interval.
+    required: false
+    default: 1
+    type: float
+  cache_dir:
+    description:
+      - The path to a directory, on the Ansible control machine, where the
+        output of the RPCs is cached. When this option is specified, the
+        output of an RPC is reused, rather than executing the RPC on the Junos
+        device again, if the same RPC with the same format, kwargs, attrs and
+        filter was executed on the same host within the last I(cache_ttl)
+        seconds.
+      - Only use this option for RPCs which do not change the state of
+        the Junos device, such as C(get-*-information) RPCs.
+      - The directory is created if it does not exist. The directory may be
+        shared by all target hosts and by both the C(juniper_junos_command)
+        and C(juniper_junos_rpc) modules.
+    required: false
+    default: none
+    type: path
+  cache_size:
+    description:
+      - The maximum number of entries kept in the I(cache_dir) directory.
+        When this number is exceeded, the least recently used entries are
+        removed. Must be at least 1.
+      - Only applies when the I(cache_dir) option is specified.
+    required: false
+    default: 256
+    type: int
+  cache_ttl:
+    description:
+      - The number of seconds a cached RPC output remains valid.
+        Must be at least 1.
+      - Only applies when the I(cache_dir) option is specified.
+    required: false
+    default: 60
+    type: int
   attrs:
     description:
       - The attributes and values to the RPCs specified by the
@@ -71,6 +112,66 @@ options:
     type: dict or list of dict
     aliases:
       - attr
+  compression:
+    description:
+      - Compress the outputs saved with the I(dest) or I(dest_dir) options.
+        With the I(dest_dir) option, the file names end in C(.gz) or C(.zst).
+        With the I(dest) option, the file name is not changed.
+      - The C(zstd) compression requires the zstandard Python library on the
+        Ansible control machine.
+    required: false
+    default: none
+    choices:
+      - none
+      - gzip
+      - zstd
+    type: str
+  content_addressed:
+    description:
+      - When C(true), each output saved with the I(dest_dir) option is
+        stored once, no matter how many hosts or runs produce it, in the
+        C(objects/<xx>/<sha256>) file of the I(dest_dir) directory. The file
+        is named by the SHA-256 digest of the output, with a C(.gz) or
+        C(.zst) suffix if it is compressed.
+      - Instead of the C(<hostname>_<rpc>.<format>) file, the
+        C(<hostname>.manifest.json) file of the I(dest_dir) directory then
+        maps that file name to the object's path, relative to the
+        I(dest_dir) directory, the object's I(sha256) digest, and the
+        output's uncompressed I(size).
+      - Requires the I(dest_dir) option. Can not be combined with the
+        I(samples) or I(stream_records) options.
+    required: false
+    default: false
+    type: bool
+  deadline:
+    description:
+      - The maximum number of seconds the module may take. The time is
+        measured from the start of the module, including the time spent
+        opening the connection to the Junos device.
+      - The timeout of each RPC is limited to the time remaining before
+        the deadline. When the deadline expires, the remaining RPCs are
+        not executed. Each of them is returned as failed with a
+        I(deadline_exceeded) key, and the results of the RPCs already
+        executed are still returned.
+    required: false
+    default: none
+    type: int
+  detect_changes:
+    description:
+      - When C(true), a normalized digest of each RPC output is compared to
+        the digest saved when the output was last written to the
+        I(dest_dir) directory. An unchanged output is not rewritten, and the
+        I(changed) value of its result is C(false). A new or different
+        output is written, and its I(changed) value is C(true).
+      - The digests are saved per host, in the C(.<hostname>.hashes.json)
+        file of the I(dest_dir) directory. Volatile parts of the outputs,
+        such as timestamps and counters, can be excluded from the digests
+        with the I(ignore_xpaths) and I(ignore_patterns) options.
+      - Requires the I(dest_dir) option. Can not be combined with the
+        I(samples) or I(stream_records) options.
+    required: false
+    default: false
+    type: bool
   dest:
     description:
       - The path to a file, on the Ansible control machine, where the output of
@@ -124,6 +225,17 @@ options:
     type: str
     aliases:
       - filter_xml
+  fail_fast:
+    description:
+      - Indicates if the remaining RPCs should be skipped once the
+        connection to the Junos device is lost. When C(true), and the
+        connection cannot be reopened (see the I(reconnect_attempts) option),
+        the remaining RPCs are returned as failed with a
+        I(connection_lost) key instead of each one failing after its own
+        timeout.
+    required: false
+    default: false
+    type: bool
   formats:
     description:
       - The format of the reply for the RPCs specified by the
@@ -146,6 +258,53 @@ options:
       - format
       - display
       - output
+  ignore_patterns:
+    description:
+      - A list of regular expressions. Every match of each expression is
+        removed from an output before its digest is computed, so changes
+        which only affect the matched text are not detected. Applies to
+        every format. For the xml format, the expressions are applied to
+        the canonical XML text, after the I(ignore_xpaths) option.
+      - Only used when the I(detect_changes) option is C(true).
+    required: false
+    default: none
+    type: list
+  ignore_xpaths:
+    description:
+      - A list of XPath expressions. The elements, attributes, and text
+        selected by each expression are removed from an xml format output
+        before its digest is computed. Ignored for other formats. For
+        example, C(//@junos:seconds) or C(//last-flapped).
+      - Only used when the I(detect_changes) option is C(true).
+    required: false
+    default: none
+    type: list
+  interval:
+    description:
+      - The number of seconds to wait between attempts to meet the
+        I(wait_for) conditions. Fractions of a second are allowed.
+    required: false
+    default: 1
+    type: float
+  json_output:
+    description:
+      - Controls which keys are returned for RPCs whose format is C(json).
+      - C(both) returns the reply as JSON text in the I(stdout) and
+        I(stdout_lines) keys, and as a JSON data structure in the
+        I(parsed_output) key.
+      - C(raw) returns only the I(stdout) and I(stdout_lines) keys.
+      - C(parsed) returns only the I(parsed_output) key. In this case the
+        reply is only encoded as JSON text if it is saved with the I(dest)
+        or I(dest_dir) options.
+      - The reply is decoded from JSON once, by PyEZ, and encoded as JSON text
+        at most once.
+    required: false
+    default: both
+    type: str
+    choices:
+      - both
+      - raw
+      - parsed
   kwargs:
     description:
       - The keyword arguments and values to the RPCs specified by the
@@ -164,6 +323,35 @@ options:
       - kwarg
       - args
       - arg
+  match:
+    description:
+      - Indicates if all of the I(wait_for) conditions, or any one of them,
+        must be met.
+    required: false
+    default: all
+    type: str
+    choices:
+      - all
+      - any
+  reconnect_attempts:
+    description:
+      - The maximum number of attempts, for the whole task, to reopen the
+        connection to the Junos device after an RPC fails because the
+        connection was lost. When the connection is reopened, the failed
+        RPC is retried once, and the remaining RPCs are executed on the
+        new connection.
+      - Only use a non-zero value for RPCs which can safely be executed
+        again.
+    required: false
+    default: 0
+    type: int
+  retries:
+    description:
+      - The maximum number of times each RPC is executed while waiting
+        for the I(wait_for) conditions to be met.
+    required: false
+    default: 10
+    type: int
   return_output:
     description:
       - Indicates if the output of the RPC should be returned in the
@@ -182,6 +370,130 @@ options:
     type: list
     aliases:
       - rpc
+  sample_interval:
+    description:
+      - The number of seconds between the start of consecutive sampling
+        rounds when the I(samples) option is specified. Fractions of a
+        second are allowed. A round which takes longer than the interval
+        delays the next round.
+    required: false
+    default: 5
+    type: float
+  samples:
+    description:
+      - The number of times to sample the RPCs. When specified, the RPCs are
+        executed in rounds, every I(sample_interval) seconds, on the same
+        connection. Each round executes every RPC once.
+      - The values selected by the I(select) option, which is required, are
+        returned as a time series in the I(series) key of each RPC's result.
+        Deltas and rates are computed for numeric values. Counters which are
+        selected as a list, one value per node, are computed element by
+        element.
+      - When the I(dest) or I(dest_dir) option is specified, each sample is
+        also written, as soon as it is collected, as one line of a JSON
+        lines file. With I(dest_dir), the file is named
+        C(<hostname>_samples.jsonl). Each line has the I(rpc), I(kwargs),
+        I(attrs), I(time), and I(values) keys of the sample, and, with the
+        I(sweep) option, the I(sweep) key with its argument set, so every
+        sample identifies the arguments it was collected with.
+      - Sampling stops early when the I(deadline) option expires. Mutually
+        exclusive with the I(cache_dir), I(stream_records), and I(wait_for)
+        options.
+    required: false
+    default: none
+    type: int
+  select:
+    description:
+      - A dictionary which maps names to XPath expressions. When specified,
+        only the values selected by the XPath expressions are converted and
+        returned in the I(parsed_output) key, as a dictionary with the same
+        names. The I(stdout) and I(stdout_lines) keys are not returned.
+      - An expression which selects nodes returns a list with one value per
+        node. The value is the text of a leaf element, or the dictionary form
+        of an element with children. Expressions which return a string,
+        number or boolean (e.g. C(count(...))) return that value.
+      - The value of this option can either be a single dictionary, or a list
+        of dictionaries. If a single dictionary is specified, it applies to
+        all RPC(s) specified by the I(rpcs) option. If a list is specified,
+        there must be one dictionary in the list for each RPC specified by
+        the I(rpcs) option.
+      - May only be applied to RPCs whose format is C(xml). Each XPath
+        expression is compiled once and reused for all RPCs.
+    required: false
+    default: none
+    type: dict or list of dict
+  stream_records:
+    description:
+      - The tag of the repeating record element of very large XML replies,
+        for example C(rt) for C(get-route-information) or
+        C(physical-interface) for C(get-interface-information).
+      - When specified, each record element is converted into a JSON data
+        structure and written as one line of a JSON lines file as soon as it
+        is reached. Each processed record is then released, and the whole
+        reply is never converted or serialized. This keeps the memory used
+        by the module close to the size of the reply as received from PyEZ.
+      - Records are written to the file specified by the I(dest) option, or
+        to a file named C(<hostname>_<rpc>.jsonl) in the directory specified
+        by the I(dest_dir) option. One of these options is required.
+      - The I(stdout), I(stdout_lines) and I(parsed_output) keys are not
+        returned. The number of records written is returned in the
+        I(record_count) key.
+      - Only valid when the format of every RPC is C(xml). Mutually exclusive
+        with the I(select) and I(cache_dir) options.
+    required: false
+    default: none
+    type: str
+  sweep:
+    description:
+      - A list of argument sets for a single RPC. The RPC specified by the
+        I(rpcs) option is executed once for each argument set. Each argument
+        set is a dictionary of keyword arguments and values, in the same form
+        as the I(kwargs) option, which is added to, or replaces, the keyword
+        arguments in the I(kwargs) option.
+      - The RPC is built once for all argument sets with the same keys. Each
+        execution uses a copy of it with the argument values filled in.
+      - The I(results) key is always returned, with one element per argument
+        set in the same order. Each element has a I(sweep) key with its
+        argument set. When the I(dest_dir) option is specified, the output
+        of each argument set is saved in a file named
+        C(<hostname>_<rpc>_<index>.<format>) where C(<index>) is the
+        zero-based position of the argument set.
+      - Only valid when the I(rpcs) option is a single RPC other than
+        C(get-config).
+    required: false
+    default: none
+    type: list of dict
+  timeouts:
+    description:
+      - The number of seconds to wait for the reply of each RPC, in place
+        of the device-wide I(timeout) option. The value of this option can
+        either be a single timeout, or a list of timeouts. If a single
+        timeout is specified, it applies to all RPCs specified by the
+        I(rpcs) option. If a list of timeouts is specified, there must be one
+        value in the list for each RPC specified by the I(rpcs) option.
+    required: false
+    default: none
+    type: int or list of int
+  wait_for:
+    description:
+      - One or more conditions which the reply of each RPC must meet.
+        The RPC is executed again, on the same connection, until the
+        conditions are met or the I(retries) are exhausted. If the conditions
+        are never met, the RPC fails and the I(failed_conditions) key
+        lists the conditions which were not met.
+      - For the C(xml) format, each condition is an XPath expression
+        evaluated against the reply. The condition is met if the expression
+        selects at least one node, or returns true, a non-zero number, or a
+        non-empty string. For the C(text) format, each condition is a
+        regular expression which must match the reply. The C(json) format is
+        not supported.
+      - Polling stops when the I(deadline) option expires. Mutually exclusive
+        with the I(cache_dir) option.
+    required: false
+    default: none
+    type: str or list of str
+    aliases:
+      - waitfor
 '''
 
 EXAMPLES = '''
@@ -202,6 +514,80 @@ EXAMPLES = '''
       debug:
         var: response.stdout
 
+    - name: Reuse the output of get-route-summary-information for a minute.
+      juniper_junos_rpc:
+        rpcs: "get-route-summary-information"
+        cache_dir: "/tmp/junos_cache"
+      register: response
+
+    - name: Save every route of a large routing table as JSON lines.
+      juniper_junos_rpc:
+        rpcs: "get-route-information"
+        stream_records: "rt"
+        dest_dir: "/tmp/routes"
+      register: response
+
+    - name: Execute get-interface-information for each interface.
+      juniper_junos_rpc:
+        rpcs: "get-interface-information"
+        kwargs:
+          detail: True
+        sweep:
+          - interface_name: "ge-0/0/0"
+          - interface_name: "ge-0/0/1"
+          - interface_name: "ge-0/0/2"
+      register: response
+
+    - name: Return only the up/down state of each physical interface.
+      juniper_junos_rpc:
+        rpcs: "get-interface-information"
+        kwargs:
+          terse: True
+        select:
+          names: "//physical-interface/name"
+          states: "//physical-interface/oper-status"
+    - name: Wait for ge-0/0/0 to come up, polling quickly at first.
+      juniper_junos_rpc:
+        rpcs: "get-interface-information"
+        kwargs:
+          interface_name: "ge-0/0/0"
+        wait_for: "//physical-interface[oper-status = 'up']"
+        retries: 10
+        interval: 0.5
+        backoff: 1.5
+      register: response
+
+    - name: Sample interface input counters every 5 seconds for a minute.
+      juniper_junos_rpc:
+        rpcs: "get-interface-information"
+        kwargs:
+          interface_name: "ge-0/0/0"
+          extensive: True
+        select:
+          input_bytes: "number(//traffic-statistics/input-bytes)"
+          output_bytes: "number(//traffic-statistics/output-bytes)"
+        samples: 12
+        sample_interval: 5
+      register: response
+
+    - name: Save the configuration only when it changes.
+      juniper_junos_rpc:
+        rpcs: "get-config"
+        format: text
+        dest_dir: "./configs"
+        detect_changes: true
+        ignore_patterns:
+          - "^## Last commit: .*$"
+      register: response
+
+    - name: Archive the configuration compressed, stored once per content.
+      juniper_junos_rpc:
+        rpcs: "get-config"
+        format: text
+        dest_dir: "/var/archive/configs"
+        compression: gzip
+        content_addressed: true
+
 ###### OLD EXAMPLES ##########
 - junos_rpc:
   host={{ inventory_hostname }}
@@ -268,6 +654,12 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
+attempts:
+  description:
+    - The number of times the RPC was executed while waiting for the
+      I(wait_for) conditions.
+  returned: when the I(wait_for) option is specified.
+  type: int
 attrs:
   description:
     - The RPC attributes and values from the list of dictionaries in the
@@ -275,6 +667,24 @@ attrs:
       RPC.
   returned: always
   type: dict
+cache_hit:
+  description:
+    - Indicates if the RPC output was retrieved from the cache rather than
+      from the Junos device.
+  returned: when the I(cache_dir) option is specified.
+  type: bool
+cache_hits:
+  description:
+    - The number of RPCs whose output was retrieved from the cache.
+  returned: when the I(cache_dir) option is specified and the I(rpcs)
+            option is a list value.
+  type: int
+cache_misses:
+  description:
+    - The number of RPCs whose output was not found in the cache.
+  returned: when the I(cache_dir) option is specified and the I(rpcs)
+            option is a list value.
+  type: int
 changed:
   description:
     - Indicates if the device's state has changed. Since this module doesn't
@@ -285,14 +695,45 @@ changed:
       C(clear-ospf-neighbor-information). Beware, this module is unable to
       detect this situation, and will still return a I(changed) value of
       C(false) in this case.
+    - When the I(detect_changes) option is C(true), indicates if the RPC
+      output differs from the output last saved in the I(dest_dir)
+      directory. For a list of RPCs, the top-level value is C(true) if any
+      RPC output changed.
   returned: success
   type: bool
+connection_lost:
+  description:
+    - Indicates that the RPC was not executed because the connection to
+      the Junos device was lost and the I(fail_fast) option is C(true).
+  returned: when the RPC was not executed because the connection was lost.
+  type: bool
+deadline_exceeded:
+  description:
+    - Indicates that the RPC was not executed because the deadline
+      specified by the I(deadline) option expired. When the I(rpcs) option is
+      a list value, the top-level key indicates if any RPC was not
+      executed.
+  returned: when the RPC was not executed, and at the top-level when the
+            I(deadline) option is specified and the I(rpcs) option is a
+            list value.
+  type: bool
 failed:
   description:
     - Indicates if the task failed. See the I(results) key for additional
       details.
   returned: always
   type: bool
+failed_conditions:
+  description:
+    - The I(wait_for) conditions which were not met by the last reply.
+  returned: when the I(wait_for) conditions were not met.
+  type: list of str
+failed_samples:
+  description:
+    - The number of samples for which the RPC failed. Their values are
+      C(none) in the I(series) key.
+  returned: when the I(samples) option is specified.
+  type: int
 format:
   description:
     - The format of the RPC response from the list of formats in the I(formats)
@@ -317,16 +758,33 @@ msg:
 parsed_output:
   description:
     - The RPC reply from the Junos device parsed into a JSON datastructure.
-      For XML replies, the response is parsed into JSON using the
-      U(jxmlease|https://github.com/Juniper/jxmlease)
-      library. For JSON the response is parsed using the Python
-      U(json|https://docs.python.org/2/library/json.html) library.
-    - When Ansible converts the jxmlease or native Python data structure
+      For XML replies, the response is parsed into JSON by a converter which
+      walks the lxml tree. Each element becomes a key named by its tag,
+      without any namespace. An element without child elements becomes its
+      stripped text, and child elements which share a tag become a list.
+      Element attributes are not included. For JSON the response is parsed using the Python
+      U(json|https://docs.python.org/2/library/json.html) library. When the
+      I(select) option is specified, this is a dictionary of the selected
+      values.
+    - When Ansible converts the native Python data structure
       into JSON, it does not guarantee that the order of dictionary/object keys
       are maintained.
   returned: when RPC executed successfully, I(return_output) is C(true),
             and the RPC format is C(xml) or C(json).
   type: dict
+record_count:
+  description:
+    - The number of records written to the JSON lines file.
+  returned: when RPC executed successfully and the I(stream_records) option
+            is specified.
+  type: int
+reconnects:
+  description:
+    - The number of attempts made to reopen the connection to the Junos
+      device.
+  returned: when the I(reconnect_attempts) option is greater than zero and
+            the I(rpcs) option is a list value.
+  type: int
 results:
   description:
     - The other keys are returned when a single RPC is specified for the
@@ -340,26 +798,58 @@ results:
       if ANY of the RPCs ran successfully. In this case, check the value
       of the I(failed) key for each element in the I(results) list for the
       results of individual RPCs.
-  returned: when the I(rpcs) option is a list value.
+  returned: when the I(rpcs) option is a list value, or the I(sweep) option
+            is specified.
   type: list of dict
 rpc:
   description:
     - The RPC which was executed from the list of RPCs in the I(rpcs) option.
   returned: always
   type: str
+samples:
+  description:
+    - The number of samples collected for the RPC.
+  returned: when the I(samples) option is specified.
+  type: int
+series:
+  description:
+    - The time series of the values sampled for the RPC. The I(time) key
+      is a list of sample timestamps, in seconds since the epoch. The
+      I(values) key is a dictionary with one list per name in the I(select)
+      option. The I(deltas) and I(rates) keys are dictionaries with one
+      list per numeric value. The delta is the difference from the previous
+      sample, and the rate is the delta per second. The first element of
+      each delta and rate list is C(none).
+  returned: when the I(samples) option is specified and I(return_output) is
+            C(true).
+  type: dict
 stdout:
   description:
     - The RPC reply from the Junos device as a single multi-line string.
-  returned: when RPC executed successfully and I(return_output) is C(true).
+    - For JSON replies, this is the reply encoded as compact JSON text.
+  returned: when RPC executed successfully, I(return_output) is C(true),
+            and the I(select) option is not specified.
   type: str
 stdout_lines:
   description:
     - The RPC reply from the Junos device as a list of single-line strings.
-  returned: when RPC executed successfully and I(return_output) is C(true).
+  returned: when RPC executed successfully, I(return_output) is C(true),
+            and the I(select) option is not specified.
   type: list of str
+sweep:
+  description:
+    - The argument set, from the I(sweep) option, applied to the RPC. The
+      I(kwargs) key contains the complete keyword arguments. Identifies
+      the result, or sampled time series, of each argument set.
+  returned: when the I(sweep) option is specified.
+  type: dict
 '''
 
+from copy import deepcopy
+import logging
 import os.path
+import sys
+import time
 
 
 try:
@@ -379,6 +869,368 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils import juniper_junos_common
 
 
+# Compiled RPC templates keyed by the signature of the RPC. See build_rpc().
+_rpc_templates = {}
+
+
+def build_rpc(junos_module, rpc_string, format, kwarg, attr):
+    """Build the XML element of an RPC.
+
+    The structure of an RPC only depends on its signature: its name, its
+    format, its attrs, and the keys of its kwargs (and which of them are
+    flags). A template element is built once per signature, with the
+    underscores of the kwarg keys replaced by dashes, and cached, so the
+    argument sets of a sweep or the rounds of samples reuse it. Each call
+    copies the template and fills in the kwarg values.
+
+    Args:
+        junos_module: The JuniperJunosModule instance.
+        rpc_string: The name of the RPC.
+        format: The format of the RPC reply.
+        kwarg: A dict of the RPC's keyword arguments, or None.
+        attr: A dict of the RPC's attributes, or None.
+
+    Returns:
+        The RPC element.
+    """
+    values = list(itervalues(kwarg)) if kwarg is not None else []
+    keys = tuple((key, isinstance(value, bool))
+                 for (key, value) in iteritems(kwarg or {}))
+    attrs = tuple(iteritems(attr)) if attr is not None else ()
+    signature = (rpc_string, format, keys, attrs)
+    template = _rpc_templates.get(signature)
+    if template is None:
+        template = junos_module.etree.Element(rpc_string, format=format)
+        for (key, flag) in keys:
+            # Replace underscores with dashes in key name.
+            junos_module.etree.SubElement(template, key.replace('_', '-'))
+        for (key, value) in attrs:
+            # Replace underscores with dashes in key name.
+            template.set(key.replace('_', '-'), value)
+        _rpc_templates[signature] = template
+    rpc = deepcopy(template)
+    for (sub_element, value) in zip(rpc, values):
+        if not isinstance(value, bool):
+            sub_element.text = value
+    return rpc
+
+
+def execute_rpc(junos_module, rpc_string, format, kwarg, attr, result,
+                select=None, stream_records=None, name=None, timeout=None):
+    """Execute an RPC on the Junos device and return its output.
+
+    Args:
+        junos_module: The JuniperJunosModule instance.
+        rpc_string: The name of the RPC to execute.
+        format: The format of the RPC reply.
+        kwarg: A dict of the RPC's keyword arguments, or None.
+        attr: A dict of the RPC's attributes, or None.
+        result: The result dict for the RPC. The 'msg' key is updated.
+        select: A dict of names and XPath expressions, or None. If
+                specified, only the selected values of an XML reply are
+                converted and returned as the parsed output.
+        stream_records: The tag of the record elements of an XML reply, or
+                        None. If specified, each record is saved as a line
+                        of a JSON lines file, the number of records is
+                        stored in result['record_count'], and no text or
+                        parsed output is produced.
+        name: The name portion of the file name of streamed records, or
+              None to use rpc_string.
+        timeout: The timeout, in seconds, for the RPC, or None to use the
+                 device timeout.
+
+    Returns:
+        A tuple containing the text output and the parsed output, or None if
+        the RPC failed.
+    """
+    # Execute the RPC
+    rpc = None
+    timeout_args = {}
+    if timeout is not None:
+        timeout_args['dev_timeout'] = timeout
+    try:
+        if rpc_string == 'get-config':
+            filter = junos_module.params.get('filter')
+            if attr is None:
+                attr = {}
+            if kwarg is None:
+                kwarg = {}
+            junos_module.logger.debug('Executing "get-config" RPC. '
+                                      'filter_xml=%s, options=%s, '
+                                      'kwargs=%s',
+                                      filter, str(attr), str(kwarg))
+            kwarg = dict(kwarg, **timeout_args)
+            resp = junos_module.dev.rpc.get_config(filter_xml=filter,
+                                                   options=attr, **kwarg)
+            result['msg'] = 'The "get-config" RPC executed successfully.'
+            junos_module.logger.debug('The "get-config" RPC executed '
+                                      'successfully.')
+        else:
+            rpc = build_rpc(junos_module, rpc_string, format, kwarg, attr)
+            # Only pretty print the RPC if it will actually be logged.
+            rpc_text = rpc_string
+            if junos_module.logger.isEnabledFor(logging.DEBUG):
+                rpc_text = junos_module.etree.tostring(rpc, pretty_print=True)
+            junos_module.logger.debug('Executing RPC "%s".', rpc_text)
+            # Records are stripped as they are converted, so a streamed
+            # reply skips normalizing, which copies the whole reply.
+            normalize = bool(format == 'xml' and stream_records is None)
+            resp = junos_module.dev.rpc(rpc, normalize=normalize,
+                                        **timeout_args)
+            result['msg'] = 'The RPC executed successfully.'
+            junos_module.logger.debug('RPC "%s" executed successfully.',
+                                      rpc_text)
+    except (junos_module.pyez_exception.ConnectError,
+            junos_module.pyez_exception.RpcError) as ex:
+        if isinstance(ex, junos_module.pyez_exception.ConnectError):
+            junos_module.connection_lost = True
+        if rpc is not None:
+            rpc_string = junos_module.etree.tostring(rpc, pretty_print=True)
+        junos_module.logger.debug('Unable to execute RPC "%s". Error: %s',
+                                  rpc_string, str(ex))
+        result['msg'] = 'Unable to execute the RPC: %s. Error: %s' % \
+                        (rpc_string, str(ex))
+        return None
+
+    text_output = None
+    parsed_output = None
+    if resp is True:
+        text_output = ''
+    elif (resp, junos_module.etree._Element):
+        # Handle the output based on format
+        if format == 'text':
+            text_output = resp.text
+            junos_module.logger.debug('Text output set.')
+        elif format == 'xml':
+            encode = None if sys.version < '3' else 'unicode'
+            if stream_records is not None:
+                # Each record is converted, written and released in turn. The
+                # whole reply is never converted or serialized.
+                records = juniper_junos_common.iter_records(resp,
+                                                            stream_records)
+                result['record_count'] = junos_module.save_records(
+                                             name or rpc_string, records)
+                junos_module.logger.debug('%d records streamed.',
+                                          result['record_count'])
+            elif select is not None:
+                # Only the selected nodes are converted. The full reply is
+                # only serialized if it must be saved.
+                parsed_output = juniper_junos_common.select_from_xml(resp,
+                                                                     select)
+                if (junos_module.params.get('dest') is not None or
+                        junos_module.params.get('dest_dir') is not None):
+                    text_output = junos_module.etree.tostring(
+                                      resp,
+                                      pretty_print=True,
+                                      encoding=encode)
+                junos_module.logger.debug('Selected XML output set.')
+            else:
+                text_output = junos_module.etree.tostring(resp,
+                                                          pretty_print=True,
+                                                          encoding=encode)
+                parsed_output = juniper_junos_common.xml_to_dict(resp)
+                junos_module.logger.debug('XML output set.')
+        elif format == 'json':
+            # PyEZ has already decoded the JSON reply. The JSON text is only
+            # encoded when it is needed. See
+            # JuniperJunosModule.json_output_text().
+            parsed_output = resp
+            junos_module.logger.debug('JSON output set.')
+        else:
+            result['msg'] = 'Unexpected format %s.' % (format)
+            junos_module.logger.debug('Unexpected format %s.', format)
+            return None
+    else:
+        result['msg'] = 'Unexpected response type %s.' % (type(resp))
+        junos_module.logger.debug('Unexpected response type %s.',
+                                  type(resp))
+        return None
+    # Check the wait_for conditions. See JuniperJunosModule.wait_for().
+    if junos_module.params.get('wait_for') is not None:
+        reply = resp if format == 'xml' else text_output
+        if resp is True:
+            reply = None
+        result['failed_conditions'] = juniper_junos_common.failed_conditions(
+                                          junos_module.params.get('wait_for'),
+                                          junos_module.params.get('match'),
+                                          format,
+                                          reply)
+    return (text_output, parsed_output)
+
+
+def numeric_value(value):
+    """Return a selected value as a number, or a list of numbers.
+
+    Args:
+        value: A value returned by juniper_junos_common.select_from_xml().
+
+    Returns:
+        An int or float, a list of them, or None if value is not numeric.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, list):
+        numbers = [numeric_value(item) for item in value]
+        if not numbers or None in numbers or \
+                any(isinstance(number, list) for number in numbers):
+            return None
+        return numbers
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+
+def add_deltas_and_rates(series):
+    """Add the deltas and rates of the numeric values of a time series.
+
+    The delta of a sample is its value minus the value of the previous
+    sample. The rate is the delta divided by the seconds between the two
+    samples. Lists are subtracted element by element. The delta and rate
+    are None for the first sample, and for samples where either value is
+    missing, not numeric, or a list of a different length.
+
+    Args:
+        series: A dict with a 'time' list and a 'values' dict of lists. The
+                'deltas' and 'rates' dicts are added to it.
+    """
+    series['deltas'] = {}
+    series['rates'] = {}
+    times = series['time']
+    for (name, values) in iteritems(series['values']):
+        numbers = [numeric_value(value) for value in values]
+        if all(number is None for number in numbers):
+            continue
+        deltas = [None]
+        rates = [None]
+        for index in range(1, len(numbers)):
+            (previous, current) = (numbers[index - 1], numbers[index])
+            elapsed = times[index] - times[index - 1]
+            delta = None
+            rate = None
+            if isinstance(previous, list) and isinstance(current, list):
+                if len(previous) == len(current):
+                    delta = [b - a for (a, b) in zip(previous, current)]
+                    if elapsed > 0:
+                        rate = [d / elapsed for d in delta]
+            elif (previous is not None and current is not None and
+                    not isinstance(previous, list) and
+                    not isinstance(current, list)):
+                delta = current - previous
+                if elapsed > 0:
+                    rate = delta / elapsed
+            deltas.append(delta)
+            rates.append(rate)
+        series['deltas'][name] = deltas
+        series['rates'][name] = rates
+
+
+def sample_rpcs(junos_module, results, rpcs, formats, kwargs, attrs,
+                selects, sweep, timeouts):
+    """Execute the RPCs every 'sample_interval' seconds, 'samples' times.
+
+    Each round executes every RPC once, on the same connection. Rounds start
+    at a fixed cadence; a round which takes longer than the interval delays
+    the next one. The values selected by each RPC's select dict are appended
+    to the time series in the 'series' key of its result. Sampling stops
+    early when the 'deadline' param expires.
+
+    This is a generator so the samples can be saved as they are collected.
+
+    Args:
+        junos_module: The JuniperJunosModule instance.
+        results: A list of result dicts, one per RPC, which are updated.
+        rpcs: The list of RPC names.
+        formats: The list of formats. Always xml.
+        kwargs: The list of kwargs dicts or None values.
+        attrs: The list of attrs dicts or None values.
+        selects: The list of select dicts.
+        sweep: The list of sweep argument sets or None values.
+        timeouts: The list of timeouts or None values.
+
+    Yields:
+        One dict per RPC per round, with the rpc, kwargs, attrs, time and
+        values of the sample, and its sweep argument set, if any.
+    """
+    interval = junos_module.params.get('sample_interval')
+    start = time.time()
+    for sample in range(junos_module.params.get('samples')):
+        # Wait for the start of the round.
+        delay = start + sample * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        for (result, rpc_string, format, kwarg, attr, select, argset,
+             timeout) in zip(results, rpcs, formats, kwargs, attrs, selects,
+                             sweep, timeouts):
+            timeout = junos_module.call_timeout(timeout)
+            if timeout == 0:
+                result['deadline_exceeded'] = True
+                return
+            junos_module.reconnect()
+            # Timestamps are rounded to milliseconds.
+            timestamp = round(time.time(), 3)
+            output = execute_rpc(junos_module, rpc_string, format, kwarg,
+                                 attr, result, select, timeout=timeout)
+            values = output[1] if output is not None else None
+            series = result['series']
+            series['time'].append(timestamp)
+            for name in select:
+                series['values'][name].append(
+                    values[name] if values is not None else None)
+            if values is not None:
+                result['failed'] = False
+            else:
+                result['failed_samples'] += 1
+            record = {'rpc': rpc_string,
+                      'kwargs': kwarg,
+                      'attrs': attr,
+                      'time': timestamp,
+                      'values': values}
+            if argset is not None:
+                record['sweep'] = argset
+            yield record
+
+
+def exit_with_results(junos_module, results):
+    """Exit the module with the results of the RPCs.
+
+    Args:
+        junos_module: The JuniperJunosModule instance.
+        results: The list of result dicts. One per RPC execution.
+    """
+    if len(results) == 1 and junos_module.params.get('sweep') is None:
+        junos_module.exit_json(**results[0])
+    else:
+        # Calculate the overall failed. Only failed if all commands failed.
+        failed = True
+        for result in results:
+            if result.get('failed') is False:
+                failed = False
+                break
+        summary = {}
+        if junos_module.params.get('cache_dir') is not None:
+            hits = len([result for result in results
+                        if result.get('cache_hit') is True])
+            summary['cache_hits'] = hits
+            summary['cache_misses'] = len(results) - hits
+        if junos_module.params.get('deadline') is not None:
+            summary['deadline_exceeded'] = any(
+                result.get('deadline_exceeded') is True
+                for result in results)
+        if junos_module.params.get('reconnect_attempts') > 0:
+            summary['reconnects'] = junos_module.reconnects
+        changed = any(result.get('changed') is True for result in results)
+        junos_module.exit_json(results=results,
+                               changed=changed,
+                               failed=failed,
+                               **summary)
+
+
 def main():
     # Create the module instance.
     junos_module = juniper_junos_common.JuniperJunosModule(
@@ -411,9 +1263,83 @@ def main():
                           type='path',
                           aliases=['destination_dir', 'destdir'],
                           default=None),
+            select=dict(required=False,
+                        type='str',
+                        default=None),
+            sweep=dict(required=False,
+                       type='str',
+                       default=None),
+            stream_records=dict(required=False,
+                                type='str',
+                                default=None),
             return_output=dict(required=False,
                                type='bool',
-                               default=True)
+                               default=True),
+            json_output=dict(required=False,
+                             choices=['both', 'raw', 'parsed'],
+                             type='str',
+                             default='both'),
+            cache_dir=dict(required=False,
+                           type='path',
+                           default=None),
+            cache_ttl=dict(required=False,
+                           type='int',
+                           default=60),
+            cache_size=dict(required=False,
+                            type='int',
+                            default=256),
+            timeouts=dict(required=False,
+                          type='list',
+                          default=None),
+            deadline=dict(required=False,
+                          type='int',
+                          default=None),
+            fail_fast=dict(required=False,
+                           type='bool',
+                           default=False),
+            reconnect_attempts=dict(required=False,
+                                    type='int',
+                                    default=0),
+            wait_for=dict(required=False,
+                          type='list',
+                          aliases=['waitfor'],
+                          default=None),
+            match=dict(required=False,
+                       choices=['all', 'any'],
+                       type='str',
+                       default='all'),
+            retries=dict(required=False,
+                         type='int',
+                         default=10),
+            interval=dict(required=False,
+                          type='float',
+                          default=1),
+            backoff=dict(required=False,
+                         type='float',
+                         default=1),
+            samples=dict(required=False,
+                         type='int',
+                         default=None),
+            sample_interval=dict(required=False,
+                                 type='float',
+                                 default=5),
+            detect_changes=dict(required=False,
+                                type='bool',
+                                default=False),
+            ignore_xpaths=dict(required=False,
+                               type='list',
+                               default=None),
+            ignore_patterns=dict(required=False,
+                                 type='list',
+                                 default=None),
+            compression=dict(
+                required=False,
+                choices=juniper_junos_common.OUTPUT_COMPRESSION_CHOICES,
+                type='str',
+                default='none'),
+            content_addressed=dict(required=False,
+                                   type='bool',
+                                   default=False)
         ),
         # Since this module doesn't change the device's configuration, there is
         # no additional work required to support check mode. It's inherently
@@ -421,7 +1347,13 @@ def main():
         # RPC executed. See the I(changed) key in the RETURN documentation
         # for more details.
         supports_check_mode=True,
-        min_jxmlease_version=juniper_junos_common.MIN_JXMLEASE_VERSION,
+        mutually_exclusive=[['stream_records', 'select'],
+                            ['stream_records', 'cache_dir'],
+                            ['stream_records', 'wait_for'],
+                            ['wait_for', 'cache_dir'],
+                            ['samples', 'cache_dir'],
+                            ['samples', 'stream_records'],
+                            ['samples', 'wait_for']],
     )
 
     # Check over rpcs
@@ -489,10 +1421,136 @@ def main():
                                        "when the rpcs option value is a "
                                        "single 'get-config' RPC.")
 
+    # Check over sweep
+    sweep = junos_module.parse_arg_to_list_of_dicts(
+                'sweep',
+                junos_module.params.get('sweep'),
+                allow_bool_values=True)
+    if sweep is not None:
+        if len(rpcs) != 1 or rpcs[0] in ['get-config', 'get_config']:
+            junos_module.fail_json(msg="The sweep option is only valid "
+                                       "when the rpcs option value is a "
+                                       "single RPC other than 'get-config'.")
+        # Every argument set with the same keys shares one RPC template.
+        # See build_rpc().
+        swept_kwargs = []
+        for argset in sweep:
+            kwarg = dict(kwargs[0] or {})
+            kwarg.update(argset)
+            swept_kwargs.append(kwarg)
+        kwargs = swept_kwargs
+        rpcs = rpcs * len(sweep)
+        formats = formats * len(sweep)
+        attrs = attrs * len(sweep)
+    else:
+        sweep = [None] * len(rpcs)
+
+    # Check over select
+    selects = junos_module.parse_select_option(len(rpcs))
+    for (rpc_string, format, select) in zip(rpcs, formats, selects):
+        if select is not None and format != 'xml':
+            junos_module.fail_json(msg="The select option can only be "
+                                       "applied to an RPC with the xml "
+                                       "format. The format of the RPC (%s) "
+                                       "is %s." % (rpc_string, format))
+
+    # Check stream_records
+    stream_records = junos_module.params.get('stream_records')
+    if stream_records is not None:
+        if set(formats) != set(['xml']):
+            junos_module.fail_json(msg="The stream_records option is only "
+                                       "valid when the format of every RPC "
+                                       "is xml.")
+        if (junos_module.params.get('dest') is None and
+                junos_module.params.get('dest_dir') is None):
+            junos_module.fail_json(msg="The stream_records option requires "
+                                       "the dest or dest_dir option.")
+
+    # Check over timeouts
+    timeouts = junos_module.parse_timeouts_option(len(rpcs))
+
+    # Check over wait_for
+    junos_module.parse_wait_for_option(formats)
+
+    # Check over detect_changes
+    junos_module.parse_detect_changes_option()
+
+    # Check over compression and content_addressed
+    junos_module.parse_storage_options()
+    if (junos_module.params.get('detect_changes') is True and
+            (stream_records is not None or
+             junos_module.params.get('samples') is not None)):
+        junos_module.fail_json(msg="The detect_changes option can not be "
+                                   "combined with the stream_records or "
+                                   "samples options.")
+    if (junos_module.params.get('content_addressed') is True and
+            (stream_records is not None or
+             junos_module.params.get('samples') is not None)):
+        junos_module.fail_json(msg="The content_addressed option can not be "
+                                   "combined with the stream_records or "
+                                   "samples options.")
+
+    # Sample the RPCs
+    if junos_module.params.get('samples') is not None:
+        if junos_module.params.get('samples') < 1:
+            junos_module.fail_json(msg="The samples option must be at "
+                                       "least 1.")
+        if junos_module.params.get('sample_interval') < 0:
+            junos_module.fail_json(msg="The sample_interval option must not "
+                                       "be negative.")
+        if None in selects:
+            junos_module.fail_json(msg="The samples option requires a "
+                                       "select value for every RPC.")
+        rpcs = [rpc_string.replace('_', '-') for rpc_string in rpcs]
+        results = list()
+        for (rpc_string, format, kwarg, attr, select, argset) in \
+                zip(rpcs, formats, kwargs, attrs, selects, sweep):
+            result = {'msg': '',
+                      'rpc': rpc_string,
+                      'format': format,
+                      'kwargs': kwarg,
+                      'attrs': attr,
+                      'changed': False,
+                      'failed': True,
+                      'failed_samples': 0,
+                      'series': {'time': [],
+                                 'values': dict((name, [])
+                                                for name in select)}}
+            if argset is not None:
+                result['sweep'] = argset
+            results.append(result)
+        records = sample_rpcs(junos_module, results, rpcs, formats, kwargs,
+                              attrs, selects, sweep, timeouts)
+        if (junos_module.params.get('dest') is not None or
+                junos_module.params.get('dest_dir') is not None):
+            junos_module.save_records('samples', records)
+        else:
+            # Run the sampler to completion.
+            for record in records:
+                pass
+        for result in results:
+            add_deltas_and_rates(result['series'])
+            result['samples'] = len(result['series']['time'])
+            if result['failed'] is False:
+                result['msg'] = 'Collected %d samples.' % (result['samples'])
+            if junos_module.params['return_output'] is False:
+                del result['series']
+        exit_with_results(junos_module, results)
+
+    # Whether the text of a reply is kept, to be saved.
+    keep_text = bool(junos_module.params.get('dest') is not None or
+                     junos_module.params.get('dest_dir') is not None)
     results = list()
-    for (rpc_string, format, kwarg, attr) in zip(rpcs, formats, kwargs, attrs):
+    for (index, (rpc_string, format, kwarg, attr, select, argset,
+                 timeout)) in enumerate(zip(rpcs, formats, kwargs, attrs,
+                                            selects, sweep, timeouts)):
         # Replace underscores with dashes in RPC name.
         rpc_string = rpc_string.replace('_', '-')
+        # The name of the saved output. Each argument set of a sweep is
+        # saved in its own file.
+        name = rpc_string
+        if argset is not None:
+            name = '%s_%d' % (rpc_string, index)
         # Set initial result values. Assume failure until we know it's success.
         result = {'msg': '',
                   'rpc': rpc_string,
@@ -501,121 +1559,78 @@ def main():
                   'attrs': attr,
                   'changed': False,
                   'failed': True}
+        if argset is not None:
+            result['sweep'] = argset
 
-        # Execute the RPC
-        try:
-            if rpc_string == 'get-config':
-                filter = junos_module.params.get('filter')
-                if attr is None:
-                    attr = {}
-                if kwarg is None:
-                    kwarg = {}
-                junos_module.logger.debug('Executing "get-config" RPC. '
-                                          'filter_xml=%s, options=%s, '
-                                          'kwargs=%s',
-                                          filter, str(attr), str(kwarg))
-                resp = junos_module.dev.rpc.get_config(filter_xml=filter,
-                                                       options=attr, **kwarg)
-                result['msg'] = 'The "get-config" RPC executed successfully.'
-                junos_module.logger.debug('The "get-config" RPC executed '
-                                          'successfully.')
-            else:
-                rpc = junos_module.etree.Element(rpc_string, format=format)
-                if kwarg is not None:
-                    # Add kwarg
-                    for (key, value) in iteritems(kwarg):
-                        # Replace underscores with dashes in key name.
-                        key = key.replace('_', '-')
-                        sub_element = junos_module.etree.SubElement(rpc, key)
-                        if not isinstance(value, bool):
-                            sub_element.text = value
-                if attr is not None:
-                    # Add attr
-                    for (key, value) in iteritems(attr):
-                        # Replace underscores with dashes in key name.
-                        key = key.replace('_', '-')
-                        rpc.set(key, value)
-                junos_module.logger.debug('Executing RPC "%s".',
-                                          junos_module.etree.tostring(
-                                              rpc,
-                                              pretty_print=True))
-                resp = junos_module.dev.rpc(rpc,
-                                            normalize=bool(format == 'xml'))
-                result['msg'] = 'The RPC executed successfully.'
-                junos_module.logger.debug('RPC "%s" executed successfully.',
-                                          junos_module.etree.tostring(
-                                              rpc,
-                                              pretty_print=True))
-        except (junos_module.pyez_exception.ConnectError,
-                junos_module.pyez_exception.RpcError) as ex:
-            junos_module.logger.debug('Unable to execute RPC "%s". Error: %s',
-                                      junos_module.etree.tostring(
-                                          rpc,
-                                          pretty_print=True), str(ex))
-            result['msg'] = 'Unable to execute the RPC: %s. Error: %s' % \
-                            (junos_module.etree.tostring(rpc,
-                                                         pretty_print=True),
-                             str(ex))
-            results.append(result)
-            continue
-
-        text_output = None
-        parsed_output = None
-        if resp is True:
-            text_output = ''
-        elif (resp, junos_module.etree._Element):
-            # Handle the output based on format
-            if format == 'text':
-                text_output = resp.text
-                junos_module.logger.debug('Text output set.')
-            elif format == 'xml':
-                text_output = junos_module.etree.tostring(resp,
-                                                          pretty_print=True)
-                parsed_output = junos_module.jxmlease.parse_etree(resp)
-                junos_module.logger.debug('XML output set.')
-            elif format == 'json':
-                text_output = str(resp)
-                parsed_output = resp
-                junos_module.logger.debug('JSON output set.')
-            else:
-                result['msg'] = 'Unexpected format %s.' % (format)
+        # Try the cache before executing the RPC. Selected replies are only
+        # kept as text if they are saved, so that is part of the key.
+        cache_key = ['rpc', rpc_string, format, kwarg, attr,
+                     junos_module.params.get('filter'), select, keep_text]
+        output = junos_module.get_cached_output(cache_key)
+        cache_hit = bool(output is not None)
+        if cache_hit is True:
+            result['msg'] = 'The RPC output was retrieved from the cache.'
+        else:
+            timeout = junos_module.call_timeout(timeout)
+            if timeout == 0:
+                result['msg'] = 'The RPC was not executed. The deadline of ' \
+                                '%d seconds expired.' % \
+                                (junos_module.params.get('deadline'))
+                result['deadline_exceeded'] = True
                 results.append(result)
-                junos_module.logger.debug('Unexpected format %s.', format)
                 continue
-        else:
-            result['msg'] = 'Unexpected response type %s.' % (type(resp))
-            results.append(result)
-            junos_module.logger.debug('Unexpected response type %s.',
-                                      type(resp))
-            continue
+            # Don't wait for another failure on a lost connection.
+            if (junos_module.reconnect() is False and
+                    junos_module.params.get('fail_fast') is True):
+                result['msg'] = 'The RPC was not executed. The ' \
+                                'connection to the device was lost.'
+                result['connection_lost'] = True
+                results.append(result)
+                continue
+            output = junos_module.wait_for(result, timeout, execute_rpc,
+                                           junos_module, rpc_string, format,
+                                           kwarg, attr, result, select,
+                                           stream_records, name)
+            # Retry once if the lost connection can be reopened.
+            if (output is None and junos_module.connection_lost is True and
+                    junos_module.reconnect() is True):
+                output = junos_module.wait_for(result, timeout, execute_rpc,
+                                               junos_module, rpc_string,
+                                               format, kwarg, attr, result,
+                                               select, stream_records, name)
+            if output is None:
+                results.append(result)
+                continue
+            junos_module.set_cached_output(cache_key, *output)
+        if junos_module.params.get('cache_dir') is not None:
+            result['cache_hit'] = cache_hit
+        (text_output, parsed_output) = output
+
+        text_output = junos_module.json_output_text(format, text_output,
+                                                    parsed_output)
 
         # Set the output keys
         if junos_module.params['return_output'] is True:
-            if text_output is not None:
+            if (text_output is not None and select is None and
+                    (format != 'json' or
+                     junos_module.params.get('json_output') != 'parsed')):
                 result['stdout'] = text_output
                 result['stdout_lines'] = text_output.splitlines()
-            if parsed_output is not None:
+            if (parsed_output is not None and
+                    (format != 'json' or
+                     junos_module.params.get('json_output') != 'raw')):
                 result['parsed_output'] = parsed_output
-        # Save the output
-        junos_module.save_text_output(rpc_string, format, text_output)
+        # Save the output. Streamed records have already been saved.
+        if stream_records is None:
+            saved = junos_module.save_text_output(name, format, text_output)
+            if junos_module.params.get('detect_changes') is True:
+                result['changed'] = saved is True
         # This command succeeded.
         result['failed'] = False
         # Append to the list of results
         results.append(result)
 
-    # Return response.
-    if len(results) == 1:
-        junos_module.exit_json(**results[0])
-    else:
-        # Calculate the overall failed. Only failed if all commands failed.
-        failed = True
-        for result in results:
-            if result.get('failed') is False:
-                failed = False
-                break
-        junos_module.exit_json(results=results,
-                               changed=False,
-                               failed=failed)
+    exit_with_results(junos_module, results)
 
 
 if __name__ == '__main__':
@@ -37,6 +37,7 @@
 #
 
 from __future__ import absolute_import, division, print_function
+from six import text_type
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
                     'supported_by': 'community',
@@ -58,6 +59,85 @@ description:
     This module may be used with the tables/views which are included in the
     PyEZ distribution or it may be used with user-defined tables/views.
 options:
+  cache_dir:
+    description:
+      - A directory on the Ansible control machine used to cache the parsed
+        table/view definitions of the I(file) option. The definitions are
+        saved as JSON in the C(tables) subdirectory of this directory, and
+        later tasks load the JSON instead of parsing the YAML again. The
+        cache is keyed by the file's path and modification time, and the
+        PyEZ version, so editing the file or upgrading PyEZ invalidates it.
+      - The directory may be shared by all hosts and tasks, and by the
+        I(cache_dir) option of the C(juniper_junos_command) and
+        C(juniper_junos_rpc) modules.
+    required: false
+    default: none
+    type: path
+  chunks:
+    description:
+      - Retrieve the table in chunks, with one RPC per chunk, instead of
+        with a single RPC. Each value is a dictionary of keyword arguments
+        which are added to, or override, the I(kwargs) option for one
+        chunk. For example, one chunk per routing table, or per destination
+        prefix range.
+      - The chunks are retrieved in order, and a chunk's reply is released
+        before the next chunk is retrieved, so only one chunk's reply is in
+        memory at a time. The items of all chunks are returned, or saved
+        with the I(stream_records) option, as if they were retrieved by a
+        single RPC.
+      - Splitting a table into chunks is only possible if the table's RPC
+        has arguments which select disjoint subsets of the items.
+    required: false
+    default: none
+    type: list
+  dest:
+    description:
+      - The path to a file, on the Ansible control machine, where the items
+        are saved when the I(stream_records) option is C(true).
+      - The value of this option must be unique per target host. This is
+        usually accomplished by including C({{ inventory_hostname }}) in the
+        value. The I(dest) and I(dest_dir) options are mutually exclusive.
+    required: false
+    default: none
+    type: path
+    aliases:
+      - destination
+  dest_dir:
+    description:
+      - The path to a directory, on the Ansible control machine, where the
+        items are saved when the I(stream_records) option is C(true). The
+        items are saved in a file named
+        C({{ inventory_hostname }}_)I(table)C(.jsonl) in this directory.
+      - The I(dest) and I(dest_dir) options are mutually exclusive.
+    required: false
+    default: none
+    type: path
+    aliases:
+      - destination_dir
+      - destdir
+  dictionary_encoding:
+    description:
+      - Only used when the I(response_type) option is C(columnar). When
+        C(true), a column with few distinct values, such as an interface
+        state, is returned as a dictionary with a I(dictionary) key, which
+        lists the distinct values in order of first appearance, and a
+        I(codes) key, which lists the index into I(dictionary) of each
+        item's value. A column is only encoded if at most half of its values
+        are distinct. Other columns are returned as plain lists.
+      - The value of an encoded column for item I(i) is
+        C(column.dictionary[column.codes[i]]).
+    required: false
+    default: false
+    type: bool
+  fields:
+    description:
+      - A list of the names of the view fields to return. Other fields of
+        the view are never evaluated, and are not part of the response.
+        By default, all fields of the view are returned.
+      - The module fails if a name is not a field of the table's view.
+    required: false
+    default: none
+    type: list
   file:
     description:
       - Name of the YAML file, relative to the I(path) option, that contains
@@ -66,6 +146,20 @@ options:
     required: true
     default: none
     type: path
+  index_fields:
+    description:
+      - Only used when the I(response_type) option is C(indexed). A list of
+        view field names to build secondary indexes on. The indexes are
+        returned in the I(indexes) key. Each index is a dictionary keyed by
+        the values of the field, with the list of the table keys of the
+        items which have that value. Each value of a field with several
+        values is indexed.
+      - Values are converted to strings like JSON converts dictionary keys.
+        For example, C(1500), C(true) and C(null) are indexed as C("1500"),
+        C("true") and C("null").
+    required: false
+    default: none
+    type: list
   kwargs:
     description:
       - Optional keyword arguments and values to the table's get() method. The
@@ -100,12 +194,68 @@ options:
         format C(juniper_items). Because Ansible module's may only return JSON
         data, PyEZ's native return format C(juniper_items) is translated into
         a list of lists.
+      - The C(columnar) format returns a dictionary with a I(keys) list, the
+        table key of each item, and a I(columns) dictionary, with one list
+        per view field. Each list holds that field's value for each item, in
+        the order of I(keys). Because field names are not repeated for each
+        item, the response is much smaller for large tables. See also the
+        I(dictionary_encoding) option.
+      - If the table has no key, or some of its items have no key, the keys
+        can not be matched with the items. The I(keys) list then holds the
+        position of each item in the RPC reply instead, starting from 0.
+        With the I(chunks) option, the positions continue from one chunk's
+        reply to the next. This also applies to nested tables.
+      - The C(indexed) format returns a dictionary of the items, in the
+        format of C(list_of_dicts), keyed by table key. The values of a
+        composite key are joined with C(|). A later task can then look up
+        an item by its key, for example
+        C(response.resource['ge-0/0/0']), without searching the whole list.
+        The table must have a key. See also the I(index_fields) option.
     required: false
     default: list_of_dicts
     choices:
       - list_of_dicts
       - juniper_items
+      - columnar
+      - indexed
     type: str
+  snapshot_dir:
+    description:
+      - The path to a directory, on the Ansible control machine, where the
+        items of the table are saved as a snapshot, and compared with the
+        snapshot saved by the previous run. The module returns the items
+        which were added, removed or changed since the previous run in the
+        I(delta) key, and their counts in the I(delta_counts) key, instead
+        of the I(resource) key. On the first run, every item is added.
+      - The snapshot is saved per host, table, and selection, in the
+        C({{ inventory_hostname }}_)I(table)C(_)I(hash)C(.snapshot.json.gz)
+        gzip compressed file of this directory. I(hash) is the SHA1 hash of the I(kwargs),
+        I(chunks), I(where), and I(fields) options, so tasks which select
+        different items or fields of the same table keep separate
+        snapshots. It is only rewritten if the items changed. The items are
+        identified by their table key, so the table must have a key. The
+        values of a composite key are joined with C(|).
+      - Volatile fields, such as counters, can be excluded from the
+        comparison with the I(fields) option. The I(response_type) option is
+        ignored, and the I(stream_records) option can not be used.
+    required: false
+    default: none
+    type: path
+  stream_records:
+    description:
+      - When C(true), the items are not returned in the I(resource) key.
+        Instead, each item is converted to a dictionary, like the
+        C(list_of_dicts) I(response_type), and immediately written as one
+        line of a JSON lines file specified by the I(dest) or I(dest_dir)
+        option. The XML of each item is released once it is written.
+      - Use this option, optionally with the I(chunks) option, for tables
+        which are too large to return, such as the full routing table of
+        a core router. The I(response_type) option is ignored.
+      - The complete reply of each RPC is still received before its items
+        are written.
+    required: false
+    default: false
+    type: bool
   table:
     description:
       - Name of the PyEZ table used to retrieve data. If not specified,
@@ -114,9 +264,53 @@ options:
         one table is defined in I(file), the module fails with an error
         message. In this case, you must manually specify the name of the table
         by setting this option.
+      - The value may also be a list of table names defined in I(file). The
+        tables which use the same RPC with the same arguments are retrieved
+        with a single RPC, and its reply is used by each of the tables. For
+        example, several tables with different views of
+        C(get-interface-information). The I(kwargs), I(chunks) and I(where)
+        options apply to every table. The I(fields) option can only be used
+        with a single table.
+      - Replies are not shared by tables when the I(use_filter) or
+        I(stream_records) option is C(true).
     required: false
     default: The name of the table defined in the I(file) option.
-    type: str
+    type: list
+    aliases:
+      - tables
+  use_filter:
+    description:
+      - When C(true), PyEZ parses the reply with a SAX parser filter built
+        from the table's item, key and view fields, or only the fields in
+        the I(fields) option, and discards all other elements as the reply
+        is parsed. This reduces the memory and time needed to parse large
+        replies.
+      - Because the other elements are discarded, the I(where) option may
+        only reference the key and the kept fields.
+      - To reduce the data the device sends, use the I(kwargs) or I(chunks)
+        options to pass the arguments of the table's RPC which select
+        items on the device, such as a destination prefix or an interface
+        name.
+      - Requires PyEZ 2.3.0 or later.
+    required: false
+    default: false
+    type: bool
+  where:
+    description:
+      - A list of XPath expressions which filter the items of the table. Each
+        expression is evaluated against the XML of an item, and converted to
+        a boolean like the XPath boolean() function. Only the items for which
+        every expression is true are returned. Use C(or) within one
+        expression to return the items which match any of several
+        conditions.
+      - Items which do not match are skipped before their fields are
+        evaluated. The items of tables nested in a view field are not
+        filtered.
+      - The expressions use the element names of the reply, not the names
+        of the view fields. For example, C(oper-status = 'down').
+    required: false
+    default: none
+    type: list
 notes:
   - This module only works with operational tables/views; it does not work with
     configuration tables/views.
@@ -152,6 +346,80 @@ EXAMPLES = '''
       debug:
         var: response
 
+    - name: Retrieve the ARP table as columns
+      juniper_junos_table:
+        file: "arp.yml"
+        response_type: "columnar"
+      register: response
+    - name: Print the MAC address of each IP address
+      debug:
+        msg: "{{ item.0 }} is at {{ item.1 }}"
+      loop: "{{ response.resource.columns.ip_address |
+                zip(response.resource.columns.mac_address) | list }}"
+
+    - name: Retrieve the interfaces indexed by name and by state
+      juniper_junos_table:
+        file: "phyport.yml"
+        table: "PhyPortTable"
+        response_type: "indexed"
+        index_fields:
+          - "oper"
+      register: response
+    - name: Print the state of ge-0/0/0 and the names of the down interfaces
+      debug:
+        msg: "{{ response.resource['ge-0/0/0'].oper }},
+              {{ response.indexes.oper.down | default([]) }}"
+
+    - name: Retrieve the statistics and errors of interfaces with one RPC
+      juniper_junos_table:
+        file: "phyport.yml"
+        table:
+          - "PhyPortStatsTable"
+          - "PhyPortErrorTable"
+      register: response
+    - name: Print the errors
+      debug:
+        var: response.results[1].resource
+
+    - name: Retrieve only the interfaces which are down
+      juniper_junos_table:
+        file: "phyport.yml"
+        table: "PhyPortTable"
+        where:
+          - "oper-status != 'up'"
+        fields:
+          - "oper"
+          - "description"
+        use_filter: true
+      register: response
+
+    - name: Report the interfaces whose state changed since the last run
+      juniper_junos_table:
+        file: "phyport.yml"
+        table: "PhyPortTable"
+        fields:
+          - "admin"
+          - "oper"
+          - "description"
+        snapshot_dir: "./snapshots"
+      register: response
+    - name: Print the interfaces which changed
+      debug:
+        var: response.delta.changed
+      when: response.changed
+
+    - name: Save the full routing table, one routing table at a time
+      juniper_junos_table:
+        file: "routes.yml"
+        table: "RouteTable"
+        chunks:
+          - table: "inet.0"
+          - table: "inet6.0"
+          - table: "mpls.0"
+        stream_records: true
+        dest_dir: "./routes"
+      register: response
+
     - name: Retrieve from custom table in playbook directory
       juniper_junos_table:
         file: "fpc.yaml"
@@ -168,24 +436,76 @@ changed:
     - Indicates if the device's configuration has changed. Since this
       module does not change the operational or configuration state of the
       device, the value is always set to C(false).
+    - When the I(snapshot_dir) option is specified, indicates if any items
+      were added, removed or changed since the previous snapshot. For a list
+      of tables, the top-level value is C(true) if any table changed.
   returned: success
   type: bool
+delta:
+  description:
+    - The items which changed since the previous snapshot. A dictionary with
+      I(added), I(removed) and I(changed) keys. Each value is a dictionary
+      of items, in the format of the C(list_of_dicts) I(response_type),
+      keyed by table key. Added and changed items have their current values,
+      and removed items have the values of the previous snapshot.
+  returned: when the I(snapshot_dir) option is specified.
+  type: dict
+  sample: |
+    {
+      "added": {
+        "ge-0/0/4": {"admin": "up", "oper": "up", "description": null}
+      },
+      "changed": {
+        "ge-0/0/1": {"admin": "up", "oper": "down", "description": "uplink"}
+      },
+      "removed": {}
+    }
+delta_counts:
+  description:
+    - The number of I(added), I(removed), I(changed) and I(unchanged) items
+      since the previous snapshot.
+  returned: when the I(snapshot_dir) option is specified.
+  type: dict
 failed:
   description:
     - Indicates if the task failed.
   returned: always
   type: bool
+indexes:
+  description:
+    - The secondary indexes of the items. A dictionary with one index per
+      field name in the I(index_fields) option. Each index is a dictionary
+      keyed by field value, with the list of the table keys of the items
+      which have that value.
+  returned: when the I(response_type) option is C(indexed) and the
+            I(index_fields) option is specified.
+  type: dict
+  sample: |
+    {
+      "oper": {
+        "down": ["ge-0/0/1"],
+        "up": ["ge-0/0/0", "ge-0/0/2"]
+      }
+    }
 msg:
   description:
     - A human-readable message indicating a summary of the result.
   returned: always
   type: str
+record_count:
+  description:
+    - The number of items saved to the JSON lines file.
+  returned: when the I(stream_records) option is C(true).
+  type: int
 resource:
   description:
     - The items retrieved by the table/view.
-  returned: success
-  type: list of dicts if I(response_type) is C(list_of_dicts) or list of
-        lists if I(respsonse_type) is C(juniper_items).
+  returned: success, when the I(stream_records) option is C(false), the
+            I(snapshot_dir) option is not specified, and a single table is
+            specified.
+  type: list of dicts if I(response_type) is C(list_of_dicts), list of
+        lists if I(respsonse_type) is C(juniper_items), or dict if
+        I(response_type) is C(columnar) or C(indexed).
   sample: |
     # when response_type == 'list_of_dicts'
     [
@@ -208,6 +528,40 @@ resource:
          "remote_type": "Mac address"
       }
     ]
+    # when response_type == 'columnar' and dictionary_encoding == true
+    {
+      "keys": ["ge-0/0/3", "ge-0/0/0"],
+      "columns": {
+        "local_int": ["ge-0/0/3", "ge-0/0/0"],
+        "local_parent": {"dictionary": ["-"], "codes": [0, 0]},
+        "remote_chassis_id": ["00:05:86:08:d4:c0", "00:05:86:18:f3:c0"],
+        "remote_port_desc": {"dictionary": [null], "codes": [0, 0]},
+        "remote_port_id": ["ge-0/0/0", "ge-0/0/2"],
+        "remote_sysname": ["r5", "r4"],
+        "remote_type": {"dictionary": ["Mac address"], "codes": [0, 0]}
+      }
+    }
+    # when response_type == 'indexed'
+    {
+      "ge-0/0/3": {
+         "local_int": "ge-0/0/3",
+         "local_parent": "-",
+         "remote_chassis_id": "00:05:86:08:d4:c0",
+         "remote_port_desc": null,
+         "remote_port_id": "ge-0/0/0",
+         "remote_sysname": "r5",
+         "remote_type": "Mac address"
+      },
+      "ge-0/0/0": {
+         "local_int": "ge-0/0/0",
+         "local_parent": "-",
+         "remote_chassis_id": "00:05:86:18:f3:c0",
+         "remote_port_desc": null,
+         "remote_port_id": "ge-0/0/2",
+         "remote_sysname": "r4",
+         "remote_type": "Mac address"
+      }
+    }
     # when response_type == 'juniper_items'
     [
       [
@@ -277,13 +631,32 @@ resource:
         ]
       ]
     ]
+results:
+  description:
+    - The results of each table. Each element is a dictionary with the
+      I(msg), I(changed), I(failed), and I(resource), I(record_count), or
+      I(delta) and I(delta_counts) keys described above, and a I(table) key
+      with the name of the table.
+  returned: when the I(table) option is a list of more than one table.
+  type: list of dicts
 '''
 
 # Standard library imports
+from copy import deepcopy
+import gzip
+import hashlib
+import json
 import os.path
 
 # Constants
-RESPONSE_CHOICES = ['list_of_dicts', 'juniper_items']
+RESPONSE_CHOICES = ['list_of_dicts', 'juniper_items', 'columnar', 'indexed']
+
+# Parsed table/view files keyed by (file path, mtime, PyEZ version).
+_table_definitions = {}
+# Table classes keyed by (file path, mtime, PyEZ version, table name).
+_table_classes = {}
+# Compiled view fields keyed by view class.
+_compiled_views = {}
 
 
 """From Ansible 2.1, Ansible uses Ansiballz framework for assembling modules
@@ -295,47 +668,964 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils import juniper_junos_common
 
 
-def expand_items(module, data):
-    """Recursively expand any table items
+def table_dependencies(table_view, table):
+    """Return the names of the definitions needed to build a table.
+
+    A table needs its view. A view needs the view it extends and the
+    tables used as the value of any of its fields. Those tables need their
+    own views, and so on.
+
+    Args:
+        table_view: The dict of table/view definitions parsed from a file.
+        table: The name of the table.
+
+    Returns:
+        The names of the table and its dependencies, in the order they are
+        defined in table_view.
+
+    Raises:
+        KeyError: If table is not defined in table_view.
     """
+    needed = set()
+    pending = [table]
+    while pending:
+        name = pending.pop()
+        if name in needed:
+            continue
+        definition = table_view[name]
+        needed.add(name)
+        if not isinstance(definition, dict):
+            continue
+        for (key, value) in definition.items():
+            if key in ['view', 'extends']:
+                references = [value]
+            elif key.startswith('fields') and isinstance(value, dict):
+                references = list(value.values())
+            else:
+                continue
+            for reference in references:
+                try:
+                    if reference in table_view:
+                        pending.append(reference)
+                except TypeError:
+                    # Unhashable values, like {xpath: type}, are not names.
+                    pass
+    return [name for name in table_view if name in needed]
+
+
+def load_table_definitions(module, file_name):
+    """Return the table/view definitions parsed from a YAML file.
+
+    Parsed files are kept in memory, and, if the cache_dir option is set,
+    also saved as JSON, which is much faster to load than YAML, in the
+    tables subdirectory of cache_dir, so later tasks do not parse them
+    again. The cache key is the file's path and modification time and the
+    PyEZ version, so an edited file or a PyEZ upgrade is parsed again.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        file_name: The path of the YAML file.
+
+    Returns:
+        The dict of table/view definitions.
+
+    Raises:
+        IOError/OSError: If the file can not be read.
+        yaml.YAMLError: If the file is not valid YAML.
+    """
+    file_name = os.path.abspath(file_name)
+    cache_key = (file_name, os.path.getmtime(file_name),
+                 juniper_junos_common.HAS_PYEZ_VERSION)
+    table_view = _table_definitions.get(cache_key)
+    if table_view is not None:
+        return table_view
+    cache_file = None
+    if module.params.get('cache_dir') is not None:
+        digest = hashlib.sha1(json.dumps(cache_key).encode('utf-8'))
+        cache_file = os.path.join(module.params.get('cache_dir'), 'tables',
+                                  digest.hexdigest() + '.json')
+        try:
+            with open(cache_file, 'r') as fp:
+                table_view = json.load(fp)
+            module.logger.debug("Table definitions of %s loaded from: %s.",
+                                file_name, cache_file)
+        except (IOError, OSError, ValueError):
+            module.logger.debug("No cached table definitions for %s.",
+                                file_name)
+    if table_view is None:
+        with open(file_name, 'r') as fp:
+            module.logger.debug("Attempting to parse YAML from : %s.",
+                                file_name)
+            table_view = juniper_junos_common.safe_load_yaml(fp)
+            module.logger.debug("YAML from %s successfully parsed.",
+                                file_name)
+        if cache_file is not None:
+            save_table_definitions(module, cache_file, table_view)
+    _table_definitions[cache_key] = table_view
+    return table_view
+
+
+def save_table_definitions(module, cache_file, table_view):
+    """Save parsed table/view definitions as JSON.
+
+    Definitions which do not survive a JSON round trip unchanged, such as
+    those with non-string keys, are not saved. Like the other caches, the
+    file is written to a temporary file which is then renamed, and a
+    failure is only logged.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        cache_file: The path of the JSON file.
+        table_view: The dict of table/view definitions.
+    """
+    try:
+        text = json.dumps(table_view)
+        if json.loads(text) != table_view:
+            module.logger.debug("Table definitions can not be cached.")
+            return
+        # Hosts which share cache_dir may create it at the same time.
+        try:
+            os.makedirs(os.path.dirname(cache_file))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                raise
+        tmp_path = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            fp.write(text)
+        os.rename(tmp_path, cache_file)
+        module.logger.debug("Table definitions saved to: %s.", cache_file)
+    except (TypeError, ValueError, IOError, OSError) as ex:
+        module.logger.warning("Unable to save table definitions to %s. "
+                              "Error: %s", cache_file, str(ex))
+
+
+def load_table(module, file_name, table_view, table):
+    """Return the PyEZ table class for a table.
+
+    Only the table and the definitions it depends on are built with PyEZ's
+    FactoryLoader, not every table and view in the file. Built classes
+    are kept in memory. Unlike the parsed definitions, they can not be
+    serialized to cache_dir.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        file_name: The path of the YAML file.
+        table_view: The dict of table/view definitions parsed from the file.
+        table: The name of the table.
+
+    Returns:
+        The table class.
+
+    Raises:
+        KeyError: If table is not defined in table_view.
+        Exception: Any exception raised by FactoryLoader.
+    """
+    file_name = os.path.abspath(file_name)
+    cache_key = (file_name, os.path.getmtime(file_name),
+                 juniper_junos_common.HAS_PYEZ_VERSION, table)
+    table_class = _table_classes.get(cache_key)
+    if table_class is None:
+        names = table_dependencies(table_view, table)
+        module.logger.debug("Building table %s from: %s.", table, names)
+        # FactoryLoader modifies the definitions, so it gets copies.
+        catalog = dict((name, deepcopy(table_view[name])) for name in names)
+        loader = module.pyez_factory_loader.FactoryLoader().load(catalog)
+        table_class = loader[table]
+        _table_classes[cache_key] = table_class
+    return table_class
+
+
+def item_matches(element, where):
+    """Return True if a table item satisfies every where condition.
+
+    Args:
+        element: The lxml element of the item.
+        where: A list of compiled etree.XPath objects, or None.
+
+    Returns:
+        True if where is None, or if every XPath expression, evaluated
+        against the item's XML, is true according to the XPath boolean()
+        function.
+    """
+    if where is None:
+        return True
+    for xpath in where:
+        if not xpath(element):
+            return False
+    return True
+
+
+def compile_view(module, view_class):
+    """Return the compiled fields of a PyEZ view class.
+
+    The XPath expressions of the view's fields and groups are compiled
+    with juniper_junos_common.compile_xpath(), and the compiled fields are
+    kept per view class, so every item of every table with the view shares
+    them.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        view_class: The PyEZ view class, or None.
+
+    Returns:
+        A tuple of a list of (group name, XPath) tuples, and a list of
+        (field name, XPath, astype, group name, table class) tuples in the
+        order of the view's fields. The XPath of a field is None if the
+        field is a nested table, or if its value is evaluated by the view
+        itself, such as an eval field.
+    """
+    if view_class is None:
+        return ([], [])
+    compiled = _compiled_views.get(view_class)
+    if compiled is not None:
+        return compiled
+    groups = []
+    for (group, expression) in (view_class.GROUPS or {}).items():
+        groups.append((group,
+                       juniper_junos_common.compile_xpath(expression)))
+    evals = getattr(view_class, 'EVAL', None) or {}
+    fields = []
+    for (name, field) in view_class.FIELDS.items():
+        if name in evals or not isinstance(field, dict):
+            fields.append((name, None, str, None, None))
+            continue
+        xpath = None
+        if 'table' not in field:
+            try:
+                xpath = juniper_junos_common.compile_xpath(field['xpath'])
+            except (module.etree.XPathError, KeyError, TypeError):
+                # Left for the view to evaluate, or to report.
+                pass
+        fields.append((name, xpath, field.get('astype', str),
+                       field.get('group'), field.get('table')))
+    compiled = (groups, fields)
+    _compiled_views[view_class] = compiled
+    return compiled
+
+
+def field_value(found, astype):
+    """Convert the node-set of a view field to the field's value.
+
+    This is the conversion done by PyEZ's View.__getattr__(). The text of
+    each node is stripped, a node with no text is replaced by its tag, and
+    the result is passed to astype.
+
+    Args:
+        found: The list of nodes and strings selected by the field's XPath.
+        astype: The type of the field.
+
+    Returns:
+        The value of the field. None if found is empty, or a list if it has
+        more than one node. For a bool field, whether found is not empty.
+    """
+    if astype is bool:
+        return bool(len(found))
+    if not found:
+        return None
+    values = []
+    for node in found:
+        if isinstance(node, juniper_junos_common.basestring):
+            text = node
+        else:
+            text = node.text
+        if text is not None:
+            if not isinstance(text, str):
+                # Non-ASCII text on Python 2, which PyEZ also encodes.
+                text = text.encode('ascii', 'replace')
+            text = text.strip()
+        if not text:
+            text = node.tag
+        values.append(astype(text))
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def extract_fields(table, compiled, element):
+    """Evaluate the fields of a table item in one pass.
+
+    Each field's compiled XPath is evaluated against the item's element,
+    or its group's element, without creating a PyEZ View. A View is only
+    created for fields which the compiled XPaths can not evaluate the same
+    way PyEZ does, such as eval fields and XPath expressions which return
+    a string or a number instead of a node-set.
+
+    Args:
+        table: The PyEZ Table.
+        compiled: The compiled fields of the table's view, as returned by
+                  compile_view().
+        element: The lxml element of the item.
+
+    Returns:
+        A list of (field name, value) tuples. The value of a field which is
+        a nested Table is the nested Table.
+
+    Raises:
+        RuntimeError: If a field's value can not be converted.
+    """
+    (groups, fields) = compiled
+    group_elements = {}
+    for (group, xpath) in groups:
+        found = xpath(element)
+        if len(found):
+            group_elements[group] = found[0]
+    view = None
+    values = []
+    for (name, xpath, astype, group, sub_table) in fields:
+        if sub_table is not None:
+            value = sub_table(table.D, element)
+        elif xpath is not None and group is not None and \
+                group not in group_elements:
+            value = None
+        else:
+            found = None
+            if xpath is not None:
+                found = xpath(group_elements[group] if group is not None
+                              else element)
+            if isinstance(found, list):
+                try:
+                    value = field_value(found, astype)
+                except Exception:
+                    raise RuntimeError("Unable to handle field:'%s'" % name)
+            else:
+                if view is None:
+                    view = table.view(table, element)
+                value = getattr(view, name)
+        values.append((name, value))
+    return values
+
+
+def table_elements(table):
+    """Return the lxml elements of the items of a PyEZ Table.
+
+    Args:
+        table: The PyEZ Table.
+
+    Returns:
+        A list of elements, in the order PyEZ iterates over the items.
+    """
+    if table.xml is None:
+        raise RuntimeError("Table is empty, use get()")
+    return juniper_junos_common.compile_xpath(table.ITEM_XPATH)(table.xml)
+
+
+def expand_items(module, data, where=None):
+    """Convert Juniper PyEZ Table/View items to a list of (key, fields).
+
+    Each item is converted to a tuple of its table key and a list of
+    (field name, value) tuples. The value of a field which is a nested
+    Table is converted the same way. Nested Tables are converted with an
+    explicit stack instead of recursion, and each field of each item is
+    evaluated exactly once.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        where: A list of compiled etree.XPath objects. Items of data which
+               do not satisfy all of them are skipped before any of their
+               fields are evaluated. Items of nested Tables are not
+               filtered.
+
+    Returns:
+        A list of (key, fields) tuples. One per table item.
+    """
+    table_class = module.pyez_factory_table.Table
     resources = []
-    # data.items() is a list of tuples
-    for table_key, table_fields in data.items():
-        # sample:
-        # ('fxp0', [('neighbor_interface', '1'), ('local_interface', 'fxp0'),
-        # ('neighbor', 'vmx2')]
-        # table_key - element 0 is the key from the Table - not using at all
-        # table_fields - element 1 is also a list of tuples
-        temp = []
-        for key, value in table_fields:
-            # calling it normalized value because YOU/WE created the keys
-            if value and isinstance(value, module.pyez_factory_table.Table):
-                value = expand_items(module, value)
-            temp.append((key, value))
-        resources.append((table_key, temp))
+    pending = [(data, resources, where)]
+    while pending:
+        (table, items, conditions) = pending.pop()
+        compiled = compile_view(module, table.view)
+        for (table_key, element) in zip(table.keys(), table_elements(table)):
+            if not item_matches(element, conditions):
+                continue
+            fields = []
+            for (name, value) in extract_fields(table, compiled, element):
+                if isinstance(value, table_class):
+                    # Filled in when the nested Table is popped.
+                    sub_items = []
+                    pending.append((value, sub_items, None))
+                    value = sub_items
+                fields.append((name, value))
+            items.append((table_key, fields))
     return resources
 
 
-def juniper_items_to_list_of_dicts(module, data):
-    """Recursively convert Juniper PyEZ Table/View items to list of dicts.
+def juniper_items_to_list_of_dicts(module, data, where=None):
+    """Convert Juniper PyEZ Table/View items to a list of dicts.
+
+    Each item is converted to a dict of its field names and values. The
+    value of a field which is a nested Table is converted the same way.
+    Nested Tables are converted with an explicit stack instead of
+    recursion, and each field of each item is evaluated exactly once.
+
+    Like PyEZ's Table.items(), the items are paired with the table keys,
+    although the keys are not part of the result. So only as many items
+    as there are keys are converted, and a table without a key converts
+    no items.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        where: A list of compiled etree.XPath objects. Items of data which
+               do not satisfy all of them are skipped before any of their
+               fields are evaluated. Items of nested Tables are not
+               filtered.
+
+    Returns:
+        A list of dicts. One per table item.
     """
+    table_class = module.pyez_factory_table.Table
     resources = []
-    # data.items() is a list of tuples
-    for table_key, table_fields in data.items():
-        # sample:
-        # ('fxp0', [('neighbor_interface', '1'), ('local_interface', 'fxp0'),
-        # ('neighbor', 'vmx2')]
-        # table_key - element 0 is the key from the Table - not using at all
-        # table_fields - element 1 is also a list of tuples
-        temp = {}
-        for key, value in table_fields:
-            if (value and isinstance(value, module.pyez_factory_table.Table)):
-                value = juniper_items_to_list_of_dicts(module, value)
-            temp[key] = value
-        resources.append(temp)
+    pending = [(data, resources, where)]
+    while pending:
+        (table, items, conditions) = pending.pop()
+        compiled = compile_view(module, table.view)
+        elements = table_elements(table)[:len(table.keys())]
+        for element in elements:
+            if not item_matches(element, conditions):
+                continue
+            item = {}
+            for (name, value) in extract_fields(table, compiled, element):
+                if isinstance(value, table_class):
+                    # Filled in when the nested Table is popped.
+                    sub_items = []
+                    pending.append((value, sub_items, None))
+                    value = sub_items
+                item[name] = value
+            items.append(item)
     return resources
 
 
+def dictionary_encode(values):
+    """Dictionary-encode a column if it has few distinct values.
+
+    Args:
+        values: The list of values of a column.
+
+    Returns:
+        A dict with a 'dictionary' list of the distinct values, in order of
+        first appearance, and a 'codes' list with the index into
+        'dictionary' of each value. The values are returned unchanged if
+        they are not hashable, or if more than half of them are distinct.
+    """
+    index = {}
+    codes = []
+    try:
+        for value in values:
+            # The type is part of the key, so True and 1 stay distinct.
+            codes.append(index.setdefault((value.__class__, value),
+                                          len(index)))
+    except TypeError:
+        return values
+    if len(index) * 2 > len(values):
+        return values
+    dictionary = [None] * len(index)
+    for ((_, value), code) in index.items():
+        dictionary[code] = value
+    return {'dictionary': dictionary, 'codes': codes}
+
+
+def juniper_items_to_columns(module, data, dictionary_encoding=False,
+                             where=None, first_position=0):
+    """Convert Juniper PyEZ Table/View items to columns.
+
+    The items are converted to a 'keys' list, with the table key of each
+    item, and a 'columns' dict, with a list of the values of each view
+    field, in item order. If the table has no key, or some of its items
+    have no key, the 'keys' list holds the position of each item in the
+    table instead, starting from first_position. The value of a field
+    which is a nested Table is converted the same way. Like
+    juniper_items_to_list_of_dicts(), nested Tables are converted with an
+    explicit stack and each field of each item is evaluated exactly once.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        dictionary_encoding: If True, the columns are passed through
+                             dictionary_encode_columns().
+        where: A list of compiled etree.XPath objects. Items of data which
+               do not satisfy all of them are skipped before any of their
+               fields are evaluated. Items of nested Tables are not
+               filtered.
+        first_position: The position of the first item of data. Used when
+                        data is one chunk of a table. Nested Tables always
+                        start from 0.
+
+    Returns:
+        A dict with the 'keys' and 'columns' keys.
+    """
+    table_class = module.pyez_factory_table.Table
+    resource = {}
+    pending = [(data, resource, where, first_position)]
+    while pending:
+        (table, columnar, conditions, first) = pending.pop()
+        compiled = compile_view(module, table.view)
+        columns = dict((field[0], []) for field in compiled[1])
+        # The position of each item which is converted.
+        positions = []
+        count = 0
+        for element in table_elements(table):
+            count += 1
+            if not item_matches(element, conditions):
+                continue
+            for (name, value) in extract_fields(table, compiled, element):
+                if isinstance(value, table_class):
+                    # Filled in when the nested Table is popped.
+                    sub_columnar = {}
+                    pending.append((value, sub_columnar, None, 0))
+                    value = sub_columnar
+                columns[name].append(value)
+            positions.append(count - 1)
+        keys = table.keys()
+        if len(keys) != count:
+            # Not every item has a key, so the keys can not be matched
+            # with the items. Use the position of each item instead.
+            keys = list(range(first, first + count))
+        columnar['keys'] = [keys[position] for position in positions]
+        columnar['columns'] = columns
+    if dictionary_encoding is True:
+        dictionary_encode_columns(resource)
+    return resource
+
+
+def dictionary_encode_columns(resource):
+    """Dictionary-encode the columns of a columnar resource in place.
+
+    Each column of the resource, and of any nested Table converted by
+    juniper_items_to_columns(), is passed through dictionary_encode().
+
+    Args:
+        resource: A dict returned by juniper_items_to_columns().
+    """
+    pending = [resource]
+    while pending:
+        columns = pending.pop()['columns']
+        for (name, values) in columns.items():
+            for value in values:
+                if isinstance(value, dict) and 'columns' in value:
+                    pending.append(value)
+            columns[name] = dictionary_encode(values)
+
+
+def iter_table_records(module, data, where=None):
+    """Yield the items of a Table as dicts, freeing their XML as it goes.
+
+    Each item is converted like juniper_items_to_list_of_dicts() converts
+    it. Once an item is converted, or skipped, its XML is cleared, so the
+    reply does not have to be held in memory as both XML and dicts.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        where: A list of compiled etree.XPath objects. Items which do not
+               satisfy all of them are skipped.
+
+    Yields:
+        One dict per table item.
+    """
+    table_class = module.pyez_factory_table.Table
+    compiled = compile_view(module, data.view)
+    for element in table_elements(data):
+        if not item_matches(element, where):
+            element.clear()
+            continue
+        record = {}
+        for (name, value) in extract_fields(data, compiled, element):
+            if isinstance(value, table_class):
+                value = juniper_items_to_list_of_dicts(module, value)
+            record[name] = value
+        yield record
+        element.clear()
+
+
+def juniper_items_to_keyed_dicts(module, data, where=None):
+    """Convert Juniper PyEZ Table/View items to a list of (key, dict).
+
+    Each item is converted to a tuple of its table key, as returned by
+    table_key_string(), and a dict like juniper_items_to_list_of_dicts()
+    returns.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        where: A list of compiled etree.XPath objects. Items which do not
+               satisfy all of them are skipped.
+
+    Returns:
+        A list of (key, dict) tuples. One per table item.
+
+    Raises:
+        ValueError: If the items of the table have no key.
+    """
+    table_class = module.pyez_factory_table.Table
+    compiled = compile_view(module, data.view)
+    elements = table_elements(data)
+    keys = data.keys()
+    if len(keys) != len(elements):
+        raise ValueError('The items of the table do not all have a key.')
+    rows = []
+    for (table_key, element) in zip(keys, elements):
+        if not item_matches(element, where):
+            continue
+        row = {}
+        for (name, value) in extract_fields(data, compiled, element):
+            if isinstance(value, table_class):
+                value = juniper_items_to_list_of_dicts(module, value)
+            row[name] = value
+        rows.append((table_key_string(table_key), row))
+    return rows
+
+
+def table_key_string(table_key):
+    """Return a table key as a string.
+
+    Args:
+        table_key: A simple key, or a tuple of the values of a composite
+                   key.
+
+    Returns:
+        The key, as a text string. The values of a composite key are joined
+        with '|', and a missing value is an empty string.
+    """
+    if isinstance(table_key, (tuple, list)):
+        return u'|'.join(u'' if value is None else text_type(value)
+                         for value in table_key)
+    return text_type(table_key)
+
+
+def rows_by_key(module, table, keyed_rows):
+    """Return the rows of a table as a dict keyed by table key.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        table: The name of the table.
+        keyed_rows: A list of (key, dict) tuples, as returned by
+                    juniper_items_to_keyed_dicts().
+
+    Returns:
+        A dict of the rows, keyed by table key. If several rows have the
+        same key, the last one is kept.
+    """
+    rows = dict(keyed_rows)
+    if len(rows) != len(keyed_rows):
+        module.logger.warning('Table %s has duplicate keys. Only the last '
+                              'item of each key is kept.', table)
+    return rows
+
+
+def secondary_indexes(rows, index_fields):
+    """Index the rows of a table by the values of some of their fields.
+
+    Args:
+        rows: A dict of the rows, keyed by table key.
+        index_fields: A list of field names.
+
+    Returns:
+        A dict with one index per field name. Each index is a dict keyed by
+        the string form of the field's values, as JSON would convert them,
+        with the list of the table keys of the rows which have that value.
+        Each value of a field with a list of values is indexed. Values which
+        are not strings, numbers, booleans or null, such as nested tables,
+        are not indexed.
+    """
+    indexes = dict((name, {}) for name in index_fields)
+    for (key, row) in rows.items():
+        for name in index_fields:
+            values = row.get(name)
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                if value is None or isinstance(value, bool):
+                    value = json.dumps(value)
+                elif isinstance(value, (int, float)):
+                    value = str(value)
+                elif not isinstance(value, juniper_junos_common.basestring):
+                    continue
+                indexes[name].setdefault(value, []).append(key)
+    return indexes
+
+
+def snapshot_file_path(module, table):
+    """Return the path of the snapshot of a table for the current host.
+
+    The file name includes a hash of the kwargs, chunks, where, and fields
+    options. A task which selects different items, or different fields,
+    of the same table uses a different snapshot, so its items are never
+    compared with items selected by other arguments.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        table: The name of the table.
+
+    Returns:
+        The path of the snapshot file in the snapshot_dir directory.
+    """
+    selection = [module.params.get('kwargs'),
+                 module.params.get('chunks'),
+                 sorted(module.params.get('where') or []),
+                 sorted(module.params.get('fields') or [])]
+    digest = hashlib.sha1(json.dumps(selection, sort_keys=True)
+                          .encode('utf-8')).hexdigest()
+    file_name = '%s_%s_%s.snapshot.json.gz' % (module.params.get('host'),
+                                               table, digest)
+    return os.path.normpath(os.path.join(module.params.get('snapshot_dir'),
+                                         file_name))
+
+
+def load_snapshot(module, file_path):
+    """Return the rows saved in a snapshot file.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        file_path: The path of the snapshot file.
+
+    Returns:
+        A dict of the rows, keyed by table key. An empty dict if there is
+        no snapshot, or if it can not be read.
+    """
+    try:
+        with gzip.open(file_path, 'rb') as snapshot_file:
+            snapshot = json.loads(snapshot_file.read().decode('utf-8'))
+        module.logger.debug("Snapshot loaded from: %s.", file_path)
+        return snapshot['rows']
+    except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+        module.logger.debug("No snapshot loaded from %s. Error: %s",
+                            file_path, str(ex))
+        return {}
+
+
+def save_snapshot(module, file_path, table, rows):
+    """Save the rows of a table as a gzip compressed JSON snapshot file.
+
+    The file is written to a temporary file which is then renamed, so an
+    interrupted run leaves the previous snapshot intact.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        file_path: The path of the snapshot file.
+        table: The name of the table.
+        rows: A dict of the rows, keyed by table key.
+
+    Fails:
+        If the snapshot file can not be written.
+    """
+    text = json.dumps({'table': table, 'rows': rows},
+                      separators=(',', ':'), sort_keys=True)
+    tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+    try:
+        # Hosts which share snapshot_dir may create it at the same time.
+        try:
+            os.makedirs(os.path.dirname(file_path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(file_path)):
+                raise
+        with juniper_junos_common.open_output_file(tmp_path, 'wb',
+                                                   'gzip') as snapshot_file:
+            snapshot_file.write(text.encode('utf-8'))
+        os.rename(tmp_path, file_path)
+        module.logger.debug("Snapshot saved to: %s.", file_path)
+    except (IOError, OSError) as ex:
+        module.fail_json(msg='Unable to save the snapshot of table %s to '
+                             '%s. Error: %s' % (table, file_path, str(ex)))
+
+
+def snapshot_delta(old_rows, new_rows):
+    """Compare the rows of a table with the rows of its last snapshot.
+
+    Args:
+        old_rows: A dict of the snapshot's rows, keyed by table key.
+        new_rows: A dict of the current rows, keyed by table key.
+
+    Returns:
+        A tuple of the delta and the counts. The delta is a dict with
+        'added', 'removed' and 'changed' dicts of rows keyed by table key.
+        Added and changed rows are the current rows, and removed rows are
+        the snapshot's rows. The counts is a dict with the number of
+        'added', 'removed', 'changed' and 'unchanged' rows.
+    """
+    delta = {'added': {}, 'removed': {}, 'changed': {}}
+    unchanged = 0
+    for (key, row) in new_rows.items():
+        if key not in old_rows:
+            delta['added'][key] = row
+        elif old_rows[key] != row:
+            delta['changed'][key] = row
+        else:
+            unchanged += 1
+    for (key, row) in old_rows.items():
+        if key not in new_rows:
+            delta['removed'][key] = row
+    counts = dict((name, len(rows)) for (name, rows) in delta.items())
+    counts['unchanged'] = unchanged
+    return (delta, counts)
+
+
+def project_table(module, table_class, table, fields):
+    """Return a table class whose view only has some of the view's fields.
+
+    The table class and its view are subclassed, rather than modified, so
+    the cached table class is unchanged. Because PyEZ builds the SAX parser
+    filter of a table from its view's fields, the filter only keeps the
+    projected fields too.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        table_class: The PyEZ table class.
+        table: The name of the table.
+        fields: The list of field names to keep, in order.
+
+    Returns:
+        The projected table class.
+
+    Fails:
+        If the table has no view, or if a field is not a field of the view.
+    """
+    view_class = table_class.VIEW
+    if view_class is None:
+        module.fail_json(msg='The fields option can not be used with table '
+                             '%s because it has no view.' % (table))
+    invalid = [name for name in fields if name not in view_class.FIELDS]
+    if invalid:
+        module.fail_json(msg='The fields %s are not fields of the view of '
+                             'table %s. Valid fields are: %s.' %
+                             (', '.join(invalid), table,
+                              ', '.join(view_class.FIELDS)))
+    view_fields = dict((name, view_class.FIELDS[name]) for name in fields)
+    projected_view = type(view_class.__name__, (view_class,),
+                          {'FIELDS': view_fields})
+    return type(table_class.__name__, (table_class,),
+                {'VIEW': projected_view})
+
+
+def get_table(module, table_class, table, kwargs, use_filter=False):
+    """Create a table and retrieve its data from the device.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        table_class: The PyEZ table class.
+        table: The name of the table.
+        kwargs: The keyword arguments of the table's get() method.
+        use_filter: If True, PyEZ parses the reply with a SAX parser filter
+                    built from the table's key and view fields.
+
+    Returns:
+        The PyEZ Table.
+
+    Fails:
+        If the data can not be retrieved.
+    """
+    try:
+        data = table_class(module.dev)
+        module.logger.debug("Table %s created successfully.", table)
+        if use_filter is True:
+            data.get(use_filter=True, **kwargs)
+        else:
+            data.get(**kwargs)
+        module.logger.debug("Data retrieved from %s successfully.", table)
+    except (module.pyez_exception.ConnectError,
+            module.pyez_exception.RpcError) as ex:
+        module.fail_json(msg='Unable to retrieve data from table %s. '
+                             'Error: %s' % (table, str(ex)))
+    return data
+
+
+def group_tables(table_classes, kwargs, use_filter=False):
+    """Group the tables which retrieve their data with the same RPC.
+
+    Tables are grouped if they have the same RPC and the same RPC arguments,
+    after the table's default arguments are updated with kwargs like
+    OpTable.get() updates them. The reply of the first table of a group can
+    then be reused by the other tables of the group.
+
+    Args:
+        table_classes: The list of PyEZ table classes.
+        kwargs: The keyword arguments of the tables' get() method.
+        use_filter: If True, the reply is filtered for each table's view,
+                    so no tables are grouped.
+
+    Returns:
+        A list of groups, in order of their first table. Each group is a
+        list of indices into table_classes.
+    """
+    groups = []
+    group_keys = {}
+    for (index, table_class) in enumerate(table_classes):
+        args = dict(getattr(table_class, 'GET_ARGS', None) or {})
+        if isinstance(kwargs.get('args'), dict):
+            args.update(kwargs['args'])
+        args.update((key, value) for (key, value) in kwargs.items()
+                    if key != 'args' or not isinstance(value, dict))
+        try:
+            group_key = (getattr(table_class, 'GET_RPC', None),
+                         json.dumps(args, sort_keys=True))
+        except (TypeError, ValueError):
+            group_key = None
+        if use_filter is True or group_key is None:
+            groups.append([index])
+        elif group_key in group_keys:
+            group_keys[group_key].append(index)
+        else:
+            group_keys[group_key] = [index]
+            groups.append(group_keys[group_key])
+    return groups
+
+
+def convert_table(module, data, table, response_type, where=None,
+                  first_position=0):
+    """Convert the items of a Table to the format of response_type.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        data: The PyEZ Table.
+        table: The name of the table.
+        response_type: The value of the response_type option, or
+                       'keyed_dicts' for juniper_items_to_keyed_dicts().
+        where: A list of compiled etree.XPath objects, or None.
+        first_position: The position of the first item of data, for the
+                        positional keys of juniper_items_to_columns().
+
+    Returns:
+        The converted items.
+
+    Fails:
+        If the items can not be converted.
+    """
+    try:
+        if response_type == 'list_of_dicts':
+            module.logger.debug('Converting data to list of dicts.')
+            return juniper_items_to_list_of_dicts(module, data, where=where)
+        elif response_type == 'columnar':
+            module.logger.debug('Converting data to columns.')
+            return juniper_items_to_columns(module, data, where=where,
+                                            first_position=first_position)
+        elif response_type == 'keyed_dicts':
+            module.logger.debug('Converting data to keyed dicts.')
+            return juniper_items_to_keyed_dicts(module, data, where=where)
+        else:
+            return expand_items(module, data, where=where)
+    except Exception as ex:
+        module.fail_json(msg='Unable to parse table %s data into '
+                             'items. Error: %s' % (table, str(ex)))
+
+
+def exit_with_results(module, results):
+    """Exit the module with the results of the tables.
+
+    Args:
+        module: The JuniperJunosModule instance.
+        results: The list of result dicts. One per table.
+    """
+    if len(results) == 1:
+        result = dict(results[0])
+        del result['table']
+        module.exit_json(**result)
+    else:
+        changed = any(result.get('changed') is True for result in results)
+        module.exit_json(results=results,
+                         changed=changed,
+                         failed=False)
+
+
 def main():
     # Create the module instance.
     junos_module = juniper_junos_common.JuniperJunosModule(
@@ -343,8 +1633,9 @@ def main():
             file=dict(type='path',
                       required=True,
                       default=None),
-            table=dict(type='str',
+            table=dict(type='list',
                        required=False,
+                       aliases=['tables'],
                        default=None),
             path=dict(type='path',
                       required=False,
@@ -358,18 +1649,55 @@ def main():
                                type='str',
                                required=False,
                                default='list_of_dicts'),
+            dictionary_encoding=dict(required=False,
+                                     type='bool',
+                                     default=False),
+            cache_dir=dict(required=False,
+                           type='path',
+                           default=None),
+            chunks=dict(required=False,
+                        type='list',
+                        default=None),
+            stream_records=dict(required=False,
+                                type='bool',
+                                default=False),
+            dest=dict(required=False,
+                      type='path',
+                      aliases=['destination'],
+                      default=None),
+            dest_dir=dict(required=False,
+                          type='path',
+                          aliases=['destination_dir', 'destdir'],
+                          default=None),
+            where=dict(required=False,
+                       type='list',
+                       default=None),
+            fields=dict(required=False,
+                        type='list',
+                        default=None),
+            use_filter=dict(required=False,
+                            type='bool',
+                            default=False),
+            snapshot_dir=dict(required=False,
+                              type='path',
+                              default=None),
+            index_fields=dict(required=False,
+                              type='list',
+                              default=None),
         ),
         # Check mode is implemented.
         supports_check_mode=True,
+        mutually_exclusive=[['dest', 'dest_dir']],
         min_yaml_version=juniper_junos_common.MIN_YAML_VERSION,
     )
 
     # Straight from params
     file = junos_module.params.get('file')
-    table = junos_module.params.get('table')
+    tables = junos_module.params.get('table')
     path = junos_module.params.get('path')
     kwargs = junos_module.params.get('kwargs')
     response_type = junos_module.params.get('response_type')
+    snapshot_dir = junos_module.params.get('snapshot_dir')
 
     if not file.endswith('.yml') and not file.endswith('.yaml'):
         junos_module.fail_json(msg='The value of the file option must end '
@@ -385,92 +1713,225 @@ def main():
 
     junos_module.logger.debug("Attempting to open: %s.", file_name)
     try:
-        with open(file_name, 'r') as fp:
-            try:
-                junos_module.logger.debug("Attempting to parse YAML from : "
-                                          "%s.", file_name)
-                table_view = junos_module.yaml.load(fp)
-                junos_module.logger.debug("YAML from %s successfully parsed.",
-                                          file_name)
-            except junos_module.yaml.YAMLError as ex:
-                junos_module.fail_json(msg='Failed parsing YAML file %s. '
-                                           'Error: %s' % (file_name, str(ex)))
-    except IOError:
+        table_view = load_table_definitions(junos_module, file_name)
+    except junos_module.yaml.YAMLError as ex:
+        junos_module.fail_json(msg='Failed parsing YAML file %s. '
+                                   'Error: %s' % (file_name, str(ex)))
+    except (IOError, OSError):
         junos_module.fail_json(msg='The file name %s could not be opened for'
                                    'reading.' % (file_name))
     junos_module.logger.debug("%s successfully read.", file_name)
 
-    # Initialize the results. Assume failure until we know it's success.
-    results = {'msg': '',
-               'changed': False,
-               'failed': True}
-
     # Default to the table defined in file_name.
     # Ignore table names which begin with an underscore.
-    if table is None:
+    if not tables:
+        tables = []
         for key in table_view:
             if not key.startswith('_') and 'Table' in key:
-                if table is not None:
+                if tables:
                     junos_module.fail_json(
                         msg='The file name %s contains multiple table '
                             'definitions. Specify the desired table with the '
                             'table option.' % (file_name))
-                table = key
+                tables.append(key)
 
-    if table is None:
+    if not tables:
         junos_module.fail_json(
             msg='No table definition was found in the %s file. Specify a '
                 'value for the file option which contains a valid table/view '
                 'definition.' % (file_name))
-    junos_module.logger.debug("Table: %s", table)
+    junos_module.logger.debug("Tables: %s", tables)
 
-    try:
-        loader = \
-            junos_module.pyez_factory_loader.FactoryLoader().load(table_view)
-        junos_module.logger.debug("Loader created successfully.")
-    except Exception as ex:
-        junos_module.fail_json(msg='Unable to create a table loader from the '
-                                   '%s file. Error: %s' % (file_name, str(ex)))
-    try:
-        data = loader[table](junos_module.dev)
-        junos_module.logger.debug("Table %s created successfully.", table)
-        if kwargs is None:
-            data.get()
-        else:
-            data.get(**kwargs)
-        junos_module.logger.debug("Data retrieved from %s successfully.",
-                                  table)
-    except KeyError:
-        junos_module.fail_json(msg='Unable to find table %s in the '
-                                   '%s file.' % (table, file_name))
-    except (junos_module.pyez_exception.ConnectError,
-            junos_module.pyez_exception.RpcError) as ex:
-        junos_module.fail_json(msg='Unable to retrieve data from table %s. '
-                                   'Error: %s' % (table, str(ex)))
-
-    if data is not None:
+    table_classes = []
+    for table in tables:
+        if table not in table_view:
+            junos_module.fail_json(msg='Unable to find table %s in the '
+                                       '%s file.' % (table, file_name))
         try:
-            len_data = len(data)
+            table_classes.append(load_table(junos_module, file_name,
+                                            table_view, table))
+            junos_module.logger.debug("Loader created successfully.")
         except Exception as ex:
-            junos_module.fail_json(msg='Unable to parse table %s data into '
-                                       'items. Error: %s' % (table, str(ex)))
-        junos_module.logger.debug('Successfully retrieved %d items from %s.',
-                                  len_data, table)
-        results['msg'] = 'Successfully retrieved %d items from %s.' % \
-                         (len_data, table)
-
-    if response_type == 'list_of_dicts':
-        junos_module.logger.debug('Converting data to list of dicts.')
-        resource = juniper_items_to_list_of_dicts(junos_module, data)
+            junos_module.fail_json(msg='Unable to create a table loader from '
+                                       'the %s file. Error: %s' %
+                                       (file_name, str(ex)))
+    fields = junos_module.params.get('fields')
+    if fields:
+        if len(tables) != 1:
+            junos_module.fail_json(msg='The fields option can only be used '
+                                       'with a single table.')
+        table_classes[0] = project_table(junos_module, table_classes[0],
+                                         tables[0], fields)
+    index_fields = junos_module.params.get('index_fields')
+    if index_fields:
+        if response_type != 'indexed':
+            junos_module.fail_json(msg='The index_fields option requires the '
+                                       'indexed response_type.')
+        for (table, table_class) in zip(tables, table_classes):
+            view_fields = table_class.VIEW.FIELDS if table_class.VIEW else {}
+            invalid = [name for name in index_fields
+                       if name not in view_fields]
+            if invalid:
+                junos_module.fail_json(msg='The index_fields %s are not '
+                                           'fields of the view of table %s.'
+                                           % (', '.join(invalid), table))
+    where = junos_module.params.get('where')
+    if where:
+        try:
+            where = [juniper_junos_common.compile_xpath(condition)
+                     for condition in where]
+        except (junos_module.etree.XPathError, TypeError) as ex:
+            junos_module.fail_json(msg='The where option contains an invalid '
+                                       'XPath expression. Error: %s' %
+                                       (str(ex)))
     else:
-        resource = expand_items(junos_module, data)
+        where = None
+    use_filter = junos_module.params.get('use_filter')
+    if use_filter is True:
+        # The use_filter argument of get() was added in PyEZ 2.3.0.
+        junos_module.check_pyez(minimum='2.3.0')
+    # Check over chunks
+    chunks = junos_module.params.get('chunks')
+    if not chunks:
+        chunks = [{}]
+    chunk_kwargs = []
+    for chunk in chunks:
+        if not isinstance(chunk, dict):
+            junos_module.fail_json(msg='Each value of the chunks option must '
+                                       'be a dictionary of keyword '
+                                       'arguments. %s is not.' % (chunk))
+        chunk_kwarg = dict(kwargs or {})
+        chunk_kwarg.update(chunk)
+        chunk_kwargs.append(chunk_kwarg)
+
+    # One result per table.
+    results = []
+    if junos_module.params.get('stream_records') is True:
+        if snapshot_dir is not None:
+            junos_module.fail_json(msg='The stream_records and snapshot_dir '
+                                       'options are mutually exclusive.')
+        if (junos_module.params.get('dest') is None and
+                junos_module.params.get('dest_dir') is None):
+            junos_module.fail_json(msg='The stream_records option requires '
+                                       'the dest or dest_dir option.')
+        if len(tables) > 1 and junos_module.params.get('dest') is not None:
+            junos_module.fail_json(msg='The stream_records option requires '
+                                       'the dest_dir option when more than '
+                                       'one table is specified.')
+        # The XML of each item is cleared once it is saved, so the replies
+        # can not be shared, and each table is retrieved separately.
+        for (table, table_class) in zip(tables, table_classes):
+            # Each chunk is only retrieved once the previous one is saved.
+            records = (record
+                       for chunk_kwarg in chunk_kwargs
+                       for record in iter_table_records(
+                           junos_module,
+                           get_table(junos_module, table_class, table,
+                                     chunk_kwarg, use_filter),
+                           where))
+            try:
+                count = junos_module.save_records(table, records)
+            except Exception as ex:
+                junos_module.fail_json(msg='Unable to parse table %s data '
+                                           'into items. Error: %s' %
+                                           (table, str(ex)))
+            junos_module.logger.debug('Successfully saved %d items from %s.',
+                                      count, table)
+            results.append({'msg': 'Successfully saved %d items from %s.' %
+                                   (count, table),
+                            'table': table,
+                            'changed': False,
+                            'failed': False,
+                            'record_count': count})
+        exit_with_results(junos_module, results)
 
-    # If we made it this far, everything was successful.
-    results['failed'] = False
-    results['resource'] = resource
+    # The items are counted as they are converted, so the table keys are
+    # only evaluated if the response needs them.
+    if snapshot_dir is not None or response_type == 'indexed':
+        convert_type = 'keyed_dicts'
+    else:
+        convert_type = response_type
+    resources = [None] * len(tables)
+    # The number of items in the earlier chunks of each table, so the
+    # positional keys of the columnar format continue across chunks.
+    item_counts = [0] * len(tables)
+    for chunk_kwarg in chunk_kwargs:
+        for group in group_tables(table_classes, chunk_kwarg, use_filter):
+            data = None
+            for index in group:
+                table = tables[index]
+                if data is None:
+                    data = get_table(junos_module, table_classes[index],
+                                     table, chunk_kwarg, use_filter)
+                    table_data = data
+                else:
+                    # The other tables of the group reuse the reply.
+                    junos_module.logger.debug("Table %s reuses the reply of "
+                                              "table %s.", table,
+                                              tables[group[0]])
+                    table_data = table_classes[index](junos_module.dev,
+                                                      xml=data.xml)
+                part = convert_table(junos_module, table_data, table,
+                                     convert_type, where,
+                                     first_position=item_counts[index])
+                if convert_type == 'columnar':
+                    item_counts[index] += len(table_elements(table_data))
+                table_data = None
+                if resources[index] is None:
+                    resources[index] = part
+                elif convert_type == 'columnar':
+                    resources[index]['keys'].extend(part['keys'])
+                    for (name, values) in part['columns'].items():
+                        resources[index]['columns'][name].extend(values)
+                else:
+                    resources[index].extend(part)
+            # Release this reply before the next one is retrieved.
+            data = None
+    for (table, resource) in zip(tables, resources):
+        if snapshot_dir is not None:
+            rows = rows_by_key(junos_module, table, resource)
+            file_path = snapshot_file_path(junos_module, table)
+            old_rows = load_snapshot(junos_module, file_path)
+            (delta, counts) = snapshot_delta(old_rows, rows)
+            changed = (counts['added'] + counts['removed'] +
+                       counts['changed']) > 0
+            if changed or not os.path.exists(file_path):
+                save_snapshot(junos_module, file_path, table, rows)
+            msg = ('Retrieved %d items from %s. %d added, %d removed, '
+                   '%d changed.' % (len(rows), table, counts['added'],
+                                    counts['removed'], counts['changed']))
+            junos_module.logger.debug(msg)
+            results.append({'msg': msg,
+                            'table': table,
+                            'changed': changed,
+                            'failed': False,
+                            'delta': delta,
+                            'delta_counts': counts})
+            continue
+        result = {'table': table,
+                  'changed': False,
+                  'failed': False}
+        if response_type == 'columnar':
+            count = len(resource['keys'])
+            if junos_module.params.get('dictionary_encoding') is True:
+                dictionary_encode_columns(resource)
+        elif response_type == 'indexed':
+            count = len(resource)
+            resource = rows_by_key(junos_module, table, resource)
+            if index_fields:
+                result['indexes'] = secondary_indexes(resource, index_fields)
+        else:
+            count = len(resource)
+        junos_module.logger.debug('Successfully retrieved %d items from %s.',
+                                  count, table)
+        # If we made it this far, everything was successful.
+        result['msg'] = 'Successfully retrieved %d items from %s.' % \
+                        (count, table)
+        result['resource'] = resource
+        results.append(result)
 
     # Return response.
-    junos_module.exit_json(**results)
+    exit_with_results(junos_module, results)
 
 
 if __name__ == '__main__':
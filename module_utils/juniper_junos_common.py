@@ -32,7 +32,7 @@
 #
 
 from __future__ import absolute_import, division, print_function
-from six import iteritems
+from six import iteritems, text_type
 
 # Ansible imports
 from ansible.module_utils.basic import AnsibleModule
@@ -41,10 +41,16 @@ from ansible.plugins.action.normal import ActionModule as ActionNormal
 
 # Standard library imports
 from argparse import ArgumentParser
+import contextlib
 from distutils.version import LooseVersion
+import gzip
+import hashlib
 import json
 import logging
+import math
 import os
+import re
+import time
 
 # Non-standard library imports and checks
 try:
@@ -112,6 +118,18 @@ try:
 except ImportError:
     HAS_YAML_VERSION = None
 
+try:
+    import textfsm
+    HAS_TEXTFSM_VERSION = textfsm.__version__
+except ImportError:
+    HAS_TEXTFSM_VERSION = None
+
+try:
+    import zstandard
+    HAS_ZSTANDARD_VERSION = zstandard.__version__
+except ImportError:
+    HAS_ZSTANDARD_VERSION = None
+
 try:
     # Python 2
     basestring
@@ -141,6 +159,15 @@ JXMLEASE_INSTALLATION_URL = \
 # Minimum yaml version required by shared code.
 MIN_YAML_VERSION = "3.08"
 YAML_INSTALLATION_URL = "http://pyyaml.org/wiki/PyYAMLDocumentation"
+# Minimum TextFSM version required by shared code.
+MIN_TEXTFSM_VERSION = "1.1.0"
+# Installation URL for TextFSM.
+TEXTFSM_INSTALLATION_URL = "https://github.com/google/textfsm#installation"
+# Minimum zstandard version required by shared code.
+MIN_ZSTANDARD_VERSION = "0.9.0"
+# Installation URL for zstandard.
+ZSTANDARD_INSTALLATION_URL = \
+    "https://github.com/indygreg/python-zstandard#installing"
 
 def convert_to_bool_func(arg):
     """Try converting arg to a bool value using Ansible's aliases for bool.
@@ -563,6 +590,9 @@ internal_spec = {
 
 # Known RPC output formats
 RPC_OUTPUT_FORMAT_CHOICES = ['text', 'xml', 'json']
+# Choices for the compression of saved outputs, and their file name suffixes.
+OUTPUT_COMPRESSION_CHOICES = ['none', 'gzip', 'zstd']
+OUTPUT_COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
 
 # Known configuration formats
 CONFIG_FORMAT_CHOICES = ['xml', 'set', 'text', 'json']
@@ -596,6 +626,365 @@ def convert_to_bool_func(arg):
         return None
 
 
+def xml_to_dict(element, attributes=False):
+    """Convert an lxml element, and its descendants, into a dict.
+
+    Produces the same JSON data structure as jxmlease.parse_etree(), but
+    walks the tree iteratively and creates only the dicts, lists, and strings
+    which are part of the result. This matters for very large RPC replies.
+
+    - The result is a dict with the element's tag as the only key.
+    - Namespace URIs are removed from tags, so '{uri}tag' becomes 'tag'.
+    - An element without child elements is converted to its text, stripped
+      of leading and trailing whitespace, or '' if it has no text.
+    - An element with child elements is converted to a dict keyed by the
+      child elements' tags. Child elements which share a tag are converted
+      to a list in document order.
+    - Comments and processing instructions are ignored.
+
+    Args:
+        element: The lxml element to convert.
+        attributes: If True, the attributes of each element are included as
+                    keys prefixed with '@'. Namespace prefixes are removed
+                    from attribute names. The text of an element without
+                    child elements, but with attributes, is then stored in
+                    the '#text' key. If False, the default, attributes are
+                    ignored, just as they are when a jxmlease result is
+                    converted to JSON.
+
+    Returns:
+        A dict.
+    """
+    root = {}
+    stack = [(element, root)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        (elem, parent) = pop()
+        children = None
+        if len(elem):
+            children = list(elem.iterchildren(etree.Element, reversed=True))
+        if children:
+            value = {}
+            if attributes is True and elem.attrib:
+                for (name, attr_value) in elem.attrib.items():
+                    value['@' + name.rpartition('}')[2]] = attr_value
+            for child in children:
+                push((child, value))
+        else:
+            text = elem.text
+            value = text.strip() if text is not None else ''
+            if attributes is True and elem.attrib:
+                value = {'#text': value}
+                for (name, attr_value) in elem.attrib.items():
+                    value['@' + name.rpartition('}')[2]] = attr_value
+        tag = elem.tag
+        if tag[0] == '{':
+            tag = tag.rpartition('}')[2]
+        existing = parent.get(tag)
+        if existing is None:
+            parent[tag] = value
+        elif isinstance(existing, list):
+            existing.append(value)
+        else:
+            parent[tag] = [existing, value]
+    return root
+
+
+# Compiled XPath expressions keyed by expression. See compile_xpath().
+_xpaths = {}
+
+
+def compile_xpath(expression):
+    """Return a compiled etree.XPath object for expression.
+
+    Each distinct expression is compiled once, and the compiled XPath
+    object is reused for every later evaluation.
+
+    Like the other module-level caches of these modules, such as the
+    compiled TextFSM templates or the PyEZ table classes, the compiled
+    expressions only last as long as the module's process. Ansible runs
+    each task in a new process, so they are not shared between tasks.
+
+    Args:
+        expression: The XPath expression.
+
+    Returns:
+        An etree.XPath object.
+
+    Raises:
+        etree.XPathSyntaxError: If the expression is invalid.
+    """
+    xpath = _xpaths.get(expression)
+    if xpath is None:
+        xpath = etree.XPath(expression)
+        _xpaths[expression] = xpath
+    return xpath
+
+
+def xpath_result_to_value(result):
+    """Convert the result of an XPath evaluation into a JSON data structure.
+
+    Args:
+        result: The result of evaluating an etree.XPath object.
+
+    Returns:
+        - For a node-set, a list with one value per node. An element with
+          child elements is converted with xml_to_dict(), without the
+          enclosing tag. An element without child elements is converted to
+          its stripped text. Attribute and text nodes are converted to
+          strings.
+        - For a number, a float. For a boolean, a bool. For a string, a text
+          string, so non-ASCII text is kept on Python 2 too.
+    """
+    if not isinstance(result, list):
+        if isinstance(result, basestring):
+            return text_type(result)
+        return result
+    values = []
+    for node in result:
+        if isinstance(node, etree._Element):
+            if len(node):
+                # The only key is the tag, without its namespace.
+                values.append(xml_to_dict(node).popitem()[1])
+            else:
+                text = node.text
+                values.append(text.strip() if text is not None else '')
+        else:
+            values.append(text_type(node))
+    return values
+
+
+def select_from_xml(element, select):
+    """Extract selected values from an XML reply with XPath expressions.
+
+    Only the selected nodes are converted. The rest of the reply is never
+    converted into a JSON data structure.
+
+    Args:
+        element: The lxml element of the reply.
+        select: A dict. Keys are names for the values in the returned dict.
+                Values are XPath expressions evaluated against element.
+
+    Returns:
+        A dict keyed by the keys of select. Each value is the result of
+        xpath_result_to_value() for the corresponding XPath expression.
+    """
+    selected = {}
+    for (name, expression) in iteritems(select):
+        selected[name] = xpath_result_to_value(
+                             compile_xpath(expression)(element))
+    return selected
+
+
+def iter_records(element, tag):
+    """Yield each record element of an XML reply as a JSON data structure.
+
+    The reply is walked in document order. Each element with the given tag
+    is converted with xml_to_dict(), without the enclosing tag, as soon as
+    its end is reached. The converted element, and the already processed
+    records before it, are then removed from the tree so their memory is
+    released while the walk continues.
+
+    Args:
+        element: The lxml element of the reply.
+        tag: The tag of the record elements.
+
+    Yields:
+        One JSON data structure per record element.
+    """
+    for (_, record) in etree.iterwalk(element, events=('end',), tag=tag):
+        yield xml_to_dict(record).popitem()[1]
+        record.clear()
+        # Drop the processed records which precede this one.
+        parent = record.getparent()
+        if parent is not None:
+            while record.getprevious() is not None:
+                del parent[0]
+
+
+def failed_conditions(conditions, match, format, reply):
+    """Return the conditions which are not met by a reply.
+
+    For XML replies, each condition is an XPath expression evaluated against
+    the reply element and converted to a boolean like the XPath boolean()
+    function: a non-empty node-set, a non-empty string, a non-zero number,
+    or true. For text replies, each condition is a regular expression which
+    must match somewhere in the text.
+
+    Args:
+        conditions: A list of conditions.
+        match: 'all' if every condition must be met, 'any' if one is enough.
+        format: The format of the reply, 'xml' or 'text'.
+        reply: The lxml element of an XML reply, or the text of a text reply.
+               None if the reply is empty.
+
+    Returns:
+        A list of the conditions which are not met, or an empty list if the
+        reply satisfies the conditions according to match.
+    """
+    failed = []
+    for condition in conditions:
+        if format == 'xml':
+            met = reply is not None and bool(compile_xpath(condition)(reply))
+        else:
+            met = re.search(condition, reply or '', re.MULTILINE) is not None
+        if met is True and match == 'any':
+            return []
+        if met is False:
+            failed.append(condition)
+    return failed
+
+
+def normalized_output_hash(format, text, ignore_xpaths=None,
+                           ignore_patterns=None):
+    """Return a digest of an output with its volatile parts removed.
+
+    For XML outputs, the nodes selected by each XPath expression in
+    ignore_xpaths, which may use the namespace prefixes declared by the
+    output, such as junos, are removed: elements are deleted, attributes are
+    deleted, and text is cleared. The remaining XML is serialized in
+    canonical form, so the digest does not depend on attribute order or
+    namespace prefixes. Then, for every format, each match of each regular
+    expression in ignore_patterns is removed from the text.
+
+    Args:
+        format: The format of the output, 'xml', 'json', or 'text'.
+        text: The text of the output.
+        ignore_xpaths: A list of XPath expressions. Only used for the xml
+                       format.
+        ignore_patterns: A list of regular expressions.
+
+    Returns:
+        The hex SHA-256 digest of the normalized output.
+    """
+    text = text or ''
+    if format == 'xml' and ignore_xpaths:
+        try:
+            root = etree.fromstring(text.encode('utf-8'))
+        except etree.XMLSyntaxError:
+            root = None
+        if root is not None:
+            # The junos namespace URI includes the Junos version, so the
+            # prefixes declared by the reply itself are used.
+            namespaces = dict((prefix, uri)
+                              for (prefix, uri) in iteritems(root.nsmap)
+                              if prefix is not None)
+            for expression in ignore_xpaths:
+                nodes = root.xpath(expression, namespaces=namespaces)
+                if not isinstance(nodes, list):
+                    continue
+                for node in nodes:
+                    if isinstance(node, basestring):
+                        parent = node.getparent()
+                        if parent is None:
+                            continue
+                        if node.is_attribute:
+                            del parent.attrib[node.attrname]
+                        elif node.is_tail:
+                            parent.tail = None
+                        else:
+                            parent.text = None
+                    elif node.getparent() is not None:
+                        node.getparent().remove(node)
+            text = etree.tostring(root, method='c14n').decode('utf-8')
+    for pattern in ignore_patterns or []:
+        text = re.sub(pattern, '', text, flags=re.MULTILINE)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def safe_load_yaml(stream):
+    """Parse YAML without constructing arbitrary Python objects.
+
+    The libyaml C loader (CSafeLoader) is used when PyYAML was built with
+    libyaml. Otherwise, the pure-Python SafeLoader is used. Both only
+    construct standard YAML types, like PyEZ's own loadyaml().
+
+    Args:
+        stream: A YAML string or an open file.
+
+    Returns:
+        The parsed YAML document.
+
+    Raises:
+        yaml.YAMLError: If the YAML is invalid.
+    """
+    loader = getattr(yaml, 'CSafeLoader', None) or yaml.SafeLoader
+    return yaml.load(stream, Loader=loader)
+
+
+@contextlib.contextmanager
+def open_output_file(file_path, mode, compression=None):
+    """Open a file for saving output, compressing what is written to it.
+
+    Used as a context manager. Compressed data appended to an existing
+    file is added as a new gzip member or zstd frame, which gunzip and
+    zstd decompress as if the file had been written at once. The gzip
+    header records no modification time, so identical outputs are stored
+    as identical bytes.
+
+    Args:
+        file_path: The path of the file.
+        mode: 'wb' to overwrite the file or 'ab' to append to it.
+        compression: 'gzip', 'zstd', or 'none'/None for no compression.
+
+    Yields:
+        A binary file-like object.
+
+    Raises:
+        IOError/OSError: If the file can not be opened or written.
+    """
+    with open(file_path, mode) as raw_file:
+        if compression == 'gzip':
+            with gzip.GzipFile(filename='', fileobj=raw_file, mode=mode,
+                               mtime=0) as save_file:
+                yield save_file
+        elif compression == 'zstd':
+            compressor = zstandard.ZstdCompressor()
+            with compressor.stream_writer(raw_file) as save_file:
+                yield save_file
+        else:
+            yield raw_file
+
+
+# Compiled TextFSM templates keyed by (template path, modification time).
+_textfsm_templates = {}
+
+
+def parse_text_output(template_file, text):
+    """Parse text output into a list of dicts using a TextFSM template.
+
+    The template is compiled the first time it is used, and the compiled
+    template is reused by later calls, unless the template file changes.
+    This function does not require a connection to a Junos device, so it
+    may also be used to parse previously saved outputs.
+
+    Args:
+        template_file: The path to the TextFSM template file.
+        text: The text output to parse.
+
+    Returns:
+        A list of dicts. One dict per record. The keys of each dict are the
+        Value names defined in the template.
+
+    Raises:
+        IOError/OSError: If the template file can not be read.
+        textfsm.TextFSMTemplateError: If the template is invalid.
+        textfsm.TextFSMError: If the text can not be parsed.
+    """
+    template_file = os.path.abspath(template_file)
+    cache_key = (template_file, os.path.getmtime(template_file))
+    fsm = _textfsm_templates.get(cache_key)
+    if fsm is None:
+        with open(template_file, 'r') as template:
+            fsm = textfsm.TextFSM(template)
+        _textfsm_templates[cache_key] = fsm
+    else:
+        fsm.Reset()
+    header = fsm.header
+    return [dict(zip(header, record)) for record in fsm.ParseText(text or '')]
+
+
 class JuniperJunosModule(AnsibleModule):
     """A subclass of AnsibleModule used by all juniper_junos_* modules.
 
@@ -614,10 +1003,22 @@ class JuniperJunosModule(AnsibleModule):
         check_lxml_etree: Verify the lxml Etree library is present and
                           functional.
         check_yaml: Verify the YAML library is present and functional.
+        check_textfsm: Verify the TextFSM library is present and functional.
+        check_zstandard: Verify the zstandard library is present and
+                         functional.
         convert_to_bool: Try converting to bool using aliases for bool.
         parse_arg_to_list_of_dicts: Parses string_val into a list of dicts.
         parse_ignore_warning_option: Parses the ignore_warning option.
         parse_rollback_option: Parses the rollback option.
+        parse_select_option: Parses the select option.
+        parse_timeouts_option: Parses the timeouts option.
+        call_timeout: Return the timeout for the next command/RPC.
+        reconnect: Reopen the connection after a command/RPC lost it.
+        parse_wait_for_option: Parses the wait_for option.
+        parse_detect_changes_option: Parses the detect_changes option.
+        parse_storage_options: Parses the compression and content_addressed
+                               options.
+        wait_for: Execute a command/RPC until the wait_for conditions are met.
         open: Open self.dev.
         close: Close self.dev.
         add_sw: Add an instance of jnp.junos.utils.sw.SW() to self.
@@ -630,7 +1031,12 @@ class JuniperJunosModule(AnsibleModule):
         load_configuration: Load the candidate configuration.
         commit_configuration: Commit the candidate configuration.
         ping: Execute a ping command from a Junos device.
-        save_text_output: Save text output into a file.
+        save_text_output: Save text output into a file, unless unchanged.
+        save_records: Save records into a JSON lines file.
+        json_output_text: Return the JSON text of a reply if it is needed.
+        get_cached_output: Return previously cached command/RPC output.
+        set_cached_output: Cache command/RPC output.
+        get_rpc_translation: Return the RPC equivalent of a CLI command.
     """
 
     # Method overrides
@@ -679,6 +1085,13 @@ class JuniperJunosModule(AnsibleModule):
         Returns:
             A JuniperJunosModule instance object.
         """
+        # Record the start time against which the 'deadline' param is
+        # measured.
+        self.start_time = time.time()
+        # Set when a command/RPC fails with a ConnectError. See reconnect().
+        self.connection_lost = False
+        # The number of reconnects made. See reconnect().
+        self.reconnects = 0
         # Initialize the dev attribute
         self.dev = None
         # Initialize the config attribute
@@ -1105,6 +1518,35 @@ class JuniperJunosModule(AnsibleModule):
         self._check_library('yaml', HAS_YAML_VERSION,
                             YAML_INSTALLATION_URL, minimum=minimum)
 
+    def check_textfsm(self, minimum=None):
+        """Check TextFSM is available and version is >= minimum.
+
+        Args:
+            minimum: The minimum TextFSM version required.
+                     Default = None which means no version check.
+
+        Failures:
+            - TextFSM not installed.
+            - TextFSM version < minimum.
+        """
+        self._check_library('textfsm', HAS_TEXTFSM_VERSION,
+                            TEXTFSM_INSTALLATION_URL, minimum=minimum)
+        self.textfsm = textfsm
+
+    def check_zstandard(self, minimum=None):
+        """Check zstandard is available and version is >= minimum.
+
+        Args:
+            minimum: The minimum zstandard version required.
+                     Default = None which means no version check.
+
+        Failures:
+            - zstandard not installed.
+            - zstandard version < minimum.
+        """
+        self._check_library('zstandard', HAS_ZSTANDARD_VERSION,
+                            ZSTANDARD_INSTALLATION_URL, minimum=minimum)
+
     def convert_to_bool(self, arg):
         """Try converting arg to a bool value using Ansible's aliases for bool.
 
@@ -1280,6 +1722,251 @@ class JuniperJunosModule(AnsibleModule):
                            "Must be the string 'rescue' or an int between "
                            "0 and 49." % (str(rollback)))
 
+    def parse_select_option(self, count):
+        """Parses the select option.
+
+        select may be a single dict which applies to every command/RPC, or
+        a list of dicts with one dict per command/RPC. Each dict maps a name
+        to an XPath expression. Every XPath expression is compiled here, so
+        an invalid expression fails the module before anything is executed.
+
+        Args:
+            count: The number of commands/RPCs.
+
+        Returns:
+            A list of count dicts, or a list of count None values if select
+            is not specified.
+
+        Fails:
+            If there is an error parsing select or compiling an expression.
+        """
+        selects = self.parse_arg_to_list_of_dicts('select',
+                                                  self.params.get('select'))
+        if selects is None:
+            return [None] * count
+        if len(selects) == 1:
+            selects = selects * count
+        elif len(selects) != count:
+            self.fail_json(msg="The select option must have a single value, "
+                               "or one value per command/RPC. There are %d "
+                               "commands/RPCs and %d select values." %
+                               (count, len(selects)))
+        for select in selects:
+            for (name, expression) in iteritems(select):
+                try:
+                    compile_xpath(expression)
+                except (etree.XPathSyntaxError, TypeError) as ex:
+                    self.fail_json(msg="The XPath expression (%s) for %s in "
+                                       "the select option is invalid. "
+                                       "Error: %s" %
+                                       (expression, name, str(ex)))
+        return selects
+
+    def call_timeout(self, timeout=None):
+        """Return the timeout for the next command/RPC.
+
+        The timeout is the per-call timeout, if specified, limited to the
+        time remaining before the 'deadline' param expires. The deadline is
+        measured from the start of the module, so it includes the time
+        spent opening the connection.
+
+        Args:
+            timeout: The per-call timeout in seconds, or None to use the
+                     device timeout.
+
+        Returns:
+            None if the device timeout applies, 0 if the deadline has
+            expired, otherwise the timeout in whole seconds. A partial second
+            which remains is rounded up. (PyEZ truncates timeouts to an int.)
+        """
+        deadline = self.params.get('deadline')
+        if deadline is None:
+            return timeout
+        remaining = deadline - (time.time() - self.start_time)
+        if remaining <= 0:
+            self.logger.debug("The deadline of %d seconds has expired.",
+                              deadline)
+            return 0
+        if timeout is None:
+            timeout = self.dev.timeout
+        return min(timeout, int(math.ceil(remaining)))
+
+    def parse_timeouts_option(self, count):
+        """Parses the timeouts option.
+
+        timeouts may be a single value which applies to every command/RPC,
+        or a list with one value per command/RPC.
+
+        Args:
+            count: The number of commands/RPCs.
+
+        Returns:
+            A list of count timeouts, in seconds, or a list of count None
+            values if timeouts is not specified.
+
+        Fails:
+            If a value, or the value of the deadline option, is not a
+            positive integer, or there is neither one value nor one value per
+            command/RPC.
+        """
+        deadline = self.params.get('deadline')
+        if deadline is not None and deadline <= 0:
+            self.fail_json(msg="The value of the deadline option must be a "
+                               "positive integer.")
+        timeouts = self.params.get('timeouts')
+        if timeouts is None:
+            return [None] * count
+        try:
+            timeouts = [int(timeout) for timeout in timeouts]
+        except (TypeError, ValueError):
+            timeouts = [0]
+        if min(timeouts) <= 0:
+            self.fail_json(msg="The values of the timeouts option must be "
+                               "positive integers.")
+        if len(timeouts) == 1:
+            timeouts = timeouts * count
+        elif len(timeouts) != count:
+            self.fail_json(msg="The timeouts option must have a single "
+                               "value, or one value per command/RPC. There "
+                               "are %d commands/RPCs and %d timeouts." %
+                               (count, len(timeouts)))
+        return timeouts
+
+    def parse_wait_for_option(self, formats):
+        """Parses the wait_for option.
+
+        Each condition is compiled, as an XPath expression for the xml format
+        or as a regular expression for the text format, so an invalid
+        condition fails the module before anything is executed.
+
+        Args:
+            formats: The list of formats of the commands/RPCs.
+
+        Fails:
+            If a condition is invalid, a format is json, or the retries,
+            interval, or backoff option is out of range.
+        """
+        conditions = self.params.get('wait_for')
+        if conditions is None:
+            return
+        if self.params.get('retries') < 1:
+            self.fail_json(msg="The retries option must be at least 1.")
+        if self.params.get('interval') < 0:
+            self.fail_json(msg="The interval option must not be negative.")
+        if self.params.get('backoff') < 1:
+            self.fail_json(msg="The backoff option must be at least 1.")
+        for format in set(formats):
+            if format not in ['xml', 'text']:
+                self.fail_json(msg="The wait_for option is only valid for "
+                                   "the xml and text formats.")
+            for condition in conditions:
+                try:
+                    if format == 'xml':
+                        compile_xpath(condition)
+                    else:
+                        re.compile(condition)
+                except (etree.XPathSyntaxError, re.error) as ex:
+                    self.fail_json(msg="The wait_for condition (%s) is "
+                                       "invalid for the %s format. Error: %s"
+                                       % (condition, format, str(ex)))
+
+    def parse_detect_changes_option(self):
+        """Parses the detect_changes option.
+
+        The ignore_xpaths and ignore_patterns expressions are compiled, so an
+        invalid expression fails the module before anything is executed.
+
+        Fails:
+            If detect_changes is set without dest_dir, or an ignore_xpaths
+            or ignore_patterns expression is invalid.
+        """
+        if self.params.get('detect_changes') is not True:
+            return
+        if self.params.get('dest_dir') is None:
+            self.fail_json(msg="The detect_changes option requires the "
+                               "dest_dir option.")
+        for expression in self.params.get('ignore_xpaths') or []:
+            try:
+                compile_xpath(expression)
+            except etree.XPathSyntaxError as ex:
+                self.fail_json(msg="The ignore_xpaths expression (%s) is "
+                                   "invalid. Error: %s" %
+                                   (expression, str(ex)))
+        for pattern in self.params.get('ignore_patterns') or []:
+            try:
+                re.compile(pattern)
+            except re.error as ex:
+                self.fail_json(msg="The ignore_patterns expression (%s) is "
+                                   "invalid. Error: %s" % (pattern, str(ex)))
+
+    def parse_storage_options(self):
+        """Parses the compression, content_addressed, and cache options.
+
+        Fails:
+            If content_addressed is set without dest_dir, the zstd
+            compression is requested and zstandard is not installed, or the
+            cache_ttl or cache_size option is less than 1.
+        """
+        if self.params.get('compression') == 'zstd':
+            self.check_zstandard(MIN_ZSTANDARD_VERSION)
+        if (self.params.get('content_addressed') is True and
+                self.params.get('dest_dir') is None):
+            self.fail_json(msg="The content_addressed option requires the "
+                               "dest_dir option.")
+        for option in ['cache_ttl', 'cache_size']:
+            if (self.params.get(option) is not None and
+                    self.params.get(option) < 1):
+                self.fail_json(msg="The %s option must be at least 1." %
+                                   (option))
+
+    def wait_for(self, result, timeout, function, *args):
+        """Execute a command/RPC until the 'wait_for' conditions are met.
+
+        function executes a command/RPC with args and timeout=timeout. It
+        returns the output, or None on failure, and stores the conditions
+        which are not met in result['failed_conditions']. It is called once
+        if the 'wait_for' param is not set. Otherwise, it is called up to
+        'retries' times, on the same connection, sleeping 'interval'
+        seconds between calls. The interval is multiplied by 'backoff'
+        after each call. Polling also stops when the 'deadline' param
+        expires.
+
+        Args:
+            result: The result dict for the command/RPC.
+            timeout: The timeout for the command/RPC, or None.
+            function: The function which executes the command/RPC.
+            *args: The positional arguments of function.
+
+        Returns:
+            The output of the last call, or None if it failed or the
+            conditions were never met. In that case, result['msg'] says why.
+        """
+        output = function(*args, timeout=timeout)
+        if self.params.get('wait_for') is None:
+            return output
+        interval = self.params.get('interval')
+        attempts = 1
+        while (output is not None and result.get('failed_conditions') and
+               attempts < self.params.get('retries')):
+            self.logger.debug("Conditions not met: %s. Retrying in %s "
+                              "seconds.", result['failed_conditions'],
+                              interval)
+            time.sleep(interval)
+            interval *= self.params.get('backoff')
+            if self.call_timeout(timeout) == 0:
+                break
+            attempts += 1
+            output = function(*args, timeout=self.call_timeout(timeout))
+        result['attempts'] = attempts
+        if output is None:
+            return None
+        if result.get('failed_conditions'):
+            result['msg'] = 'The wait_for conditions were not met after ' \
+                            '%d attempts.' % (attempts)
+            return None
+        result.pop('failed_conditions', None)
+        return output
+
     def open(self):
         """Open the self.dev PyEZ Device instance.
 
@@ -1293,19 +1980,7 @@ class JuniperJunosModule(AnsibleModule):
                 connect_args[key] = self.params.get(key)
 
         try:
-            self.close()
-            log_connect_args = dict(connect_args)
-            log_connect_args['passwd'] = 'NOT_LOGGING_PARAMETER'
-            self.logger.debug("Creating device parameters: %s",
-                              log_connect_args)
-            timeout = connect_args.pop('timeout')
-            self.dev = jnpr.junos.device.Device(**connect_args)
-            self.logger.debug("Opening device.")
-            self.dev.open()
-            self.logger.debug("Device opened.")
-            self.logger.debug("Setting default device timeout to %d.", timeout)
-            self.dev.timeout = timeout
-            self.logger.debug("Device timeout set.")
+            self._open_device(connect_args)
         # Exceptions raised by close() or open() are all sub-classes of
         # ConnectError, so this should catch all connection-related exceptions
         # raised from PyEZ.
@@ -1313,6 +1988,67 @@ class JuniperJunosModule(AnsibleModule):
             self.fail_json(msg='Unable to make a PyEZ connection: %s' %
                                (str(ex)))
 
+    def _open_device(self, connect_args):
+        """Create and open the self.dev PyEZ Device instance.
+
+        Args:
+            connect_args: A dict of the connection arguments.
+
+        Raises:
+            ConnectError: When unable to make a PyEZ connection.
+        """
+        connect_args = dict(connect_args)
+        self.close()
+        log_connect_args = dict(connect_args)
+        log_connect_args['passwd'] = 'NOT_LOGGING_PARAMETER'
+        self.logger.debug("Creating device parameters: %s",
+                          log_connect_args)
+        timeout = connect_args.pop('timeout')
+        self.dev = jnpr.junos.device.Device(**connect_args)
+        self.logger.debug("Opening device.")
+        self.dev.open()
+        self.logger.debug("Device opened.")
+        self.logger.debug("Setting default device timeout to %d.", timeout)
+        self.dev.timeout = timeout
+        self.logger.debug("Device timeout set.")
+
+    def reconnect(self):
+        """Reopen the connection after a command/RPC lost it.
+
+        Modules set self.connection_lost when a command/RPC fails with a
+        ConnectError. The 'reconnect_attempts' param bounds the total number
+        of attempts to reopen the connection made by the module, so a
+        flapping device cannot make the module reconnect indefinitely.
+
+        Returns:
+            True if the connection is open, False if it is still lost.
+        """
+        if self.connection_lost is False:
+            return True
+        attempts = self.params.get('reconnect_attempts') or 0
+        connect_args = {}
+        for key in connection_spec:
+            if self.params.get(key) is not None:
+                connect_args[key] = self.params.get(key)
+        if attempts > self.reconnects:
+            # The session is already dead. Any error closing it is
+            # irrelevant.
+            try:
+                self.close()
+            except Exception:
+                pass
+        while self.reconnects < attempts:
+            self.reconnects += 1
+            self.logger.info("Reconnecting. Attempt %d of %d.",
+                             self.reconnects, attempts)
+            try:
+                self._open_device(connect_args)
+                self.connection_lost = False
+                return True
+            except pyez_exception.ConnectError as ex:
+                self.logger.warning("Unable to reconnect: %s", str(ex))
+        return False
+
     def close(self, raise_exceptions=False):
         """Close the self.dev PyEZ Device instance.
         """
@@ -1483,7 +2219,7 @@ class JuniperJunosModule(AnsibleModule):
                                    'Configuration is: %s' %
                                    (etree.tostring(config, pretty_print=True)))
             return_val = (etree.tostring(config, pretty_print=True),
-                          jxmlease.parse_etree(config))
+                          xml_to_dict(config))
         elif format == 'json':
             return_val = (json.dumps(config), config)
         else:
@@ -1832,6 +2568,24 @@ class JuniperJunosModule(AnsibleModule):
         self.destfile attribute is present, then the file is appended. This
         allows multiple text outputs to be written to the same file.
 
+        If the 'detect_changes' parameter is true, a normalized digest of the
+        text (see normalized_output_hash()) is compared to the digest saved
+        when the destination file was last written. If they are equal, and
+        the file still exists, the file is not rewritten. The digests are
+        saved per host in the .<hostname>.hashes.json file of the 'dest_dir'
+        directory.
+
+        If the 'compression' parameter is 'gzip' or 'zstd', the file is
+        compressed and, with 'dest_dir', its name ends in .gz or .zst. If the
+        'content_addressed' parameter is true, the output is not saved in
+        <hostname>_<name>.<format>. Instead, it is saved once, in the
+        objects/<xx>/<sha256> file of the 'dest_dir' directory, named by the
+        SHA-256 digest of the output, no matter how many hosts or runs
+        produce it. The <hostname>.manifest.json file of the 'dest_dir'
+        directory maps each file name which would have been written to the
+        path of its object, relative to 'dest_dir', and the object's digest
+        and uncompressed size.
+
         Args:
             name: The name portion of the destination filename when the
                   'dest_dir' parameter is specified.
@@ -1839,8 +2593,13 @@ class JuniperJunosModule(AnsibleModule):
                   'dest_dir' parameter is specified.
             text: The text to be written into the destination file.
 
+        Returns:
+            True if the file was written, False if it was not rewritten
+            because the output is unchanged, or None if no file is saved.
+
         Fails:
             - If the destination file is not writable.
+            - If a file must be saved, but text is None.
         """
         file_path = None
         mode = 'wb'
@@ -1853,30 +2612,470 @@ class JuniperJunosModule(AnsibleModule):
                 file_name = '%s.diff' % (hostname)
                 file_path = os.path.normpath(os.path.join(dest_dir, file_name))
         else:
-            if self.params.get('dest') is not None:
-                file_path = os.path.normpath(self.params.get('dest'))
-                if getattr(self, 'destfile', None) is None:
-                    self.destfile = self.params.get('dest')
-                else:
-                    mode = 'a'
-            elif self.params.get('dest_dir') is not None:
-                dest_dir = self.params.get('dest_dir')
-                hostname = self.params.get('host')
-                # Substitute underscore for spaces.
-                name = name.replace(' ', '_')
-                # Substitute underscore for pipe
-                name = name.replace('|', '_')
-                name = '' if name == 'config' else '_' + name
-                file_name = '%s%s.%s' % (hostname, name, format)
-                file_path = os.path.normpath(os.path.join(dest_dir, file_name))
-        if file_path is not None:
-            try:
-                with open(file_path, mode) as save_file:
-                    save_file.write(text.encode(encoding='utf-8'))
+            (file_path, mode) = self._dest_file_path(name, format)
+        if file_path is None:
+            return None
+        if text is None:
+            self.fail_json(msg="Unable to save output to the %s file. The "
+                               "text of the output is not available." %
+                               (file_path))
+        digest = None
+        if name != 'diff' and self.params.get('detect_changes') is True:
+            digest = normalized_output_hash(
+                         format, text,
+                         self.params.get('ignore_xpaths'),
+                         self.params.get('ignore_patterns'))
+            hashes = self._host_index('.%s.hashes.json')
+            if (hashes.get(os.path.basename(file_path)) == digest and
+                    self._saved_output_exists(file_path)):
+                self.logger.debug("Output unchanged. Not saved to: %s.",
+                                  file_path)
+                return False
+        data = text.encode(encoding='utf-8')
+        compression = self.params.get('compression')
+        if name == 'diff':
+            compression = None
+        try:
+            if self.params.get('content_addressed') is True:
+                self._save_output_object(file_path, data, compression)
+            else:
+                with open_output_file(file_path, mode,
+                                      compression) as save_file:
+                    save_file.write(data)
                 self.logger.debug("Output saved to: %s.", file_path)
-            except IOError:
-                self.fail_json(msg="Unable to save output. Failed to "
-                                   "open the %s file." % (file_path))
+        except (IOError, OSError):
+            self.fail_json(msg="Unable to save output. Failed to "
+                               "open the %s file." % (file_path))
+        if digest is not None:
+            hashes[os.path.basename(file_path)] = digest
+            self._save_host_index('.%s.hashes.json')
+        return True
+
+    def _save_output_object(self, file_path, data, compression):
+        """Save an output as a content-addressed object under 'dest_dir'.
+
+        The object is only written if no identical output has been saved
+        before. It is written to a temporary file which is then renamed, so
+        a partially written object is never referenced. The host's manifest
+        then references the object under the file name of file_path.
+
+        Args:
+            file_path: The path the output would have been saved to.
+            data: The encoded output.
+            compression: 'gzip', 'zstd', or 'none'/None.
+
+        Raises:
+            IOError/OSError: If the object can not be written.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        suffix = OUTPUT_COMPRESSION_SUFFIXES.get(compression, '')
+        object_name = '/'.join(['objects', digest[:2], digest + suffix])
+        object_path = os.path.normpath(
+            os.path.join(self.params.get('dest_dir'), object_name))
+        if os.path.exists(object_path):
+            self.logger.debug("Output already saved in: %s.", object_path)
+        else:
+            # Other hosts may create the directory at the same time.
+            try:
+                os.makedirs(os.path.dirname(object_path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(object_path)):
+                    raise
+            tmp_path = '%s.%d.tmp' % (object_path, os.getpid())
+            with open_output_file(tmp_path, 'wb', compression) as save_file:
+                save_file.write(data)
+            os.rename(tmp_path, object_path)
+            self.logger.debug("Output saved to: %s.", object_path)
+        manifest = self._host_index('%s.manifest.json')
+        manifest[os.path.basename(file_path)] = {'object': object_name,
+                                                 'sha256': digest,
+                                                 'size': len(data)}
+        self._save_host_index('%s.manifest.json')
+
+    def _saved_output_exists(self, file_path):
+        """Return True if the output saved for file_path still exists."""
+        if self.params.get('content_addressed') is True:
+            entry = self._host_index('%s.manifest.json').get(
+                        os.path.basename(file_path))
+            return bool(entry is not None and
+                        os.path.exists(os.path.join(
+                            self.params.get('dest_dir'), entry['object'])))
+        return os.path.exists(file_path)
+
+    def _host_index(self, file_name):
+        """Return a per-host index saved in the 'dest_dir' directory.
+
+        The index is read the first time it is needed. A missing or
+        unreadable file means an empty index.
+
+        Args:
+            file_name: The file name of the index, with a %s for the host.
+
+        Returns:
+            The index dict. Changes are saved by _save_host_index().
+        """
+        indexes = getattr(self, '_host_indexes', None)
+        if indexes is None:
+            indexes = self._host_indexes = {}
+        if file_name not in indexes:
+            file_path = os.path.normpath(
+                os.path.join(self.params.get('dest_dir'),
+                             file_name % (self.params.get('host'))))
+            indexes[file_name] = {}
+            try:
+                with open(file_path, 'r') as index_file:
+                    indexes[file_name] = json.load(index_file)
+            except (IOError, OSError, ValueError):
+                self.logger.debug("No saved index: %s.", file_path)
+        return indexes[file_name]
+
+    def _save_host_index(self, file_name):
+        """Save a per-host index in the 'dest_dir' directory.
+
+        Like _save_rpc_translations(), the file is written to a temporary
+        file which is then renamed, and a failure is only logged. Outputs
+        missing from a lost index are simply saved again by the next run.
+
+        Args:
+            file_name: The file name of the index, with a %s for the host.
+        """
+        file_path = os.path.normpath(
+            os.path.join(self.params.get('dest_dir'),
+                         file_name % (self.params.get('host'))))
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as index_file:
+                json.dump(self._host_indexes[file_name], index_file,
+                          sort_keys=True)
+            os.rename(tmp_path, file_path)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Unable to save the index %s. Error: %s",
+                                file_path, str(ex))
+
+    def _dest_file_path(self, name, format):
+        """Return the destination file path and mode for an output.
+
+        Implements the 'dest' and 'dest_dir' naming and append rules
+        described in save_text_output().
+
+        Args:
+            name: The name portion of the destination filename when the
+                  'dest_dir' parameter is specified.
+            format: The format portion of the destination filename when the
+                    'dest_dir' parameter is specified.
+
+        Returns:
+            A tuple of the file path, or None if neither 'dest' nor
+            'dest_dir' is specified, and the mode for opening the file.
+        """
+        file_path = None
+        mode = 'wb'
+        if self.params.get('dest') is not None:
+            file_path = os.path.normpath(self.params.get('dest'))
+            if getattr(self, 'destfile', None) is None:
+                self.destfile = self.params.get('dest')
+            else:
+                mode = 'ab'
+        elif self.params.get('dest_dir') is not None:
+            dest_dir = self.params.get('dest_dir')
+            hostname = self.params.get('host')
+            # Substitute underscore for spaces.
+            name = name.replace(' ', '_')
+            # Substitute underscore for pipe
+            name = name.replace('|', '_')
+            name = '' if name == 'config' else '_' + name
+            suffix = OUTPUT_COMPRESSION_SUFFIXES.get(
+                         self.params.get('compression'), '')
+            file_name = '%s%s.%s%s' % (hostname, name, format, suffix)
+            file_path = os.path.normpath(os.path.join(dest_dir, file_name))
+        return (file_path, mode)
+
+    def save_records(self, name, records):
+        """Save records into a JSON lines file based on 'dest' and 'dest_dir'.
+
+        The destination file is chosen exactly like save_text_output() with a
+        format of 'jsonl'. Each record is encoded as compact JSON and written
+        on its own line as soon as it is produced by the records iterator,
+        so only one record is held in memory at a time. The file is
+        compressed according to the 'compression' parameter.
+
+        Args:
+            name: The name portion of the destination filename when the
+                  'dest_dir' parameter is specified.
+            records: An iterable of JSON-serializable records.
+
+        Returns:
+            The number of records written.
+
+        Fails:
+            - If neither 'dest' nor 'dest_dir' is specified.
+            - If the destination file is not writable.
+        """
+        (file_path, mode) = self._dest_file_path(name, 'jsonl')
+        if file_path is None:
+            self.fail_json(msg="Records can only be saved when the dest or "
+                               "dest_dir option is specified.")
+        count = 0
+        try:
+            with open_output_file(file_path, mode,
+                                  self.params.get('compression')) as save_file:
+                for record in records:
+                    line = json.dumps(record, separators=(',', ':'))
+                    save_file.write(line.encode(encoding='utf-8') + b'\n')
+                    count += 1
+            self.logger.debug("%d records saved to: %s.", count, file_path)
+        except (IOError, OSError):
+            self.fail_json(msg="Unable to save records. Failed to "
+                               "open the %s file." % (file_path))
+        return count
+
+    def json_output_text(self, format, text_output, parsed_output):
+        """Return the text output, encoding a JSON reply only if it is needed.
+
+        PyEZ decodes JSON replies. The text form of a JSON reply is only
+        needed if it is returned in the stdout key ('json_output' param is
+        'raw' or 'both') or saved with the 'dest' or 'dest_dir' params. In
+        this case, it is encoded once, as compact JSON.
+
+        Args:
+            format: The format of the reply.
+            text_output: The text output of the reply, or None.
+            parsed_output: The parsed output of the reply, or None.
+
+        Returns:
+            The text output, or None if it is not needed.
+        """
+        if (format != 'json' or text_output is not None or
+                parsed_output is None):
+            return text_output
+        if ((self.params.get('return_output') is True and
+             self.params.get('json_output') != 'parsed') or
+                self.params.get('dest') is not None or
+                self.params.get('dest_dir') is not None):
+            return json.dumps(parsed_output, separators=(',', ':'))
+        return None
+
+    def _cache_file_path(self, key):
+        """Return the cache file path for key based on the 'cache_dir' param.
+
+        The key is combined with the host and port of the device and hashed.
+        The resulting digest is the name of the cache file in the
+        'cache_dir' directory.
+
+        Args:
+            key: A JSON serializable list which uniquely identifies the
+                 output. For example, the RPC name, format, and arguments.
+
+        Returns:
+            The path of the cache file, or None if 'cache_dir' is not set.
+        """
+        cache_dir = self.params.get('cache_dir')
+        if cache_dir is None:
+            return None
+        key_string = json.dumps([self.params.get('host'),
+                                 self.params.get('port')] + list(key),
+                                sort_keys=True)
+        digest = hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+        return os.path.normpath(os.path.join(cache_dir, digest + '.json'))
+
+    def get_cached_output(self, key):
+        """Return previously cached output for key.
+
+        Cache entries are files in the 'cache_dir' directory. An entry is only
+        returned if it is younger than 'cache_ttl' seconds. A returned entry
+        has its modification time updated so that the least recently used
+        entries are the ones evicted by set_cached_output().
+
+        Args:
+            key: A JSON serializable list which uniquely identifies the
+                 output.
+
+        Returns:
+            A tuple containing the text output and the parsed output, or None
+            if caching is disabled or there is no valid entry for key.
+        """
+        file_path = self._cache_file_path(key)
+        if file_path is None:
+            return None
+        try:
+            with open(file_path, 'r') as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.logger.debug("Cache miss: %s.", file_path)
+            return None
+        if entry.get('expires', 0) < time.time():
+            self.logger.debug("Cache entry expired: %s.", file_path)
+            return None
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            # Another process may have evicted the entry. Still use it.
+            pass
+        self.logger.debug("Cache hit: %s.", file_path)
+        return (entry.get('text_output'), entry.get('parsed_output'))
+
+    def set_cached_output(self, key, text_output, parsed_output):
+        """Cache output for key.
+
+        The entry is written to a temporary file which is then renamed, so
+        that concurrent processes never read a partial entry. If the
+        'cache_dir' directory then contains more than 'cache_size' entries,
+        the least recently used entries are removed.
+
+        Args:
+            key: A JSON serializable list which uniquely identifies the
+                 output.
+            text_output: The output as a single multi-line string.
+            parsed_output: The output parsed into a JSON data structure, or
+                           None.
+        """
+        file_path = self._cache_file_path(key)
+        if file_path is None:
+            return
+        cache_dir = os.path.dirname(file_path)
+        entry = {'expires': time.time() + self.params.get('cache_ttl'),
+                 'text_output': text_output,
+                 'parsed_output': parsed_output}
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        try:
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.rename(tmp_path, file_path)
+            self.logger.debug("Output cached to: %s.", file_path)
+        except (IOError, OSError, TypeError, ValueError) as ex:
+            # A cache failure should never fail the task.
+            self.logger.warning("Unable to cache output to %s. Error: %s",
+                                file_path, str(ex))
+            return
+        # Evict the least recently used entries.
+        try:
+            entries = [os.path.join(cache_dir, name)
+                       for name in os.listdir(cache_dir)
+                       if name.endswith('.json')]
+            excess = len(entries) - self.params.get('cache_size')
+            if excess > 0:
+                entries.sort(key=os.path.getmtime)
+                for entry_path in entries[:excess]:
+                    os.remove(entry_path)
+                self.logger.debug("Evicted %d cache entries.", excess)
+        except OSError:
+            # Another process is evicting at the same time.
+            pass
+
+    def _rpc_translations_path(self):
+        """Return the file path of the saved CLI-to-RPC translations.
+
+        Translations are specific to the platform and Junos version of the
+        device, so the file name is a digest of the device's model and
+        version facts. The file is in the 'translations_dir' directory,
+        where it is never evicted. Unlike the output cache of 'cache_dir',
+        saving translations never changes which outputs are returned.
+
+        Returns:
+            The file path, or None if 'translations_dir' is not set or the
+            model and version facts could not be gathered.
+        """
+        translations_dir = self.params.get('translations_dir')
+        if translations_dir is None:
+            return None
+        try:
+            platform = [self.dev.facts.get('model'),
+                        self.dev.facts.get('version')]
+        except (self.pyez_exception.ConnectError,
+                self.pyez_exception.RpcError) as ex:
+            self.logger.warning("Unable to gather the model and version "
+                                "facts. CLI-to-RPC translations will not be "
+                                "saved. Error: %s", str(ex))
+            return None
+        self.logger.debug("CLI-to-RPC translations for platform: %s.",
+                          platform)
+        digest = hashlib.sha1(json.dumps(platform).encode('utf-8')).hexdigest()
+        return os.path.normpath(os.path.join(translations_dir,
+                                             digest + '.json'))
+
+    def get_rpc_translation(self, command):
+        """Return the RPC which is equivalent to a CLI command.
+
+        A command is translated once with PyEZ's Device.display_xml_rpc(),
+        which executes "<command> | display xml rpc" on the device. The
+        translation is then reused for the rest of the module's execution.
+        If the 'translations_dir' param is set, translations are also saved
+        on the Ansible control machine, per platform and Junos version, so
+        later tasks against any device of the same platform and version
+        skip the translation. Commands with no RPC equivalent are remembered
+        too.
+
+        Commands which contain a pipe (|) are never translated. Pipes are
+        CLI output filters with no RPC equivalent.
+
+        Args:
+            command: The CLI command.
+
+        Returns:
+            A new etree.Element for the RPC, or None if the command has no
+            RPC equivalent.
+        """
+        if '|' in command:
+            return None
+        if getattr(self, '_rpc_translations', None) is None:
+            self._rpc_translations = {}
+            self._rpc_translations_file = self._rpc_translations_path()
+            if self._rpc_translations_file is not None:
+                try:
+                    with open(self._rpc_translations_file, 'r') as map_file:
+                        self._rpc_translations = json.load(map_file)
+                except (IOError, OSError, ValueError):
+                    self.logger.debug("No saved CLI-to-RPC translations: "
+                                      "%s.", self._rpc_translations_file)
+        if command not in self._rpc_translations:
+            self.logger.debug('Translating command "%s" to an RPC.', command)
+            rpc = self.dev.display_xml_rpc(command)
+            if isinstance(rpc, basestring):
+                # PyEZ returns an error string instead of raising.
+                self.logger.debug('Unable to translate command "%s": %s',
+                                  command, rpc)
+                if not rpc.startswith('No RPC equivalent'):
+                    # Possibly transient. Don't remember it.
+                    return None
+                self._rpc_translations[command] = None
+            else:
+                self._rpc_translations[command] = etree.tostring(
+                    rpc, with_tail=False).decode('utf-8')
+            self._save_rpc_translations()
+        rpc_string = self._rpc_translations[command]
+        if rpc_string is None:
+            return None
+        return etree.fromstring(rpc_string)
+
+    def _save_rpc_translations(self):
+        """Save the CLI-to-RPC translations in 'translations_dir'.
+
+        Like set_cached_output(), the file is written to a temporary file
+        which is then renamed, and a failure is only logged.
+        """
+        file_path = getattr(self, '_rpc_translations_file', None)
+        if file_path is None:
+            return
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        try:
+            try:
+                os.makedirs(os.path.dirname(file_path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(file_path)):
+                    raise
+            with open(tmp_path, 'w') as map_file:
+                json.dump(self._rpc_translations, map_file)
+            os.rename(tmp_path, file_path)
+            self.logger.debug("CLI-to-RPC translations saved to: %s.",
+                              file_path)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Unable to save CLI-to-RPC translations to "
+                                "%s. Error: %s", file_path, str(ex))
 
 
 class JuniperJunosActionModule(ActionNormal):
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017-2018, Juniper Networks Inc. All rights reserved.
+#
+# License: Apache 2.0
+#
+"""Make the repository's modules importable by the unit tests.
+
+The modules import the shared code as
+ansible.module_utils.juniper_junos_common, which is where Ansible places
+it at run time. Alias the repository's copy to that name before any
+module is loaded.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+import ansible.module_utils
+import jnpr.junos.exception as pyez_exception
+import jnpr.junos.factory.factory_loader
+import jnpr.junos.factory.table
+from lxml import etree
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+juniper_junos_common = importlib.import_module(
+    'module_utils.juniper_junos_common')
+sys.modules['ansible.module_utils.juniper_junos_common'] = \
+    juniper_junos_common
+ansible.module_utils.juniper_junos_common = juniper_junos_common
+
+
+def load_library_module(name):
+    """Import and return the module library/<name>.py."""
+    if name not in sys.modules:
+        path = os.path.join(REPO_DIR, 'library', name + '.py')
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+    return sys.modules[name]
+
+
+class FailJson(Exception):
+    """Raised by the fake module in place of fail_json()."""
+
+
+class FakeModule(juniper_junos_common.JuniperJunosModule):
+    """A JuniperJunosModule which is not connected to a device."""
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        self.etree = etree
+        self.pyez_exception = pyez_exception
+        self.pyez_factory_loader = jnpr.junos.factory.factory_loader
+        self.pyez_factory_table = jnpr.junos.factory.table
+        self.logger = logging.getLogger('tests.unit')
+        self.start_time = time.time()
+        self.connection_lost = False
+        self.reconnects = 0
+
+    def fail_json(self, **kwargs):
+        raise FailJson(kwargs.get('msg'))
+
+
+@pytest.fixture
+def racing_makedirs(monkeypatch):
+    """Make os.makedirs() lose a race with another host.
+
+    The directory is created, as if by another host, and then EEXIST is
+    raised, as os.makedirs() does when the directory already exists.
+    """
+    makedirs = os.makedirs
+
+    def lose_race(path, *args, **kwargs):
+        makedirs(path, *args, **kwargs)
+        raise OSError(errno.EEXIST, 'File exists', path)
+    monkeypatch.setattr(os, 'makedirs', lose_race)
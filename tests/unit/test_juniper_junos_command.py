@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017-2018, Juniper Networks Inc. All rights reserved.
+#
+# License: Apache 2.0
+#
+"""Unit tests for the helpers in library/juniper_junos_command.py."""
+
+from __future__ import absolute_import, division, print_function
+
+from lxml import etree
+
+from conftest import FakeModule, load_library_module
+
+command_module = load_library_module('juniper_junos_command')
+
+
+class FakeDevice(object):
+    def rpc(self, rpc, **kwargs):
+        return etree.fromstring('<configuration-text>system { }'
+                                '</configuration-text>')
+
+
+def command_fake_module(translate_to_rpc):
+    module = FakeModule({'translate_to_rpc': translate_to_rpc})
+    module.dev = FakeDevice()
+    module._rpc_translations = {
+        'show configuration': '<get-configuration/>'}
+    return module
+
+
+def test_text_reply_of_translated_command():
+    module = command_fake_module(True)
+    result = {}
+    output = command_module.execute_command(module, 'show configuration',
+                                            'text', result)
+    assert output == ('system { }', None)
+    assert result['rpc'] == 'get-configuration'
+
+
+def test_unexpected_text_response_tag():
+    module = command_fake_module(False)
+    result = {}
+    output = command_module.execute_command(module, 'show configuration',
+                                            'text', result)
+    assert output is None
+    assert result['msg'] == \
+        'Unexpected text response tag: configuration-text.'
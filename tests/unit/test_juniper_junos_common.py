@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017-2018, Juniper Networks Inc. All rights reserved.
+#
+# License: Apache 2.0
+#
+"""Unit tests for the helpers in module_utils/juniper_junos_common.py."""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import time
+
+from lxml import etree
+import pytest
+
+from conftest import FailJson, FakeModule
+from conftest import juniper_junos_common as common
+
+
+INTERFACES = b"""<interface-information
+    xmlns="http://xml.juniper.net/junos/18.4R1/junos-interface"
+    xmlns:junos="http://xml.juniper.net/junos/*/junos">
+  <physical-interface>
+    <name>ge-0/0/0</name>
+    <oper-status junos:format="Up">up</oper-status>
+    <!-- a comment -->
+    <logical-interface><name>ge-0/0/0.0</name></logical-interface>
+    <logical-interface><name>ge-0/0/0.1</name></logical-interface>
+  </physical-interface>
+  <physical-interface>
+    <name>ge-0/0/1</name>
+    <oper-status>down</oper-status>
+    <description/>
+  </physical-interface>
+</interface-information>"""
+
+
+def test_xml_to_dict_structure():
+    root = etree.fromstring(INTERFACES)
+    assert common.xml_to_dict(root) == {
+        'interface-information': {
+            'physical-interface': [
+                {'name': 'ge-0/0/0',
+                 'oper-status': 'up',
+                 'logical-interface': [{'name': 'ge-0/0/0.0'},
+                                       {'name': 'ge-0/0/0.1'}]},
+                {'name': 'ge-0/0/1',
+                 'oper-status': 'down',
+                 'description': ''}]}}
+
+
+def test_xml_to_dict_attributes():
+    root = etree.fromstring(INTERFACES)
+    result = common.xml_to_dict(root, attributes=True)
+    first = result['interface-information']['physical-interface'][0]
+    assert first['oper-status'] == {'#text': 'up', '@format': 'Up'}
+
+
+def test_xml_to_dict_matches_jxmlease():
+    jxmlease = pytest.importorskip('jxmlease')
+    root = etree.fromstring(INTERFACES)
+    expected = json.loads(json.dumps(jxmlease.parse_etree(root)))
+    assert common.xml_to_dict(root) == expected
+
+
+def route_information(count):
+    """Return a get-route-information reply with count routes."""
+    routes = []
+    for index in range(count):
+        routes.append(
+            '<rt junos:style="brief">'
+            '<rt-destination>10.%d.%d.0/24</rt-destination>'
+            '<rt-entry><active-tag>*</active-tag>'
+            '<protocol-name>Static</protocol-name>'
+            '<nh><to>192.168.0.1</to><via>ge-0/0/0.0</via></nh>'
+            '<nh><to>192.168.1.1</to><via>ge-0/0/1.0</via></nh>'
+            '</rt-entry></rt>' % (index // 256, index % 256))
+    return etree.fromstring(
+        '<route-information '
+        'xmlns="http://xml.juniper.net/junos/18.4R1/junos-routing" '
+        'xmlns:junos="http://xml.juniper.net/junos/*/junos">'
+        '<route-table><table-name>inet.0</table-name>%s</route-table>'
+        '</route-information>' % ''.join(routes))
+
+
+def test_xml_to_dict_matches_jxmlease_on_large_reply():
+    jxmlease = pytest.importorskip('jxmlease')
+    root = route_information(500)
+    expected = json.dumps(jxmlease.parse_etree(root), sort_keys=True)
+    result = common.xml_to_dict(root)
+    assert json.dumps(result, sort_keys=True) == expected
+    routes = result['route-information']['route-table']['rt']
+    assert len(routes) == 500
+    assert routes[-1]['rt-destination'] == '10.1.243.0/24'
+
+
+@pytest.mark.parametrize('option', ['cache_ttl', 'cache_size'])
+@pytest.mark.parametrize('value', [0, -5])
+def test_parse_storage_options_rejects_small_cache_values(option, value):
+    module = FakeModule({'cache_ttl': 60, 'cache_size': 256})
+    module.params[option] = value
+    with pytest.raises(FailJson) as error:
+        module.parse_storage_options()
+    assert option in str(error.value)
+
+
+def test_parse_storage_options_accepts_defaults():
+    module = FakeModule({'cache_ttl': 60, 'cache_size': 256})
+    module.parse_storage_options()
+
+
+class FakeDevice(object):
+    timeout = 30
+
+
+@pytest.mark.parametrize('elapsed,timeout,expected', [
+    (9.5, None, 1),
+    (9.9, 20, 1),
+    (4.2, None, 6),
+    (4.2, 3, 3),
+    (10.0, None, 0),
+    (12.0, 5, 0),
+])
+def test_call_timeout(elapsed, timeout, expected):
+    module = FakeModule({'deadline': 10})
+    module.dev = FakeDevice()
+    module.start_time = time.time() - elapsed
+    assert module.call_timeout(timeout) == expected
+
+
+def test_call_timeout_without_deadline():
+    module = FakeModule({'deadline': None})
+    assert module.call_timeout(7) == 7
+    assert module.call_timeout() is None
+
+
+TEMPLATE = """Value NAME (\\S+)
+Value STATUS (up|down)
+
+Start
+  ^${NAME}\\s+${STATUS} -> Record
+"""
+
+
+def test_parse_text_output(tmpdir):
+    pytest.importorskip('textfsm')
+    template = tmpdir.join('interfaces.textfsm')
+    template.write(TEMPLATE)
+    text = 'ge-0/0/0  up\nge-0/0/1  down\n'
+    expected = [{'NAME': 'ge-0/0/0', 'STATUS': 'up'},
+                {'NAME': 'ge-0/0/1', 'STATUS': 'down'}]
+    assert common.parse_text_output(str(template), text) == expected
+    # The compiled template is reused, and reset, by the next call.
+    assert common.parse_text_output(str(template), text) == expected
+    assert common.parse_text_output(str(template), None) == []
+
+
+def test_xpath_result_to_value_namespaced_elements():
+    root = etree.fromstring(INTERFACES)
+    namespaces = {'i': root.nsmap[None]}
+    result = root.xpath('i:physical-interface[i:name="ge-0/0/1"]',
+                        namespaces=namespaces)
+    assert common.xpath_result_to_value(result) == [
+        {'name': 'ge-0/0/1', 'oper-status': 'down', 'description': ''}]
+
+
+def test_iter_records_namespaced_elements():
+    root = etree.fromstring(INTERFACES)
+    tag = '{%s}physical-interface' % root.nsmap[None]
+    records = list(common.iter_records(root, tag))
+    assert [record['name'] for record in records] == ['ge-0/0/0',
+                                                      'ge-0/0/1']
+
+
+def test_compile_xpath_reuses_compiled_expressions():
+    xpath = common.compile_xpath('//name')
+    assert isinstance(xpath, etree.XPath)
+    assert common.compile_xpath('//name') is xpath
+
+
+def test_compile_xpath_invalid_expression():
+    with pytest.raises(etree.XPathSyntaxError):
+        common.compile_xpath('//name[')
+
+
+def test_select_from_xml():
+    root = etree.fromstring(
+        '<interface-information><physical-interface><name>ge-0/0/0</name>'
+        '<oper-status>up</oper-status><mtu>1514</mtu>'
+        '<logical-interface><name>ge-0/0/0.0</name></logical-interface>'
+        '</physical-interface></interface-information>')
+    select = {'names': '//physical-interface/name',
+              'logical': '//logical-interface',
+              'up': "count(//oper-status[. = 'up'])",
+              'any_down': "boolean(//oper-status[. = 'down'])",
+              'mtu': 'string(//mtu)',
+              'missing': '//speed'}
+    assert common.select_from_xml(root, select) == {
+        'names': ['ge-0/0/0'],
+        'logical': [{'name': 'ge-0/0/0.0'}],
+        'up': 1.0,
+        'any_down': False,
+        'mtu': '1514',
+        'missing': []}
+
+
+@pytest.mark.parametrize('conditions,match,expected', [
+    (["//oper-status = 'up'", '//mtu > 1000'], 'all', []),
+    (["//oper-status = 'up'", '//mtu > 9000'], 'all', ['//mtu > 9000']),
+    (["//oper-status = 'down'", '//mtu > 1000'], 'any', []),
+    (["//oper-status = 'down'", '//mtu > 9000'], 'any',
+     ["//oper-status = 'down'", '//mtu > 9000']),
+    (['//speed'], 'all', ['//speed']),
+])
+def test_failed_conditions_xml(conditions, match, expected):
+    reply = etree.fromstring('<interface><oper-status>up</oper-status>'
+                             '<mtu>1514</mtu></interface>')
+    assert common.failed_conditions(conditions, match, 'xml',
+                                    reply) == expected
+
+
+def test_failed_conditions_text():
+    text = 'Physical interface: ge-0/0/0, Enabled, Physical link is Up\n'
+    assert common.failed_conditions([r'link is Up$'], 'all', 'text',
+                                    text) == []
+    assert common.failed_conditions([r'link is Down'], 'all', 'text',
+                                    text) == [r'link is Down']
+
+
+def test_failed_conditions_empty_reply():
+    assert common.failed_conditions(['//name'], 'all', 'xml', None) == \
+        ['//name']
+    assert common.failed_conditions(['.*'], 'all', 'text', None) == []
+
+
+UPTIME = ('<system-uptime-information '
+          'xmlns:junos="http://xml.juniper.net/junos/18.4R1/junos">'
+          '<current-time><date-time junos:seconds="%d">%s</date-time>'
+          '</current-time><uptime>%d</uptime><model>MX960</model>'
+          '</system-uptime-information>')
+
+
+def test_normalized_output_hash_xml():
+    first = UPTIME % (1000, '2018-06-01 10:00:00', 5)
+    second = UPTIME % (2000, '2018-06-01 10:16:40', 1005)
+    assert common.normalized_output_hash('xml', first) != \
+        common.normalized_output_hash('xml', second)
+    ignore = ['//uptime', '//date-time/text()', '//date-time/@junos:seconds']
+    assert common.normalized_output_hash('xml', first, ignore) == \
+        common.normalized_output_hash('xml', second, ignore)
+    changed = first.replace('MX960', 'MX480')
+    assert common.normalized_output_hash('xml', first, ignore) != \
+        common.normalized_output_hash('xml', changed, ignore)
+
+
+def test_normalized_output_hash_ignores_attribute_order():
+    assert common.normalized_output_hash('xml', '<a x="1" y="2"/>', ['//b']) \
+        == common.normalized_output_hash('xml', '<a y="2" x="1"/>', ['//b'])
+
+
+def test_normalized_output_hash_text():
+    first = 'Current time: 10:00:00\nModel: MX960\n'
+    second = 'Current time: 10:16:40\nModel: MX960\n'
+    assert common.normalized_output_hash('text', first) != \
+        common.normalized_output_hash('text', second)
+    ignore = [r'^Current time: .*$']
+    assert common.normalized_output_hash('text', first, None, ignore) == \
+        common.normalized_output_hash('text', second, None, ignore)
+    assert common.normalized_output_hash('text', None) == \
+        common.normalized_output_hash('text', '')
+
+
+def cache_module(tmpdir, **params):
+    options = {'host': 'r1', 'port': 830, 'cache_dir': str(tmpdir),
+               'cache_ttl': 60, 'cache_size': 2}
+    options.update(params)
+    return FakeModule(options)
+
+
+def test_cache_round_trip(tmpdir):
+    module = cache_module(tmpdir)
+    assert module.get_cached_output(['rpc', 'a']) is None
+    module.set_cached_output(['rpc', 'a'], '<a/>', {'a': ''})
+    assert module.get_cached_output(['rpc', 'a']) == ('<a/>', {'a': ''})
+    # The key includes the host.
+    other = cache_module(tmpdir, host='r2')
+    assert other.get_cached_output(['rpc', 'a']) is None
+
+
+def test_cache_evicts_least_recently_used(tmpdir):
+    module = cache_module(tmpdir)
+    now = time.time()
+    module.set_cached_output(['rpc', 'a'], 'a', None)
+    os.utime(module._cache_file_path(['rpc', 'a']), (now - 100, now - 100))
+    module.set_cached_output(['rpc', 'b'], 'b', None)
+    os.utime(module._cache_file_path(['rpc', 'b']), (now - 50, now - 50))
+    # Reading 'a' makes it the most recently used entry.
+    assert module.get_cached_output(['rpc', 'a']) == ('a', None)
+    module.set_cached_output(['rpc', 'c'], 'c', None)
+    assert len(tmpdir.listdir()) == 2
+    assert module.get_cached_output(['rpc', 'b']) is None
+    assert module.get_cached_output(['rpc', 'a']) == ('a', None)
+    assert module.get_cached_output(['rpc', 'c']) == ('c', None)
+
+
+def test_cache_entries_expire(tmpdir, monkeypatch):
+    module = cache_module(tmpdir)
+    module.set_cached_output(['rpc', 'a'], 'a', None)
+    now = time.time()
+    monkeypatch.setattr(common.time, 'time', lambda: now + 59)
+    assert module.get_cached_output(['rpc', 'a']) == ('a', None)
+    monkeypatch.setattr(common.time, 'time', lambda: now + 61)
+    assert module.get_cached_output(['rpc', 'a']) is None
+
+
+def test_cache_disabled_without_cache_dir(tmpdir):
+    module = cache_module(tmpdir, cache_dir=None)
+    module.set_cached_output(['rpc', 'a'], 'a', None)
+    assert module.get_cached_output(['rpc', 'a']) is None
+    assert tmpdir.listdir() == []
+
+
+def test_save_output_object_directory_race(tmpdir, racing_makedirs):
+    module = FakeModule({'host': 'r1', 'dest_dir': str(tmpdir),
+                         'content_addressed': True})
+    data = b'<configuration/>'
+    digest = common.hashlib.sha256(data).hexdigest()
+    module._save_output_object(str(tmpdir.join('r1_config.xml')), data,
+                               None)
+    assert tmpdir.join('objects', digest[:2], digest).read_binary() == data
+
+
+def test_cache_directory_race(tmpdir, racing_makedirs):
+    module = cache_module(tmpdir.join('cache'))
+    module.set_cached_output(['rpc', 'a'], 'a', None)
+    assert module.get_cached_output(['rpc', 'a']) == ('a', None)
+
+
+def test_rpc_translations_directory_race(tmpdir, racing_makedirs):
+    module = FakeModule({})
+    module._rpc_translations_file = str(tmpdir.join('translations',
+                                                    'mx960.json'))
+    module._rpc_translations = {'show version': '<get-software/>'}
+    module._save_rpc_translations()
+    assert tmpdir.join('translations', 'mx960.json').check(file=True)
+
+
+def test_json_output_text_is_compact():
+    reply = {'a': [1, {'b': 'c'}]}
+    module = FakeModule({'return_output': True, 'json_output': 'raw'})
+    assert module.json_output_text('json', None, reply) == \
+        '{"a":[1,{"b":"c"}]}'
+    module = FakeModule({'return_output': True, 'json_output': 'parsed'})
+    assert module.json_output_text('json', None, reply) is None
+
+
+def test_select_from_xml_non_ascii_text():
+    root = etree.fromstring(u'<physical-interface description="Zürich">'
+                            u'<description>Zürich – uplink</description>'
+                            u'</physical-interface>'.encode('utf-8'))
+    select = {'attribute': '@description',
+              'text': 'description/text()',
+              'string': 'string(description)'}
+    assert common.select_from_xml(root, select) == {
+        'attribute': [u'Zürich'],
+        'text': [u'Zürich – uplink'],
+        'string': u'Zürich – uplink'}
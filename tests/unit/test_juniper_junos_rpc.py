@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017-2018, Juniper Networks Inc. All rights reserved.
+#
+# License: Apache 2.0
+#
+"""Unit tests for the helpers in library/juniper_junos_rpc.py."""
+
+from __future__ import absolute_import, division, print_function
+
+from lxml import etree
+
+from conftest import FakeModule, load_library_module
+
+rpc_module = load_library_module('juniper_junos_rpc')
+
+
+class FakeDevice(object):
+    timeout = 30
+
+    def rpc(self, rpc, **kwargs):
+        name = rpc.findtext('interface-name')
+        return etree.fromstring(
+            '<interface-information><physical-interface>'
+            '<name>%s</name><oper-status>up</oper-status>'
+            '</physical-interface></interface-information>' % name)
+
+
+def test_sample_rpcs_identifies_each_argument_set():
+    module = FakeModule({'samples': 2, 'sample_interval': 0,
+                         'deadline': None, 'reconnect_attempts': 0})
+    module.dev = FakeDevice()
+    sweep = [{'interface_name': 'ge-0/0/0'}, {'interface_name': 'ge-0/0/1'}]
+    select = {'name': 'physical-interface/name'}
+    results = [{'failed': True, 'failed_samples': 0,
+                'series': {'time': [], 'values': {'name': []}}}
+               for argset in sweep]
+    records = list(rpc_module.sample_rpcs(
+        module, results, ['get-interface-information'] * 2, ['xml'] * 2,
+        [dict(argset) for argset in sweep], [None] * 2,
+        [select] * 2, sweep, [None] * 2))
+    assert len(records) == 4
+    for record in records:
+        assert record['sweep'] == record['kwargs']
+        assert record['values'] == {
+            'name': [record['sweep']['interface_name']]}
+        assert record['attrs'] is None
+    for (result, argset) in zip(results, sweep):
+        assert result['failed'] is False
+        assert result['series']['values']['name'] == \
+            [[argset['interface_name']]] * 2
+
+
+def test_build_rpc_reuses_templates():
+    module = FakeModule({})
+    rpc_module._rpc_templates.clear()
+    first = rpc_module.build_rpc(module, 'get-interface-information', 'xml',
+                                 {'interface_name': 'ge-0/0/0',
+                                  'terse': True},
+                                 {'junos_format': 'text'})
+    second = rpc_module.build_rpc(module, 'get-interface-information', 'xml',
+                                  {'interface_name': 'ge-0/0/1',
+                                   'terse': True},
+                                  {'junos_format': 'text'})
+    assert len(rpc_module._rpc_templates) == 1
+    assert etree.tostring(first) == (
+        b'<get-interface-information format="xml" junos-format="text">'
+        b'<interface-name>ge-0/0/0</interface-name><terse/>'
+        b'</get-interface-information>')
+    assert second.findtext('interface-name') == 'ge-0/0/1'
+    assert first.findtext('interface-name') == 'ge-0/0/0'
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017-2018, Juniper Networks Inc. All rights reserved.
+#
+# License: Apache 2.0
+#
+"""Unit tests for the helpers in library/juniper_junos_table.py."""
+
+from __future__ import absolute_import, division, print_function
+
+from lxml import etree
+import pytest
+import yaml
+
+from conftest import FailJson, FakeModule, load_library_module
+
+table_module = load_library_module('juniper_junos_table')
+
+TABLES = """
+IfTable:
+  rpc: get-interface-information
+  item: physical-interface
+  key: name
+  view: IfView
+IfView:
+  fields:
+    status: oper-status
+    mtu: { mtu: int }
+    logical: LogicalTable
+LogicalTable:
+  item: logical-interface
+  key: name
+  view: LogicalView
+LogicalView:
+  fields:
+    family: address-family/address-family-name
+UnkeyedTable:
+  rpc: get-interface-information
+  item: physical-interface
+  key: Null
+  view: UnkeyedView
+UnkeyedView:
+  fields:
+    name: name
+    status: oper-status
+"""
+
+REPLY = """<interface-information>
+  <physical-interface>
+    <name>ge-0/0/0</name><oper-status>up</oper-status><mtu>1514</mtu>
+    <logical-interface>
+      <name>ge-0/0/0.0</name>
+      <address-family><address-family-name>inet</address-family-name>
+      </address-family>
+    </logical-interface>
+  </physical-interface>
+  <physical-interface>
+    <name>ge-0/0/1</name><oper-status>down</oper-status><mtu>1514</mtu>
+  </physical-interface>
+  <physical-interface>
+    <name>ge-0/0/2</name><oper-status>up</oper-status><mtu>9192</mtu>
+  </physical-interface>
+</interface-information>"""
+
+
+@pytest.fixture
+def module():
+    return FakeModule({})
+
+
+@pytest.fixture
+def tables(module):
+    loader = module.pyez_factory_loader.FactoryLoader()
+    return loader.load(yaml.safe_load(TABLES))
+
+
+def make_table(tables, name):
+    return tables[name](xml=etree.fromstring(REPLY))
+
+
+def test_list_of_dicts(module, tables):
+    data = make_table(tables, 'IfTable')
+    assert table_module.juniper_items_to_list_of_dicts(module, data) == [
+        {'status': 'up', 'mtu': 1514,
+         'logical': [{'family': 'inet'}]},
+        {'status': 'down', 'mtu': 1514, 'logical': []},
+        {'status': 'up', 'mtu': 9192, 'logical': []}]
+
+
+def test_list_of_dicts_pairs_items_with_keys(module, tables):
+    # Like PyEZ's Table.items(), a table without a key has no items.
+    data = make_table(tables, 'UnkeyedTable')
+    assert data.items() == []
+    assert table_module.juniper_items_to_list_of_dicts(module, data) == []
+
+
+def test_list_of_dicts_where(module, tables):
+    data = make_table(tables, 'IfTable')
+    where = [etree.XPath("oper-status = 'up'"), etree.XPath('mtu > 2000')]
+    result = table_module.juniper_items_to_list_of_dicts(module, data,
+                                                         where=where)
+    assert result == [{'status': 'up', 'mtu': 9192, 'logical': []}]
+
+
+def test_expand_items_matches_pyez(module, tables):
+    data = make_table(tables, 'IfTable')
+    expected = [(key, [(name, value) for (name, value) in fields
+                       if name != 'logical'])
+                for (key, fields) in data.items()]
+    result = [(key, [(name, value) for (name, value) in fields
+                     if name != 'logical'])
+              for (key, fields) in table_module.expand_items(module, data)]
+    assert result == expected
+
+
+def test_columns(module, tables):
+    data = make_table(tables, 'IfTable')
+    assert table_module.juniper_items_to_columns(module, data) == {
+        'keys': ['ge-0/0/0', 'ge-0/0/1', 'ge-0/0/2'],
+        'columns': {
+            'status': ['up', 'down', 'up'],
+            'mtu': [1514, 1514, 9192],
+            'logical': [{'keys': ['ge-0/0/0.0'],
+                         'columns': {'family': ['inet']}},
+                        {'keys': [], 'columns': {'family': []}},
+                        {'keys': [], 'columns': {'family': []}}]}}
+
+
+def test_columns_use_positions_without_keys(module, tables):
+    data = make_table(tables, 'UnkeyedTable')
+    where = [etree.XPath("oper-status = 'up'")]
+    result = table_module.juniper_items_to_columns(module, data,
+                                                   where=where)
+    assert result == {'keys': [0, 2],
+                      'columns': {'name': ['ge-0/0/0', 'ge-0/0/2'],
+                                  'status': ['up', 'up']}}
+
+
+def test_columns_positions_continue_across_chunks(module, tables):
+    # Each chunk's reply holds three items, so the second chunk's
+    # positions start from 3.
+    where = [etree.XPath("oper-status = 'up'")]
+    keys = []
+    for first_position in [0, 3]:
+        data = make_table(tables, 'UnkeyedTable')
+        part = table_module.convert_table(module, data, 'UnkeyedTable',
+                                          'columnar', where,
+                                          first_position=first_position)
+        keys.extend(part['keys'])
+    assert keys == [0, 2, 3, 5]
+
+
+def test_dictionary_encode_columns():
+    resource = {'keys': [0, 1, 2, 3],
+                'columns': {
+                    'status': ['up', 'up', 'down', 'up'],
+                    'name': ['a', 'b', 'c', 'd'],
+                    'sub': [{'keys': [0, 1],
+                             'columns': {'family': ['inet', 'inet']}},
+                            None, None, None]}}
+    table_module.dictionary_encode_columns(resource)
+    columns = resource['columns']
+    assert columns['status'] == {'dictionary': ['up', 'down'],
+                                 'codes': [0, 0, 1, 0]}
+    assert columns['name'] == ['a', 'b', 'c', 'd']
+    assert columns['sub'] == [{'keys': [0, 1],
+                               'columns': {'family': {
+                                   'dictionary': ['inet'],
+                                   'codes': [0, 0]}}},
+                              None, None, None]
+
+
+@pytest.mark.parametrize('values,expected', [
+    (['a', 'b', 'a', 'a'], {'dictionary': ['a', 'b'], 'codes': [0, 1, 0, 0]}),
+    ([True, 1, True, 1], {'dictionary': [True, 1], 'codes': [0, 1, 0, 1]}),
+    (['a', 'b', 'c'], ['a', 'b', 'c']),
+    ([[1], [1]], [[1], [1]]),
+    ([], {'dictionary': [], 'codes': []}),
+])
+def test_dictionary_encode(values, expected):
+    assert table_module.dictionary_encode(values) == expected
+
+
+def test_snapshot_delta():
+    old_rows = {'a': {'status': 'up'}, 'b': {'status': 'up'},
+                'c': {'status': 'up'}}
+    new_rows = {'a': {'status': 'up'}, 'b': {'status': 'down'},
+                'd': {'status': 'up'}}
+    (delta, counts) = table_module.snapshot_delta(old_rows, new_rows)
+    assert delta == {'added': {'d': {'status': 'up'}},
+                     'removed': {'c': {'status': 'up'}},
+                     'changed': {'b': {'status': 'down'}}}
+    assert counts == {'added': 1, 'removed': 1, 'changed': 1,
+                      'unchanged': 1}
+
+
+def test_snapshot_round_trip(module, tmpdir):
+    module.params.update({'host': 'r1', 'snapshot_dir': str(tmpdir)})
+    file_path = table_module.snapshot_file_path(module, 'IfTable')
+    assert table_module.load_snapshot(module, file_path) == {}
+    rows = {'ge-0/0/0': {'status': 'up', 'mtu': 1514}}
+    table_module.save_snapshot(module, file_path, 'IfTable', rows)
+    assert table_module.load_snapshot(module, file_path) == rows
+    assert tmpdir.listdir() == [tmpdir.join(file_path.split('/')[-1])]
+
+
+def test_snapshot_file_path_depends_on_selection(module):
+    module.params.update({'host': 'r1', 'snapshot_dir': '/snapshots'})
+    paths = set()
+    for params in [{},
+                   {'kwargs': {'interface_name': 'ge-0/0/0'}},
+                   {'chunks': [{'interface_name': 'ge-0/0/1'}]},
+                   {'where': ["oper-status = 'up'"]},
+                   {'fields': ['status']}]:
+        module.params.update({'kwargs': None, 'chunks': None,
+                              'where': None, 'fields': None})
+        module.params.update(params)
+        path = table_module.snapshot_file_path(module, 'IfTable')
+        assert path.startswith('/snapshots/r1_IfTable_')
+        paths.add(path)
+    assert len(paths) == 5
+    module.params['fields'] = ['status', 'mtu']
+    first = table_module.snapshot_file_path(module, 'IfTable')
+    module.params['fields'] = ['mtu', 'status']
+    assert table_module.snapshot_file_path(module, 'IfTable') == first
+
+
+def test_load_table_definitions_from_cache_dir(module, tmpdir):
+    yml = tmpdir.join('interfaces.yml')
+    yml.write(TABLES)
+    cache_dir = tmpdir.join('cache')
+    module.params['cache_dir'] = str(cache_dir)
+    table_module._table_definitions.clear()
+    expected = yaml.safe_load(TABLES)
+    assert table_module.load_table_definitions(module, str(yml)) == expected
+    assert len(cache_dir.join('tables').listdir()) == 1
+    # A new task starts with empty module-level caches, and loads the
+    # definitions saved in cache_dir.
+    table_module._table_definitions.clear()
+    cache_dir.join('tables').listdir()[0].write(
+        '{"IfTable": {"from": "cache"}}')
+    assert table_module.load_table_definitions(module, str(yml)) == \
+        {'IfTable': {'from': 'cache'}}
+
+
+def test_load_table_builds_the_dependencies(module, tmpdir):
+    yml = tmpdir.join('interfaces.yml')
+    yml.write(TABLES)
+    table_view = yaml.safe_load(TABLES)
+    assert sorted(table_module.table_dependencies(table_view, 'IfTable')) == \
+        ['IfTable', 'IfView', 'LogicalTable', 'LogicalView']
+    table_class = table_module.load_table(module, str(yml), table_view,
+                                          'IfTable')
+    data = table_class(xml=etree.fromstring(REPLY))
+    assert data.keys() == ['ge-0/0/0', 'ge-0/0/1', 'ge-0/0/2']
+    assert table_module.load_table(module, str(yml), table_view,
+                                   'IfTable') is table_class
+
+
+VIEW_TABLES = """
+RouteTable:
+  rpc: get-route-information
+  item: route-table/rt
+  key: rt-destination
+  view: RouteView
+RouteView:
+  groups:
+    entry: rt-entry
+  fields_entry:
+    protocol: protocol-name
+    active: { active-tag: flag }
+    preference: { preference: int }
+    via: nh/via
+    missing: age
+  fields:
+    destination: rt-destination
+"""
+
+ROUTES = """<route-information><route-table>
+  <rt><rt-destination>10.0.0.0/24</rt-destination>
+    <rt-entry><active-tag>*</active-tag><protocol-name>Static
+      </protocol-name><preference>5</preference>
+      <nh><via>ge-0/0/0.0</via></nh><nh><via>ge-0/0/1.0</via></nh>
+    </rt-entry></rt>
+  <rt><rt-destination>10.0.1.0/24</rt-destination>
+    <rt-entry><protocol-name>Direct</protocol-name>
+      <preference>0</preference><nh><via>ge-0/0/2.0</via></nh>
+    </rt-entry></rt>
+  <rt><rt-destination>10.0.2.0/24</rt-destination></rt>
+</route-table></route-information>"""
+
+
+def test_compiled_view_matches_pyez(module):
+    loader = module.pyez_factory_loader.FactoryLoader()
+    tables = loader.load(yaml.safe_load(VIEW_TABLES))
+    data = tables['RouteTable'](xml=etree.fromstring(ROUTES))
+    compiled = table_module.compile_view(module, data.view)
+    assert table_module.compile_view(module, data.view) is compiled
+    elements = table_module.table_elements(data)
+    assert len(elements) == 3
+    for (element, view) in zip(elements, data):
+        values = table_module.extract_fields(data, compiled, element)
+        assert values == [(name, getattr(view, name))
+                          for (name, _) in values]
+    first = dict(table_module.extract_fields(data, compiled, elements[0]))
+    assert first['via'] == ['ge-0/0/0.0', 'ge-0/0/1.0']
+    assert first['active'] is True
+    assert first['preference'] == 5
+    assert first['protocol'] == 'Static'
+    last = dict(table_module.extract_fields(data, compiled, elements[2]))
+    assert last['protocol'] is None
+
+
+def test_compiled_view_shares_compiled_xpaths(module, tables):
+    data = make_table(tables, 'IfTable')
+    (groups, fields) = table_module.compile_view(module, data.view)
+    status = [field for field in fields if field[0] == 'status'][0]
+    assert status[1] is \
+        table_module.juniper_junos_common.compile_xpath('oper-status')
+
+
+GROUP_TABLES = """
+UpTable:
+  rpc: get-interface-information
+  args:
+    terse: True
+  item: physical-interface
+  view: UpView
+UpView:
+  fields:
+    status: oper-status
+NameTable:
+  rpc: get-interface-information
+  args:
+    terse: True
+  item: physical-interface
+  view: NameView
+NameView:
+  fields:
+    name: name
+DetailTable:
+  rpc: get-interface-information
+  args:
+    detail: True
+  item: physical-interface
+  view: NameView
+RouteTable:
+  rpc: get-route-information
+  item: route-table/rt
+  key: rt-destination
+  view: RouteView
+RouteView:
+  fields:
+    destination: rt-destination
+"""
+
+
+@pytest.fixture
+def group_classes(module):
+    loader = module.pyez_factory_loader.FactoryLoader()
+    classes = loader.load(yaml.safe_load(GROUP_TABLES))
+    return [classes[name] for name in ['UpTable', 'RouteTable', 'NameTable',
+                                       'DetailTable']]
+
+
+def test_group_tables_by_rpc_and_args(group_classes):
+    assert table_module.group_tables(group_classes, {}) == \
+        [[0, 2], [1], [3]]
+
+
+def test_group_tables_with_kwargs(group_classes):
+    # kwargs apply to every table, so they do not split groups.
+    assert table_module.group_tables(
+        group_classes, {'interface_name': 'ge-0/0/0'}) == [[0, 2], [1], [3]]
+    # An args dict is merged with each table's default args, so UpTable
+    # and NameTable get terse and detail, and DetailTable only detail.
+    assert table_module.group_tables(
+        group_classes, {'args': {'detail': True}}) == [[0, 2], [1], [3]]
+    assert table_module.group_tables(
+        group_classes, {'args': {'terse': True, 'detail': True}}) == \
+        [[0, 2, 3], [1]]
+
+
+def test_group_tables_use_filter(group_classes):
+    assert table_module.group_tables(group_classes, {}, use_filter=True) == \
+        [[0], [1], [2], [3]]
+
+
+def test_keyed_dicts(module, tables):
+    data = make_table(tables, 'IfTable')
+    where = [etree.XPath("oper-status = 'up'")]
+    rows = table_module.juniper_items_to_keyed_dicts(module, data, where)
+    assert rows == [('ge-0/0/0', {'status': 'up', 'mtu': 1514,
+                                  'logical': [{'family': 'inet'}]}),
+                    ('ge-0/0/2', {'status': 'up', 'mtu': 9192,
+                                  'logical': []})]
+
+
+def test_keyed_dicts_require_a_key(module, tables):
+    data = make_table(tables, 'UnkeyedTable')
+    with pytest.raises(ValueError):
+        table_module.juniper_items_to_keyed_dicts(module, data)
+
+
+@pytest.mark.parametrize('table_key,expected', [
+    ('ge-0/0/0', 'ge-0/0/0'),
+    (('inet.0', '10.0.0.0/24'), 'inet.0|10.0.0.0/24'),
+    (('inet.0', None), 'inet.0|'),
+    (5, '5'),
+    (u'Zürich', u'Zürich'),
+    ((u'Zürich', u'ge-0/0/0'), u'Zürich|ge-0/0/0'),
+])
+def test_table_key_string(table_key, expected):
+    assert table_module.table_key_string(table_key) == expected
+
+
+def test_rows_by_key_keeps_the_last_duplicate(module):
+    rows = table_module.rows_by_key(module, 'IfTable',
+                                    [('a', {'n': 1}), ('b', {'n': 2}),
+                                     ('a', {'n': 3})])
+    assert rows == {'a': {'n': 3}, 'b': {'n': 2}}
+
+
+def test_secondary_indexes():
+    rows = {'ge-0/0/0': {'status': 'up', 'mtu': 1514, 'vlans': [10, 20],
+                         'up': True, 'logical': [{'family': 'inet'}]},
+            'ge-0/0/1': {'status': 'down', 'mtu': 1514, 'vlans': [20],
+                         'up': False, 'logical': []},
+            'ge-0/0/2': {'status': 'up', 'mtu': None, 'vlans': [],
+                         'up': True, 'logical': []}}
+    indexes = table_module.secondary_indexes(
+        rows, ['status', 'mtu', 'vlans', 'up', 'logical'])
+    for index in indexes.values():
+        for keys in index.values():
+            keys.sort()
+    assert indexes == {
+        'status': {'up': ['ge-0/0/0', 'ge-0/0/2'], 'down': ['ge-0/0/1']},
+        'mtu': {'1514': ['ge-0/0/0', 'ge-0/0/1'], 'null': ['ge-0/0/2']},
+        'vlans': {'10': ['ge-0/0/0'], '20': ['ge-0/0/0', 'ge-0/0/1']},
+        'up': {'true': ['ge-0/0/0', 'ge-0/0/2'], 'false': ['ge-0/0/1']},
+        'logical': {}}
+
+
+def test_project_table(module, tables):
+    projected = table_module.project_table(module, tables['IfTable'],
+                                           'IfTable', ['mtu', 'status'])
+    assert tables['IfTable'].VIEW.FIELDS['logical']
+    data = projected(xml=etree.fromstring(REPLY))
+    assert table_module.juniper_items_to_list_of_dicts(module, data) == [
+        {'status': 'up', 'mtu': 1514},
+        {'status': 'down', 'mtu': 1514},
+        {'status': 'up', 'mtu': 9192}]
+
+
+def test_project_table_unknown_field(module, tables):
+    with pytest.raises(FailJson) as error:
+        table_module.project_table(module, tables['IfTable'], 'IfTable',
+                                   ['speed'])
+    assert 'speed' in str(error.value)
+
+
+def test_save_snapshot_directory_race(module, tmpdir, racing_makedirs):
+    module.params.update({'host': 'r1',
+                          'snapshot_dir': str(tmpdir.join('snapshots'))})
+    file_path = table_module.snapshot_file_path(module, 'IfTable')
+    rows = {'ge-0/0/0': {'status': 'up'}}
+    table_module.save_snapshot(module, file_path, 'IfTable', rows)
+    assert table_module.load_snapshot(module, file_path) == rows
+
+
+def test_save_table_definitions_directory_race(module, tmpdir,
+                                               racing_makedirs):
+    cache_file = str(tmpdir.join('cache', 'tables', 'interfaces.json'))
+    table_view = yaml.safe_load(TABLES)
+    table_module.save_table_definitions(module, cache_file, table_view)
+    assert tmpdir.join('cache', 'tables', 'interfaces.json').check(
+        file=True)